@@ -9,12 +9,23 @@
 import os
 import io
 import json
+import base64
+import codecs
+import hashlib
+import functools
 import math
 import csv
 import re
+import time
+import uuid
+import tempfile
+import threading
+import zipfile
+import multiprocessing
+from collections import OrderedDict
 import httpx
-from datetime import datetime, date, timedelta
-from flask import Flask, request, jsonify, Response, send_from_directory
+from datetime import datetime, date, timedelta, timezone
+from flask import Flask, request, jsonify, Response, send_from_directory, g, has_app_context, stream_with_context
 from flask_cors import CORS
 
 # ── Banco de Dados ──────────────────────────────────────────
@@ -37,66 +48,549 @@ CORS(app)
 _dir = os.path.dirname(os.path.abspath(__file__))
 STATIC_DIR = os.path.normpath(os.path.join(_dir, '..'))
 
+# Processo do pool de leitura de ZIP (forkserver/spawn): importa este módulo
+# só pelas funções de leitura, sem migrar o banco nem iniciar threads
+PROCESSO_AUXILIAR = multiprocessing.parent_process() is not None
+
 # ============================================================
 # CONEXÃO COM O BANCO
 # ============================================================
+# Pool de conexões por processo: uma instância "quente" da Vercel reaproveita
+# as conexões já abertas em vez de refazer o handshake (TLS no Turso) a cada
+# instrução SQL. Dentro de uma requisição todas as chamadas a query()/execute()/
+# execute_many() usam a mesma conexão, devolvida ao pool no teardown.
 
-def get_db():
-    """Retorna conexão com Turso (produção) ou SQLite local (dev)."""
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', '4'))                # conexões ociosas guardadas
+DB_POOL_IDLE_SECONDS = float(os.environ.get('DB_POOL_IDLE_SECONDS', '300'))  # descarta após ociosidade
+DB_POOL_CHECK_SECONDS = float(os.environ.get('DB_POOL_CHECK_SECONDS', '30'))  # health check se ociosa há mais
+
+_pool = []  # [(conn, ultimo_uso)] — LIFO, a mais recente no fim
+_pool_lock = threading.Lock()
+_pool_stats = {'criadas': 0, 'reutilizadas': 0, 'descartadas': 0, 'reconexoes': 0}
+
+
+def _contar_pool(chave):
+    """Incrementa um contador do pool (o servidor atende em várias threads)."""
+    with _pool_lock:
+        _pool_stats[chave] += 1
+
+
+def _abrir_conexao():
+    """Abre uma conexão nova com Turso (produção) ou SQLite local (dev)."""
     if USE_TURSO:
         url = os.environ.get("TURSO_DATABASE_URL", "")
         token = os.environ.get("TURSO_AUTH_TOKEN", "")
         conn = libsql.connect(url, auth_token=token)
-        return conn
     else:
-        conn = sqlite3.connect("local.db")
+        # check_same_thread=False: a conexão pode ser devolvida ao pool e
+        # reutilizada por outra thread do servidor (nunca por duas ao mesmo tempo).
+        conn = sqlite3.connect("local.db", check_same_thread=False)
         conn.row_factory = sqlite3.Row
-        return conn
+    _contar_pool('criadas')
+    return conn
 
 
-def query(sql, params=None):
-    """SELECT → retorna lista de dicts."""
-    conn = get_db()
+def _descartar(conn):
+    """Fecha uma conexão que não volta mais para o pool."""
+    _contar_pool('descartadas')
     try:
-        cursor = conn.execute(sql, tuple(params or []))
-        if cursor.description:
-            cols = [d[0] for d in cursor.description]
-            return [dict(zip(cols, row)) for row in cursor.fetchall()]
-        return []
-    finally:
+        conn.close()
+    except Exception:
+        pass
+
+
+def _conexao_ok(conn):
+    """Health check barato: a conexão ainda responde?"""
+    try:
+        conn.execute("SELECT 1").fetchall()
+        return True
+    except Exception:
+        return False
+
+
+def _pool_checkout():
+    """Retira uma conexão saudável do pool ou abre uma nova."""
+    agora = time.monotonic()
+    while True:
+        vencidas = []
+        conn = None
+        with _pool_lock:
+            # Despejar as ociosas há muito tempo (ficam no início da lista)
+            while _pool and agora - _pool[0][1] > DB_POOL_IDLE_SECONDS:
+                vencidas.append(_pool.pop(0)[0])
+            if _pool:
+                conn, ultimo_uso = _pool.pop()
+        for velha in vencidas:
+            _descartar(velha)  # fora do lock: _descartar também conta sob o lock
+        if conn is None:
+            break
+        if agora - ultimo_uso > DB_POOL_CHECK_SECONDS and not _conexao_ok(conn):
+            _descartar(conn)
+            continue
+        _contar_pool('reutilizadas')
+        return conn
+    return _abrir_conexao()
+
+
+def _pool_checkin(conn):
+    """Devolve a conexão ao pool (ou fecha, se o pool estiver cheio)."""
+    if getattr(conn, 'in_transaction', True):
         try:
-            conn.close()
+            conn.rollback()
         except Exception:
-            pass
+            _descartar(conn)
+            return
+    with _pool_lock:
+        if len(_pool) < DB_POOL_MAX:
+            _pool.append((conn, time.monotonic()))
+            return
+    _descartar(conn)
+
+
+def get_db():
+    """Retorna a conexão da requisição atual (checkout do pool na primeira chamada).
+    Fora de uma requisição (ex.: init_db), retorna uma conexão avulsa do pool,
+    que deve ser devolvida com release_db()."""
+    if has_app_context():
+        conn = g.get('_db_conn')
+        if conn is None:
+            conn = _pool_checkout()
+            g._db_conn = conn
+        return conn
+    return _pool_checkout()
+
+
+def release_db(conn):
+    """Devolve ao pool uma conexão obtida fora de requisição."""
+    if has_app_context() and g.get('_db_conn') is conn:
+        return  # devolvida no teardown da requisição
+    _pool_checkin(conn)
+
+
+def _invalidar_conexao(conn):
+    """Remove uma conexão quebrada da requisição e fecha."""
+    if has_app_context() and g.get('_db_conn') is conn:
+        g.pop('_db_conn', None)
+    _descartar(conn)
+
+
+@app.teardown_appcontext
+def _devolver_conexao(exc):
+    conn = g.pop('_db_conn', None)
+    if conn is not None:
+        _pool_checkin(conn)
+
+
+def _com_conexao(operacao):
+    """Executa operacao(conn). Se a conexão caiu (falha no health check),
+    reconecta e tenta uma única vez mais; erros de SQL sobem normalmente."""
+    for tentativa in (1, 2):
+        conn = get_db()
+        try:
+            resultado = operacao(conn)
+        except Exception as e:
+            if tentativa == 2 or isinstance(e, BatchError) or _conexao_ok(conn):
+                try:
+                    conn.rollback()
+                except Exception:
+                    pass
+                release_db(conn)
+                raise
+            _invalidar_conexao(conn)
+            _contar_pool('reconexoes')
+            continue
+        release_db(conn)
+        return resultado
+
+
+# ── Réplica embutida do Turso (leituras locais) ─────────────
+# Com TURSO_REPLICA_PATH definido, query() lê de um arquivo libSQL local
+# sincronizado com o primário; execute()/execute_many() continuam indo ao
+# primário. A réplica é sincronizada antes da leitura quando passou de
+# TURSO_REPLICA_MAX_STALENESS segundos ou quando houve escrita neste processo
+# (read-your-writes). Na mesma requisição, após uma escrita, as leituras vão
+# direto ao primário.
+
+TURSO_REPLICA_PATH = os.environ.get('TURSO_REPLICA_PATH', '').strip()
+USE_REPLICA = USE_TURSO and bool(TURSO_REPLICA_PATH)
+REPLICA_MAX_STALENESS = float(os.environ.get('TURSO_REPLICA_MAX_STALENESS', '15'))
+REPLICA_SYNC_INTERVAL = float(os.environ.get('TURSO_REPLICA_SYNC_INTERVAL', '0'))  # 0 = só sob demanda
+
+_replica_conn = None
+_replica_lock = threading.Lock()
+_replica_estado = {'ultima_sync': 0.0, 'sujo': True, 'syncs': 0, 'falhas': 0, 'leituras': 0}
+
+
+def _linhas(cursor):
+    """Converte o resultado de um cursor em lista de dicts."""
+    if cursor.description:
+        cols = [d[0] for d in cursor.description]
+        return [dict(zip(cols, row)) for row in cursor.fetchall()]
+    return []
+
+
+def _replica_sync_locked():
+    """Sincroniza a réplica com o primário (chamar com _replica_lock)."""
+    global _replica_conn
+    if _replica_conn is None:
+        _replica_conn = libsql.connect(
+            TURSO_REPLICA_PATH,
+            sync_url=os.environ.get("TURSO_DATABASE_URL", ""),
+            auth_token=os.environ.get("TURSO_AUTH_TOKEN", ""),
+        )
+    _replica_estado['sujo'] = False  # escritas durante o sync remarcam
+    _replica_conn.sync()
+    _replica_estado['ultima_sync'] = time.monotonic()
+    _replica_estado['syncs'] += 1
+
+
+def _replica_desatualizada():
+    idade = time.monotonic() - _replica_estado['ultima_sync']
+    return _replica_estado['sujo'] or idade > REPLICA_MAX_STALENESS
+
+
+def sincronizar_replica(forcar=False):
+    """Sincroniza a réplica se estiver além do limite de defasagem (ou sempre, com forcar)."""
+    global _replica_conn
+    if not USE_REPLICA:
+        return False
+    with _replica_lock:
+        try:
+            if forcar or _replica_desatualizada():
+                _replica_sync_locked()
+            return True
+        except Exception as e:
+            print(f"[replica] Erro ao sincronizar: {e}")
+            _replica_estado['falhas'] += 1
+            _replica_estado['sujo'] = True
+            _replica_conn = None
+            return False
+
+
+def _sync_periodico():
+    while True:
+        time.sleep(REPLICA_SYNC_INTERVAL)
+        sincronizar_replica(forcar=True)
+
+
+def _marcar_escrita():
+    """Registra uma escrita no primário para garantir read-your-writes."""
+    _replica_estado['sujo'] = True
+    _versao_cache['lido_em'] = 0.0
+    if has_app_context():
+        g._escreveu = True
+    _notificar_monitor()
+
+
+def _query_replica(sql, params):
+    """Lê da réplica local; retorna None se a réplica não puder atender."""
+    if not sincronizar_replica():
+        return None
+    with _replica_lock:
+        try:
+            rows = _linhas(_replica_conn.execute(sql, tuple(params or [])))
+        except Exception as e:
+            print(f"[replica] Erro na leitura, usando primário: {e}")
+            _replica_estado['falhas'] += 1
+            return None
+    _replica_estado['leituras'] += 1
+    return rows
+
+
+if USE_REPLICA and REPLICA_SYNC_INTERVAL > 0 and not PROCESSO_AUXILIAR:
+    threading.Thread(target=_sync_periodico, daemon=True).start()
+
+
+def query(sql, params=None, primario=False):
+    """SELECT → retorna lista de dicts.
+    primario=True ignora a réplica (leituras que antecedem uma escrita)."""
+    if USE_REPLICA and not primario and not (has_app_context() and g.get('_escreveu')):
+        rows = _query_replica(sql, params)
+        if rows is not None:
+            return rows
+    return _com_conexao(lambda conn: _linhas(conn.execute(sql, tuple(params or []))))
 
 
 def execute(sql, params=None):
     """INSERT / UPDATE / DELETE → retorna lastrowid."""
-    conn = get_db()
-    try:
+    def _op(conn):
         cursor = conn.execute(sql, tuple(params or []))
         conn.commit()
         return cursor.lastrowid
-    finally:
+    lastrowid = _com_conexao(_op)
+    _marcar_escrita()
+    return lastrowid
+
+
+class BatchError(Exception):
+    """Falha em uma instrução de execute_many(); o lote inteiro foi desfeito."""
+
+    def __init__(self, indice, sql, mensagem):
+        super().__init__(f"instrução {indice}: {mensagem}")
+        self.indice = indice
+        self.sql = sql
+        self.mensagem = mensagem
+
+
+# ── Lote em uma única ida ao Turso (Hrana pipeline) ─────────
+# libsql_experimental envia cada execute() separadamente; o endpoint HTTP
+# /v2/pipeline aceita BEGIN + N instruções + COMMIT em um só request.
+
+_turso_http = None
+
+
+def _turso_http_client():
+    """Cliente HTTP reaproveitado entre requisições (mantém a conexão TLS)."""
+    global _turso_http
+    if _turso_http is None:
+        _turso_http = httpx.Client(timeout=30.0)
+    return _turso_http
+
+
+def _turso_pipeline_url():
+    url = os.environ.get("TURSO_DATABASE_URL", "").strip()
+    if url.startswith('libsql://'):
+        url = 'https://' + url[len('libsql://'):]
+    return url.rstrip('/') + '/v2/pipeline'
+
+
+def _hrana_valor(v):
+    """Converte um parâmetro Python para o formato de valor do Hrana."""
+    if v is None:
+        return {'type': 'null'}
+    if isinstance(v, bool):
+        return {'type': 'integer', 'value': str(int(v))}
+    if isinstance(v, int):
+        return {'type': 'integer', 'value': str(v)}
+    if isinstance(v, float):
+        return {'type': 'float', 'value': v}
+    if isinstance(v, (bytes, bytearray)):
+        return {'type': 'blob', 'base64': base64.b64encode(bytes(v)).decode('ascii')}
+    return {'type': 'text', 'value': str(v)}
+
+
+def _turso_batch(statements):
+    """Executa o lote no Turso em um único round-trip, dentro de uma transação."""
+    n = len(statements)
+    steps = [{'stmt': {'sql': 'BEGIN'}}]
+    for i, (sql, params) in enumerate(statements):
+        steps.append({
+            'stmt': {'sql': sql, 'args': [_hrana_valor(v) for v in (params or [])]},
+            'condition': {'type': 'ok', 'step': i},
+        })
+    steps.append({'stmt': {'sql': 'COMMIT'}, 'condition': {'type': 'ok', 'step': n}})
+    steps.append({'stmt': {'sql': 'ROLLBACK'},
+                  'condition': {'type': 'not', 'cond': {'type': 'ok', 'step': n + 1}}})
+
+    resp = _turso_http_client().post(
+        _turso_pipeline_url(),
+        headers={'Authorization': f'Bearer {os.environ.get("TURSO_AUTH_TOKEN", "")}'},
+        json={'requests': [{'type': 'batch', 'batch': {'steps': steps}}, {'type': 'close'}]},
+    )
+    resp.raise_for_status()
+    resultado = resp.json()['results'][0]
+    if resultado.get('type') != 'ok':
+        raise BatchError(-1, None, resultado.get('error', {}).get('message', 'erro no pipeline'))
+
+    batch = resultado['response']['result']
+    for i, erro in enumerate(batch['step_errors'][:n + 2]):
+        if erro:
+            indice = i - 1  # passo 0 é o BEGIN
+            sql = statements[indice][0] if 0 <= indice < n else None
+            raise BatchError(indice, sql, erro.get('message', ''))
+
+    saida = []
+    for r in batch['step_results'][1:n + 1]:
+        rowid = r.get('last_insert_rowid')
+        saida.append({
+            'linhas_afetadas': r.get('affected_row_count', 0),
+            'lastrowid': int(rowid) if rowid is not None else None,
+        })
+    return saida
+
+
+def _sqlite_batch(conn, statements):
+    """Equivalente local: todas as instruções em uma transação explícita."""
+    saida = []
+    for i, (sql, params) in enumerate(statements):
         try:
-            conn.close()
-        except Exception:
-            pass
+            cursor = conn.execute(sql, tuple(params or []))
+        except Exception as e:
+            conn.rollback()
+            if not _conexao_ok(conn):
+                raise  # conexão caiu: _com_conexao reconecta e repete o lote
+            raise BatchError(i, sql, str(e))
+        saida.append({'linhas_afetadas': cursor.rowcount, 'lastrowid': cursor.lastrowid})
+    conn.commit()
+    return saida
 
 
 def execute_many(statements):
-    """Executa múltiplas instruções em uma transação."""
-    conn = get_db()
-    try:
-        for sql, params in statements:
-            conn.execute(sql, tuple(params or []))
-        conn.commit()
-    finally:
-        try:
-            conn.close()
-        except Exception:
-            pass
+    """Executa múltiplas instruções em uma transação, em uma única ida ao banco.
+    Retorna [{linhas_afetadas, lastrowid}] por instrução; se alguma falhar,
+    nada é gravado e BatchError informa o índice da instrução."""
+    statements = list(statements)
+    if not statements:
+        return []
+    if USE_TURSO:
+        saida = _turso_batch(statements)
+    else:
+        saida = _com_conexao(lambda conn: _sqlite_batch(conn, statements))
+    _marcar_escrita()
+    return saida
+
+
+# ============================================================
+# CALENDÁRIO PEDAGÓGICO 2026 — Estado de São Paulo (SEDUC-SP)
+# ============================================================
+
+CALENDARIO_PEDAGOGICO_2026 = {
+    "ano": 2026,
+    "inicio_aulas": "2026-02-02",
+    "fim_aulas": "2026-12-17",
+    "total_dias_letivos": 200,
+    "bimestres": [
+        {"bimestre": 1, "inicio": "2026-02-02", "fim": "2026-04-22", "dias_letivos": 55},
+        {"bimestre": 2, "inicio": "2026-04-23", "fim": "2026-07-09", "dias_letivos": 50},
+        {"bimestre": 3, "inicio": "2026-07-24", "fim": "2026-10-02", "dias_letivos": 50},
+        {"bimestre": 4, "inicio": "2026-10-05", "fim": "2026-12-17", "dias_letivos": 45},
+    ],
+    "feriados": [
+        {"data": "2026-01-01", "descricao": "Confraternização Universal"},
+        {"data": "2026-01-25", "descricao": "Aniversário de São Paulo"},
+        {"data": "2026-02-16", "descricao": "Carnaval (Ponto Facultativo)"},
+        {"data": "2026-02-17", "descricao": "Carnaval"},
+        {"data": "2026-02-18", "descricao": "Quarta-feira de Cinzas (Ponto Facultativo)"},
+        {"data": "2026-04-02", "descricao": "Paixão de Cristo"},
+        {"data": "2026-04-21", "descricao": "Tiradentes"},
+        {"data": "2026-05-01", "descricao": "Dia do Trabalho"},
+        {"data": "2026-06-04", "descricao": "Corpus Christi"},
+        {"data": "2026-06-05", "descricao": "Ponto Facultativo (Corpus Christi)"},
+        {"data": "2026-09-07", "descricao": "Independência do Brasil"},
+        {"data": "2026-10-12", "descricao": "Nossa Senhora Aparecida / Dia das Crianças"},
+        {"data": "2026-11-02", "descricao": "Finados"},
+        {"data": "2026-11-15", "descricao": "Proclamação da República"},
+        {"data": "2026-11-20", "descricao": "Dia da Consciência Negra"},
+        {"data": "2026-12-25", "descricao": "Natal"},
+    ],
+    "recessos": [
+        {"inicio": "2026-01-01", "fim": "2026-01-31", "descricao": "Recesso/Planejamento de Janeiro"},
+        {"inicio": "2026-07-10", "fim": "2026-07-23", "descricao": "Recesso Escolar de Julho"},
+        {"inicio": "2026-12-18", "fim": "2026-12-31", "descricao": "Recesso de Dezembro"},
+    ],
+    "avaliacoes": [
+        {"inicio": "2026-03-16", "fim": "2026-03-27", "descricao": "AAP 1 — Avaliação de Aprendizagem em Processo", "bimestre": 1},
+        {"inicio": "2026-05-18", "fim": "2026-05-29", "descricao": "AAP 2 — Avaliação de Aprendizagem em Processo", "bimestre": 2},
+        {"inicio": "2026-08-17", "fim": "2026-08-28", "descricao": "AAP 3 — Avaliação de Aprendizagem em Processo", "bimestre": 3},
+        {"inicio": "2026-10-19", "fim": "2026-10-30", "descricao": "AAP 4 — Avaliação de Aprendizagem em Processo", "bimestre": 4},
+    ],
+    "conselhos": [
+        {"inicio": "2026-04-20", "fim": "2026-04-22", "descricao": "Conselho de Classe/Série — 1º Bimestre"},
+        {"inicio": "2026-07-07", "fim": "2026-07-09", "descricao": "Conselho de Classe/Série — 2º Bimestre"},
+        {"inicio": "2026-09-30", "fim": "2026-10-02", "descricao": "Conselho de Classe/Série — 3º Bimestre"},
+        {"inicio": "2026-12-15", "fim": "2026-12-17", "descricao": "Conselho de Classe/Série — 4º Bimestre"},
+    ],
+    "reunioes_pais": [
+        {"data": "2026-02-06", "descricao": "Reunião de Pais e Mestres — Acolhimento"},
+        {"data": "2026-05-08", "descricao": "Reunião de Pais e Mestres — 1º Bimestre"},
+        {"data": "2026-08-07", "descricao": "Reunião de Pais e Mestres — 2º Bimestre"},
+        {"data": "2026-10-16", "descricao": "Reunião de Pais e Mestres — 3º Bimestre"},
+    ],
+    "replanejamentos": [
+        {"data": "2026-02-02", "descricao": "Planejamento Escolar — Início do Ano"},
+        {"data": "2026-07-24", "descricao": "Replanejamento — Início do 2º Semestre"},
+    ],
+    "olimpiadas": [
+        {"inicio": "2026-03-02", "fim": "2026-03-13", "descricao": "Olimpíada Brasileira de Matemática (OBMEP) — 1ª Fase"},
+        {"inicio": "2026-06-01", "fim": "2026-06-12", "descricao": "Olimpíada de Língua Portuguesa"},
+        {"inicio": "2026-09-14", "fim": "2026-09-25", "descricao": "OBMEP — 2ª Fase"},
+    ],
+    "provao_paulista": [
+        {"inicio": "2026-10-26", "fim": "2026-11-06", "descricao": "Provão Paulista — Fase Única (3ª Série)"},
+    ],
+}
+
+
+# ── Índice de dias letivos ──────────────────────────────────
+# Dias do ano do calendário numerados a partir de 1º de janeiro, com a soma
+# de prefixo dos dias letivos (segunda a sexta dentro de um bimestre, fora de
+# feriados e recessos) e o bimestre vigente de cada dia. Dias letivos entre
+# duas datas, bimestre atual e chamadas esperadas até hoje viram leituras
+# O(1) nas listas, sem laço por data a cada requisição.
+
+def _montar_indice_letivo(cal):
+    base = date(cal['ano'], 1, 1).toordinal()
+    total = date(cal['ano'], 12, 31).toordinal() - base + 1
+
+    def dia(iso):
+        return date.fromisoformat(iso).toordinal() - base
+
+    fora = {dia(f['data']) for f in cal['feriados']}
+    for r in cal['recessos']:
+        fora.update(range(dia(r['inicio']), dia(r['fim']) + 1))
+
+    letivo = [0] * total
+    vigente = [cal['bimestres'][0]['bimestre']] * total  # antes do 1º: o 1º
+    for b in cal['bimestres']:
+        ini, fim = dia(b['inicio']), dia(b['fim'])
+        for i in range(ini, fim + 1):
+            if (base + i) % 7 not in (6, 0) and i not in fora:  # ordinal % 7: 0 = domingo
+                letivo[i] = 1
+        for i in range(ini, total):
+            vigente[i] = b['bimestre']
+
+    acumulado = [0]
+    for x in letivo:
+        acumulado.append(acumulado[-1] + x)
+    return {
+        'ano': cal['ano'],
+        'base': base,
+        'total': total,
+        'acumulado': acumulado,   # acumulado[i] = dias letivos antes do dia i
+        'vigente': vigente,
+        'bimestres': {b['bimestre']: b for b in cal['bimestres']},
+        'inicio_aulas': cal['inicio_aulas'],
+    }
+
+
+INDICE_LETIVO = _montar_indice_letivo(CALENDARIO_PEDAGOGICO_2026)
+
+
+def _dia_do_indice(d):
+    """Data ('AAAA-MM-DD' ou date) → posição no índice (pode cair fora do ano)."""
+    if isinstance(d, str):
+        d = date.fromisoformat(d[:10])
+    return d.toordinal() - INDICE_LETIVO['base']
+
+
+def dias_letivos_entre(inicio, fim):
+    """Dias letivos em [inicio, fim] (datas fora do ano do calendário não contam)."""
+    total = INDICE_LETIVO['total']
+    i = min(max(_dia_do_indice(inicio), 0), total)
+    j = min(max(_dia_do_indice(fim) + 1, 0), total)
+    acumulado = INDICE_LETIVO['acumulado']
+    return acumulado[j] - acumulado[i] if j > i else 0
+
 
+def eh_dia_letivo(d):
+    i = _dia_do_indice(d)
+    return 0 <= i < INDICE_LETIVO['total'] and \
+        INDICE_LETIVO['acumulado'][i + 1] > INDICE_LETIVO['acumulado'][i]
+
+
+def bimestre_vigente(ref):
+    """Bimestre em curso na data (durante recessos, o último iniciado; antes
+    das aulas, o 1º). None se a data estiver fora do ano do calendário."""
+    i = _dia_do_indice(ref)
+    if not 0 <= i < INDICE_LETIVO['total']:
+        return None
+    return INDICE_LETIVO['bimestres'][INDICE_LETIVO['vigente'][i]]
+
+
+def chamadas_esperadas(ate, desde=None):
+    """Dias letivos (chamadas a fazer por turma) do início das aulas — ou de
+    `desde` — até `ate`, inclusive."""
+    return dias_letivos_entre(desde or INDICE_LETIVO['inicio_aulas'], ate)
 
 # ============================================================
 # SCHEMA DO BANCO
@@ -181,23 +675,658 @@ SCHEMA = [
 ]
 
 
-def init_db():
-    conn = get_db()
+# ============================================================
+# MIGRAÇÕES VERSIONADAS
+# ============================================================
+# Cada migração é (versão, descrição, [instruções]) e roda uma única vez, em
+# ordem, dentro de um lote transacional que também registra a versão em
+# schema_version. As instruções usam IF NOT EXISTS para que duas instâncias
+# iniciando ao mesmo tempo possam aplicar a mesma migração sem erro.
+
+SCHEMA_VERSION_DDL = """CREATE TABLE IF NOT EXISTS schema_version (
+    versao INTEGER PRIMARY KEY,
+    descricao TEXT,
+    aplicado_em TEXT DEFAULT (datetime('now'))
+)"""
+
+# Agregado (turma, data) → total/presenças/faltas, atualizado pelos triggers
+# na mesma transação de qualquer escrita em frequencia. Dashboard, calendário
+# e monitoramento leem daqui: o custo cresce com turmas × dias, não com
+# alunos × dias.
+FREQUENCIA_DIARIA_DDL = [
+    """CREATE TABLE IF NOT EXISTS frequencia_diaria (
+        turma_id INTEGER NOT NULL,
+        data TEXT NOT NULL,
+        total INTEGER NOT NULL DEFAULT 0,
+        presencas INTEGER NOT NULL DEFAULT 0,
+        faltas INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (turma_id, data)
+    ) WITHOUT ROWID""",
+    """CREATE INDEX IF NOT EXISTS idx_frequencia_diaria_data
+       ON frequencia_diaria (data)""",
+    """CREATE TRIGGER IF NOT EXISTS trg_frequencia_diaria_ins
+       AFTER INSERT ON frequencia
+       BEGIN
+           INSERT INTO frequencia_diaria (turma_id, data, total, presencas, faltas)
+           VALUES (NEW.turma_id, NEW.data, 1, NEW.presente = 1, NEW.presente = 0)
+           ON CONFLICT(turma_id, data) DO UPDATE SET
+               total = total + 1,
+               presencas = presencas + (NEW.presente = 1),
+               faltas = faltas + (NEW.presente = 0);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS trg_frequencia_diaria_del
+       AFTER DELETE ON frequencia
+       BEGIN
+           UPDATE frequencia_diaria SET
+               total = total - 1,
+               presencas = presencas - (OLD.presente = 1),
+               faltas = faltas - (OLD.presente = 0)
+           WHERE turma_id = OLD.turma_id AND data = OLD.data;
+           DELETE FROM frequencia_diaria
+           WHERE turma_id = OLD.turma_id AND data = OLD.data AND total <= 0;
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS trg_frequencia_diaria_upd
+       AFTER UPDATE OF turma_id, data, presente ON frequencia
+       BEGIN
+           UPDATE frequencia_diaria SET
+               total = total - 1,
+               presencas = presencas - (OLD.presente = 1),
+               faltas = faltas - (OLD.presente = 0)
+           WHERE turma_id = OLD.turma_id AND data = OLD.data;
+           INSERT INTO frequencia_diaria (turma_id, data, total, presencas, faltas)
+           VALUES (NEW.turma_id, NEW.data, 1, NEW.presente = 1, NEW.presente = 0)
+           ON CONFLICT(turma_id, data) DO UPDATE SET
+               total = total + 1,
+               presencas = presencas + (NEW.presente = 1),
+               faltas = faltas + (NEW.presente = 0);
+           DELETE FROM frequencia_diaria
+           WHERE turma_id = OLD.turma_id AND data = OLD.data AND total <= 0;
+       END""",
+]
+
+RECONSTRUIR_FREQUENCIA_DIARIA = [
+    "DELETE FROM frequencia_diaria",
+    """INSERT INTO frequencia_diaria (turma_id, data, total, presencas, faltas)
+       SELECT turma_id, data, COUNT(*),
+              SUM(CASE WHEN presente = 1 THEN 1 ELSE 0 END),
+              SUM(CASE WHEN presente = 0 THEN 1 ELSE 0 END)
+       FROM frequencia
+       GROUP BY turma_id, data""",
+]
+
+# Contadores por aluno e período ('AAAA-MM' para mês, 'AAAA-Bn' para bimestre
+# letivo de calendario_bimestres), mantidos pelos triggers de frequencia.
+# A coluna gerada percentual + índice (periodo, percentual) transformam a
+# lista de alunos críticos do monitoramento em uma leitura top-K pelo índice.
+_PERIODOS_DA_DATA = """(SELECT substr({d}, 1, 7) AS periodo
+          UNION ALL
+          SELECT substr(b.inicio, 1, 4) || '-B' || b.bimestre
+          FROM calendario_bimestres b WHERE {d} BETWEEN b.inicio AND b.fim)"""
+
+_SOMAR_CONTADOR = """INSERT INTO frequencia_aluno_periodo (aluno_id, periodo, total, presencas, faltas)
+           SELECT NEW.aluno_id, p.periodo, 1, NEW.presente = 1, NEW.presente = 0
+           FROM """ + _PERIODOS_DA_DATA.format(d='NEW.data') + """ p
+           WHERE 1
+           ON CONFLICT(aluno_id, periodo) DO UPDATE SET
+               total = total + 1,
+               presencas = presencas + excluded.presencas,
+               faltas = faltas + excluded.faltas;"""
+
+_SUBTRAIR_CONTADOR = """UPDATE frequencia_aluno_periodo SET
+               total = total - 1,
+               presencas = presencas - (OLD.presente = 1),
+               faltas = faltas - (OLD.presente = 0)
+           WHERE aluno_id = OLD.aluno_id
+             AND periodo IN """ + _PERIODOS_DA_DATA.format(d='OLD.data') + """;
+           DELETE FROM frequencia_aluno_periodo
+           WHERE aluno_id = OLD.aluno_id AND total <= 0;"""
+
+CONTADORES_ALUNO_DDL = [
+    """CREATE TABLE IF NOT EXISTS calendario_bimestres (
+        ano INTEGER NOT NULL,
+        bimestre INTEGER NOT NULL,
+        inicio TEXT NOT NULL,
+        fim TEXT NOT NULL,
+        dias_letivos INTEGER,
+        PRIMARY KEY (ano, bimestre)
+    )""",
+    "INSERT OR REPLACE INTO calendario_bimestres (ano, bimestre, inicio, fim, dias_letivos) VALUES "
+    + ", ".join(
+        f"({CALENDARIO_PEDAGOGICO_2026['ano']}, {b['bimestre']}, '{b['inicio']}', '{b['fim']}', {b['dias_letivos']})"
+        for b in CALENDARIO_PEDAGOGICO_2026['bimestres']
+    ),
+    """CREATE TABLE IF NOT EXISTS frequencia_aluno_periodo (
+        aluno_id INTEGER NOT NULL,
+        periodo TEXT NOT NULL,
+        total INTEGER NOT NULL DEFAULT 0,
+        presencas INTEGER NOT NULL DEFAULT 0,
+        faltas INTEGER NOT NULL DEFAULT 0,
+        percentual REAL GENERATED ALWAYS AS
+            (CASE WHEN total > 0 THEN presencas * 100.0 / total END) VIRTUAL,
+        PRIMARY KEY (aluno_id, periodo)
+    ) WITHOUT ROWID""",
+    """CREATE INDEX IF NOT EXISTS idx_frequencia_aluno_periodo_perc
+       ON frequencia_aluno_periodo (periodo, percentual)""",
+    """CREATE TRIGGER IF NOT EXISTS trg_frequencia_aluno_periodo_ins
+       AFTER INSERT ON frequencia
+       BEGIN
+           """ + _SOMAR_CONTADOR + """
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS trg_frequencia_aluno_periodo_del
+       AFTER DELETE ON frequencia
+       BEGIN
+           """ + _SUBTRAIR_CONTADOR + """
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS trg_frequencia_aluno_periodo_upd
+       AFTER UPDATE OF aluno_id, data, presente ON frequencia
+       BEGIN
+           """ + _SUBTRAIR_CONTADOR + """
+           """ + _SOMAR_CONTADOR + """
+       END""",
+]
+
+RECONSTRUIR_CONTADORES_ALUNO = [
+    "DELETE FROM frequencia_aluno_periodo",
+    """INSERT INTO frequencia_aluno_periodo (aluno_id, periodo, total, presencas, faltas)
+       SELECT f.aluno_id, p.periodo, COUNT(*),
+              SUM(CASE WHEN f.presente = 1 THEN 1 ELSE 0 END),
+              SUM(CASE WHEN f.presente = 0 THEN 1 ELSE 0 END)
+       FROM frequencia f
+       JOIN (SELECT DISTINCT data, substr(data, 1, 7) AS periodo FROM frequencia
+             UNION ALL
+             SELECT DISTINCT f2.data, substr(b.inicio, 1, 4) || '-B' || b.bimestre
+             FROM frequencia f2
+             JOIN calendario_bimestres b ON f2.data BETWEEN b.inicio AND b.fim) p
+         ON p.data = f.data
+       GROUP BY f.aluno_id, p.periodo""",
+]
+
+# Versão dos dados: um contador por tabela, incrementado por triggers na
+# mesma transação de qualquer escrita. Caches em memória (dashboard, etc.)
+# comparam a versão em vez de recalcular.
+VERSAO_DADOS_TABELAS = ('alunos', 'turmas', 'frequencia')
+
+VERSAO_DADOS_DDL = [
+    """CREATE TABLE IF NOT EXISTS versao_dados (
+        chave TEXT PRIMARY KEY,
+        versao INTEGER NOT NULL DEFAULT 0
+    )""",
+    "INSERT OR IGNORE INTO versao_dados (chave, versao) VALUES "
+    + ", ".join(f"('{t}', 0)" for t in VERSAO_DADOS_TABELAS),
+] + [
+    f"""CREATE TRIGGER IF NOT EXISTS trg_versao_{tabela}_{evento.lower()}
+        AFTER {evento} ON {tabela}
+        BEGIN
+            UPDATE versao_dados SET versao = versao + 1 WHERE chave = '{tabela}';
+        END"""
+    for tabela in VERSAO_DADOS_TABELAS
+    for evento in ('INSERT', 'UPDATE', 'DELETE')
+]
+
+# Data de nascimento em ISO ('AAAA-MM-DD'), derivada de data_nascimento
+# ('dd/mm/aaaa' da SED ou 'AAAA-MM-DD[ hh:mm:ss]' vindo de planilhas). Como
+# coluna gerada ela vale para toda escrita (cadastro, edição, importação)
+# sem código extra, e o índice é preenchido para as linhas existentes ao
+# ser criado. Idades, filtros e histogramas passam a ser feitos em SQL.
+NASCIMENTO_DDL = [
+    """ALTER TABLE alunos ADD COLUMN nascimento TEXT GENERATED ALWAYS AS (
+        CASE
+            WHEN data_nascimento GLOB '[0-9][0-9]/[0-9][0-9]/[0-9][0-9][0-9][0-9]'
+            THEN substr(data_nascimento, 7, 4) || '-' || substr(data_nascimento, 4, 2)
+                 || '-' || substr(data_nascimento, 1, 2)
+            WHEN data_nascimento GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]*'
+            THEN substr(data_nascimento, 1, 10)
+        END) VIRTUAL""",
+    # Filtros por faixa de idade (intervalo de nascimento) entre os ativos
+    """CREATE INDEX IF NOT EXISTS idx_alunos_nascimento
+       ON alunos (nascimento) WHERE ativo = 1""",
+]
+
+# Importações assíncronas: o upload fica em partes BLOB no próprio banco
+# (a função que recebe o arquivo não é a que processa) e cada bloco gravado
+# registra uma linha em importacoes_lotes na mesma transação dos alunos —
+# a retomada continua do primeiro bloco sem registro, e dois workers nunca
+# gravam o mesmo bloco (PRIMARY KEY).
+IMPORTACOES_DDL = [
+    """CREATE TABLE IF NOT EXISTS importacoes (
+        id TEXT PRIMARY KEY,
+        nome_arquivo TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'recebendo',
+        tamanho_bytes INTEGER NOT NULL DEFAULT 0,
+        total_linhas_estimado INTEGER,
+        lote_linhas INTEGER NOT NULL,
+        lotes_gravados INTEGER NOT NULL DEFAULT 0,
+        linhas_processadas INTEGER NOT NULL DEFAULT 0,
+        total_importados INTEGER NOT NULL DEFAULT 0,
+        inseridos INTEGER NOT NULL DEFAULT 0,
+        atualizados INTEGER NOT NULL DEFAULT 0,
+        turmas_novas INTEGER NOT NULL DEFAULT 0,
+        series_json TEXT NOT NULL DEFAULT '[]',
+        tentativas INTEGER NOT NULL DEFAULT 0,
+        dono TEXT,
+        erro TEXT,
+        linhas_na_retomada INTEGER NOT NULL DEFAULT 0,
+        criado_em TEXT DEFAULT (datetime('now')),
+        iniciado_em TEXT,
+        retomado_em TEXT,
+        atualizado_em TEXT,
+        concluido_em TEXT
+    )""",
+    """CREATE INDEX IF NOT EXISTS idx_importacoes_status
+       ON importacoes (status, criado_em)""",
+    """CREATE TABLE IF NOT EXISTS importacoes_partes (
+        importacao_id TEXT NOT NULL,
+        parte INTEGER NOT NULL,
+        dados BLOB NOT NULL,
+        PRIMARY KEY (importacao_id, parte)
+    ) WITHOUT ROWID""",
+    """CREATE TABLE IF NOT EXISTS importacoes_lotes (
+        importacao_id TEXT NOT NULL,
+        lote INTEGER NOT NULL,
+        PRIMARY KEY (importacao_id, lote)
+    ) WITHOUT ROWID""",
+]
+
+# Detecção de mudanças na reimportação: cada aluno guarda o hash do
+# registro importado (linhas iguais não são regravadas) e cada arquivo
+# importado guarda o seu hash com as versões de alunos/turmas logo após a
+# gravação — o mesmo arquivo, sem escritas desde então, nem é processado.
+# Qualquer outra alteração do aluno (edição, transferência) apaga o hash
+# da linha, para que a próxima importação volte a gravá-la.
+HASH_IMPORTACAO_DDL = [
+    "ALTER TABLE alunos ADD COLUMN hash_importacao TEXT",
+    """CREATE TRIGGER IF NOT EXISTS trg_alunos_hash_importacao
+        AFTER UPDATE ON alunos
+        WHEN OLD.hash_importacao IS NOT NULL
+         AND NEW.hash_importacao IS OLD.hash_importacao
+        BEGIN
+            UPDATE alunos SET hash_importacao = NULL WHERE id = NEW.id;
+        END""",
+    """CREATE TABLE IF NOT EXISTS importacoes_arquivos (
+        hash TEXT PRIMARY KEY,
+        nome_arquivo TEXT,
+        resumo_json TEXT NOT NULL,
+        versao_alunos INTEGER NOT NULL,
+        versao_turmas INTEGER NOT NULL,
+        importado_em TEXT DEFAULT (datetime('now'))
+    )""",
+    "ALTER TABLE importacoes ADD COLUMN hash_arquivo TEXT",
+    "ALTER TABLE importacoes ADD COLUMN inalterados INTEGER NOT NULL DEFAULT 0",
+]
+
+# Busca de alunos: índice FTS5 com nome, nome social, RA, CPF e filiação.
+# unicode61 com remove_diacritics ignora acentos e caixa ("JOSÉ" = "jose"),
+# prefix= deixa a busca por início de palavra (digitação) em índice e o
+# bm25 ordena por relevância. RA e CPF ficam sem pontuação ('.', '-', '/',
+# espaço), como a busca os reduz (expressao_busca). O rowid é o id do
+# aluno; triggers mantêm o índice a cada escrita em alunos.
+def _sem_pontuacao_sql(col):
+    return f"replace(replace(replace(replace({col}, '.', ''), '-', ''), '/', ''), ' ', '')"
+
+
+def _valores_busca(p):
+    return (f"{p}.id, {p}.nome, {p}.nome_social, "
+            f"{_sem_pontuacao_sql(f'{p}.ra')}, {_sem_pontuacao_sql(f'{p}.cpf')}, "
+            f"trim(coalesce({p}.filiacao_1, '') || ' ' || coalesce({p}.filiacao_2, ''))")
+
+
+BUSCA_ALUNOS_COLUNAS = "rowid, nome, nome_social, ra, cpf, filiacao"
+
+BUSCA_ALUNOS_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS alunos_busca USING fts5(
+        nome, nome_social, ra, cpf, filiacao,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS trg_alunos_busca_insert
+        AFTER INSERT ON alunos
+        BEGIN
+            INSERT INTO alunos_busca ({BUSCA_ALUNOS_COLUNAS}) VALUES ({_valores_busca('NEW')});
+        END""",
+    """CREATE TRIGGER IF NOT EXISTS trg_alunos_busca_delete
+        AFTER DELETE ON alunos
+        BEGIN
+            DELETE FROM alunos_busca WHERE rowid = OLD.id;
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS trg_alunos_busca_update
+        AFTER UPDATE OF nome, nome_social, ra, cpf, filiacao_1, filiacao_2 ON alunos
+        BEGIN
+            DELETE FROM alunos_busca WHERE rowid = OLD.id;
+            INSERT INTO alunos_busca ({BUSCA_ALUNOS_COLUNAS}) VALUES ({_valores_busca('NEW')});
+        END""",
+    "DELETE FROM alunos_busca",
+    f"INSERT INTO alunos_busca ({BUSCA_ALUNOS_COLUNAS}) SELECT {_valores_busca('a')} FROM alunos a",
+]
+
+MIGRACOES = [
+    (1, 'Tabelas iniciais', SCHEMA),
+    (2, 'Índices das consultas de frequência e alunos', [
+        # monitoramento (freq_turma, freq_diaria), calendario_frequencia,
+        # relatorio_freq_mensal: turma_id = ? AND data entre X e Y; cobre presente
+        """CREATE INDEX IF NOT EXISTS idx_frequencia_turma_data
+           ON frequencia (turma_id, data, presente)""",
+        # alunos_criticos / resumo por aluno: JOIN por aluno_id + faixa de data.
+        # Cobre presente, evitando ler a linha da tabela (o UNIQUE não cobre).
+        """CREATE INDEX IF NOT EXISTS idx_frequencia_aluno_data
+           ON frequencia (aluno_id, data, presente)""",
+        # Alunos ativos de uma turma, já em ordem de nome (listagens e contagens)
+        """CREATE INDEX IF NOT EXISTS idx_alunos_turma_ativos
+           ON alunos (turma_id, nome) WHERE ativo = 1""",
+        # Listagem geral de alunos ativos ordenada por nome
+        """CREATE INDEX IF NOT EXISTS idx_alunos_ativos_nome
+           ON alunos (nome) WHERE ativo = 1""",
+        # importar_arquivo: aluno existente por RA na turma
+        """CREATE INDEX IF NOT EXISTS idx_alunos_ra_turma
+           ON alunos (ra, turma_id)""",
+        # turmas(nome) já é UNIQUE → índice automático, nada a criar.
+    ]),
+    (3, 'Índice por data para filtros de mês/ano sem turma', [
+        # listar_frequencia só com ?mes=, série diária do dashboard
+        """CREATE INDEX IF NOT EXISTS idx_frequencia_data
+           ON frequencia (data, presente)""",
+    ]),
+    (4, 'Lotes de frequência já aplicados (idempotência por lote_id)', [
+        """CREATE TABLE IF NOT EXISTS frequencia_lotes (
+            lote_id TEXT PRIMARY KEY,
+            resultado_json TEXT NOT NULL,
+            criado_em TEXT DEFAULT (datetime('now'))
+        )""",
+    ]),
+    (5, 'Agregado diário por turma mantido por triggers', FREQUENCIA_DIARIA_DDL
+        + RECONSTRUIR_FREQUENCIA_DIARIA),
+    (6, 'Contadores de frequência por aluno (mês e bimestre)', CONTADORES_ALUNO_DDL
+        + RECONSTRUIR_CONTADORES_ALUNO),
+    (7, 'Versão dos dados por tabela (invalidação de caches)', VERSAO_DADOS_DDL),
+    (8, 'Data de nascimento normalizada (ISO) para idades em SQL', NASCIMENTO_DDL),
+    (9, 'Fila de importações assíncronas com retomada por bloco', IMPORTACOES_DDL),
+    (10, 'Hash de conteúdo por aluno e por arquivo importado', HASH_IMPORTACAO_DDL),
+    (11, 'Índice de busca de alunos (FTS5, sem acentos, por prefixo)', BUSCA_ALUNOS_DDL),
+    (12, 'Busca de alunos: RA sem pontuação no índice', [
+        "DROP TRIGGER IF EXISTS trg_alunos_busca_insert",
+        "DROP TRIGGER IF EXISTS trg_alunos_busca_update",
+    ] + BUSCA_ALUNOS_DDL),
+    (13, 'Posição de retomada das importações assíncronas', [
+        # Byte (CSV) ou linha (XLSX) logo depois do último bloco gravado
+        "ALTER TABLE importacoes ADD COLUMN retomar_em INTEGER",
+        "ALTER TABLE importacoes ADD COLUMN encoding TEXT",
+    ]),
+]
+
+
+SCHEMA_META_DDL = """CREATE TABLE IF NOT EXISTS schema_meta (
+    chave TEXT PRIMARY KEY,
+    valor TEXT
+)"""
+
+# Impressão digital do conjunto de migrações: muda sempre que MIGRACOES muda.
+SCHEMA_IMPRESSAO = hashlib.sha1(
+    json.dumps([(v, i) for v, _, i in MIGRACOES]).encode('utf-8')
+).hexdigest()[:16]
+
+# Tempo máximo que uma requisição espera por uma migração em andamento
+DB_MIGRACAO_TIMEOUT = float(os.environ.get('DB_MIGRACAO_TIMEOUT', '20'))
+
+_schema_pronto = threading.Event()
+
+
+def versao_schema():
+    """Versão atual do schema (0 se nenhuma migração foi registrada)."""
+    rows = query("SELECT MAX(versao) AS v FROM schema_version", primario=True)
+    return (rows[0]['v'] if rows else None) or 0
+
+
+def schema_atualizado():
+    """Caminho rápido: uma única leitura compara a impressão gravada no banco."""
     try:
-        for stmt in SCHEMA:
-            conn.execute(stmt)
-        conn.commit()
+        rows = query("SELECT valor FROM schema_meta WHERE chave = 'impressao'")
+    except Exception:
+        return False  # banco novo: schema_meta ainda não existe
+    return bool(rows) and rows[0]['valor'] == SCHEMA_IMPRESSAO
+
+
+_ADD_COLUMN_RE = re.compile(r'\s*ALTER\s+TABLE\s+(\w+)\s+ADD\s+COLUMN\s+(\w+)', re.IGNORECASE)
+
+
+def _instrucoes_pendentes(instrucoes):
+    """Tira da migração os ADD COLUMN de colunas que já existem: SQLite não
+    tem ADD COLUMN IF NOT EXISTS, e duas partidas a frio migrando ao mesmo
+    tempo (ou uma migração aplicada à mão) dariam "duplicate column"."""
+    colunas = {}
+    pendentes = []
+    for stmt in instrucoes:
+        m = _ADD_COLUMN_RE.match(stmt)
+        if m:
+            tabela, coluna = m.group(1), m.group(2)
+            if tabela not in colunas:
+                # table_xinfo: inclui colunas geradas (nascimento), que table_info esconde
+                colunas[tabela] = {r['name'] for r in query(
+                    "SELECT name FROM pragma_table_xinfo(?)", [tabela], primario=True)}
+            if coluna in colunas[tabela]:
+                continue
+        pendentes.append(stmt)
+    return pendentes
+
+
+def aplicar_migracoes():
+    """Aplica, em ordem, as migrações ainda não registradas. Idempotente."""
+    execute_many([(SCHEMA_VERSION_DDL, None), (SCHEMA_META_DDL, None)])
+    atual = versao_schema()
+    aplicadas = []
+    for versao, descricao, instrucoes in MIGRACOES:
+        if versao <= atual:
+            continue
+        try:
+            execute_many(
+                [(stmt, None) for stmt in _instrucoes_pendentes(instrucoes)]
+                + [("INSERT OR IGNORE INTO schema_version (versao, descricao) VALUES (?, ?)",
+                    [versao, descricao])]
+            )
+        except BatchError as e:
+            # Outra instância aplicou esta migração entre a checagem e o ALTER:
+            # a transação dela registra a versão junto com as colunas
+            if 'duplicate column' not in e.mensagem.lower() or versao_schema() < versao:
+                raise
+            continue
+        aplicadas.append(versao)
+    execute(
+        "INSERT OR REPLACE INTO schema_meta (chave, valor) VALUES ('impressao', ?)",
+        [SCHEMA_IMPRESSAO]
+    )
+    return aplicadas
+
+
+def _migrar_em_segundo_plano():
+    try:
+        aplicadas = aplicar_migracoes()
+        if aplicadas:
+            print(f"[init_db] Migrações aplicadas: {aplicadas}")
     except Exception as e:
         print(f"[init_db] Erro: {e}")
     finally:
+        _schema_pronto.set()
+
+
+def init_db():
+    """Na carga do módulo: se o schema já está em dia, nenhum DDL é enviado
+    (só uma leitura). Caso contrário, as migrações rodam em uma thread e só
+    as requisições que chegarem antes de terminarem esperam por elas.
+    DB_MIGRAR_NA_INICIALIZACAO=0 desliga a migração automática (use
+    `python api/index.py migrar` no deploy)."""
+    if schema_atualizado():
+        _schema_pronto.set()
+        return
+    if os.environ.get('DB_MIGRAR_NA_INICIALIZACAO', '1') == '0':
+        print("[init_db] Schema desatualizado — rode: python api/index.py migrar")
+        _schema_pronto.set()
+        return
+    threading.Thread(target=_migrar_em_segundo_plano, daemon=True).start()
+
+
+@app.before_request
+def _aguardar_schema():
+    if not _schema_pronto.is_set():
+        _schema_pronto.wait(DB_MIGRACAO_TIMEOUT)
+
+
+# ============================================================
+# VERSÃO DOS DADOS
+# ============================================================
+
+# Por quanto tempo a versão lida do banco é reaproveitada sem nova consulta.
+# Escritas feitas por este processo invalidam na hora; escritas de outras
+# instâncias aparecem em até VERSAO_DADOS_TTL segundos.
+VERSAO_DADOS_TTL = float(os.environ.get('VERSAO_DADOS_TTL', '2'))
+
+_versao_cache = {'valor': None, 'lido_em': 0.0, 'mudou_em': None}
+
+
+def versao_dados():
+    """{'alunos': n, 'turmas': n, 'frequencia': n}: contadores de escrita."""
+    agora = time.monotonic()
+    if _versao_cache['valor'] is None or agora - _versao_cache['lido_em'] > VERSAO_DADOS_TTL:
+        rows = query("SELECT chave, versao FROM versao_dados")
+        valor = {r['chave']: r['versao'] for r in rows}
+        if valor != _versao_cache['valor']:
+            _versao_cache['mudou_em'] = datetime.now(timezone.utc).replace(microsecond=0)
+        _versao_cache['valor'] = valor
+        _versao_cache['lido_em'] = agora
+    return _versao_cache['valor']
+
+
+# ============================================================
+# RESPOSTAS CONDICIONAIS (ETag / 304)
+# ============================================================
+# Telas de monitoramento repetem o mesmo GET o dia todo. Com ETag derivado da
+# versão dos dados, o navegador revalida (Cache-Control: no-cache) e recebe
+# 304 sem que a rota — e suas consultas — seja executada.
+
+def _versao_banco():
+    """Versão para rotas que leem o banco (datas relativas a hoje entram na chave)."""
+    v = versao_dados()
+    return (tuple(sorted(v.items())), date.today().isoformat()), _versao_cache['mudou_em']
+
+
+def _versao_arquivos(*caminhos):
+    """Versão para rotas que leem CSVs: mtime e tamanho dos arquivos."""
+    partes = []
+    modificado = None
+    for caminho in caminhos:
         try:
-            conn.close()
-        except Exception:
-            pass
+            st = os.stat(caminho)
+        except OSError:
+            partes.append((caminho, None))
+            continue
+        partes.append((caminho, st.st_mtime_ns, st.st_size))
+        mtime = datetime.fromtimestamp(int(st.st_mtime), timezone.utc)
+        modificado = max(modificado, mtime) if modificado else mtime
+    return tuple(partes), modificado
+
+
+def resposta_condicional(versao_fn):
+    """Decorator: ETag/Last-Modified a partir de versao_fn() → (versao, modificado).
+    Se o cliente já tem a versão atual, responde 304 sem executar a rota."""
+    def decorator(rota):
+        @functools.wraps(rota)
+        def wrapper(*args, **kwargs):
+            versao, modificado = versao_fn()
+            etag = hashlib.sha1(repr((
+                request.path, sorted(request.args.items(multi=True)), versao
+            )).encode('utf-8')).hexdigest()[:20]
+
+            if request.if_none_match:
+                nao_mudou = request.if_none_match.contains(etag)
+            else:
+                ims = request.if_modified_since
+                nao_mudou = bool(ims and modificado and modificado <= ims)
+            if nao_mudou:
+                resp = Response(status=304)
+            else:
+                resp = app.make_response(rota(*args, **kwargs))
+                if resp.status_code != 200:
+                    return resp
+            resp.set_etag(etag)
+            if modificado:
+                resp.last_modified = modificado
+            resp.headers['Cache-Control'] = 'no-cache'
+            return resp
+        return wrapper
+    return decorator
+
+
+# Consultas quentes e o índice que cada uma deve usar (conferido com
+# EXPLAIN QUERY PLAN em /api/schema — uma regressão aparece como "SCAN").
+PLANOS_ESPERADOS = [
+    ('monitoramento.freq_turma', 'PRIMARY KEY',
+     """SELECT fd.turma_id, COUNT(*), SUM(fd.total), SUM(fd.presencas)
+        FROM frequencia_diaria fd
+        WHERE fd.turma_id IN (?, ?) AND fd.data >= ? AND fd.data <= ?
+        GROUP BY fd.turma_id""", [1, 2, '2026-03-01', '2026-03-31']),
+    ('calendario_frequencia', 'PRIMARY KEY',
+     """SELECT data, total, presencas FROM frequencia_diaria
+        WHERE turma_id = ? AND data >= ? AND data < ?""", [1, '2026-01-01', '2027-01-01']),
+    ('relatorio_freq_mensal', 'idx_frequencia_turma_data',
+     """SELECT aluno_id, data, presente FROM frequencia
+        WHERE turma_id = ? AND data >= ? AND data < ?""", [1, '2026-03-01', '2026-04-01']),
+    ('monitoramento.alunos_criticos', 'idx_frequencia_aluno_periodo_perc',
+     """SELECT a.id, c.total, c.presencas
+        FROM frequencia_aluno_periodo c
+        JOIN alunos a ON a.id = c.aluno_id
+        WHERE c.periodo = ? AND c.percentual < ? AND a.ativo = 1 AND a.turma_id IN (?, ?)
+        ORDER BY c.percentual, a.id LIMIT 50""", ['2026-03', 74.95, 1, 2]),
+    ('monitoramento_turma_detalhe', 'idx_frequencia_aluno_data',
+     """SELECT a.id, COUNT(f.id), SUM(CASE WHEN f.presente = 1 THEN 1 ELSE 0 END)
+        FROM alunos a
+        LEFT JOIN frequencia f ON f.aluno_id = a.id AND f.data >= ? AND f.data <= ?
+        WHERE a.turma_id = ? AND a.ativo = 1
+        GROUP BY a.id""", ['2026-03-01', '2026-03-31', 1]),
+    ('listar_frequencia.mes', 'idx_frequencia_data',
+     """SELECT f.*, a.nome FROM frequencia f JOIN alunos a ON a.id = f.aluno_id
+        WHERE f.data >= ? AND f.data < ? ORDER BY f.data DESC""", ['2026-03-01', '2026-04-01']),
+    ('resumo_frequencia.alunos', 'idx_alunos_turma_ativos',
+     "SELECT id, nome FROM alunos WHERE turma_id = ? AND ativo = 1 ORDER BY nome", [1]),
+    ('listar_alunos', 'idx_alunos_ativos_nome',
+     "SELECT * FROM alunos WHERE ativo = 1 ORDER BY nome", []),
+    ('listar_alunos.idade', 'idx_alunos_nascimento',
+     "SELECT id FROM alunos WHERE ativo = 1 AND nascimento <= ? AND nascimento > ?",
+     ['2012-01-01', '2010-01-01']),
+    ('listar_alunos.busca', 'VIRTUAL TABLE INDEX',
+     """SELECT rowid, bm25(alunos_busca) FROM alunos_busca
+        WHERE alunos_busca MATCH ?""", ['"jose"*']),
+    ('importar_arquivo.aluno_por_ra', 'idx_alunos_ra_turma',
+     "SELECT id FROM alunos WHERE ra = ? AND turma_id = ?", ['123', 1]),
+    ('importar_arquivo.turma_por_nome', 'sqlite_autoindex_turmas_1',
+     "SELECT id FROM turmas WHERE nome = ?", ['1A']),
+]
 
 
-# Inicializar banco na primeira carga
-init_db()
+def verificar_planos():
+    """Roda EXPLAIN QUERY PLAN nas consultas quentes e confere o índice usado."""
+    resultado = []
+    for nome, indice, sql, params in PLANOS_ESPERADOS:
+        try:
+            plano = [r.get('detail', '') for r in query("EXPLAIN QUERY PLAN " + sql, params)]
+        except Exception as e:
+            plano = [f'erro: {e}']
+        resultado.append({
+            'consulta': nome,
+            'indice_esperado': indice,
+            'usa_indice': any(indice in linha for linha in plano),
+            'plano': plano,
+        })
+    return resultado
+
+
+@app.route('/api/schema', methods=['GET'])
+def schema_info():
+    """Versão do schema, migrações conhecidas e planos das consultas quentes."""
+    return jsonify({
+        'versao': versao_schema(),
+        'versao_esperada': MIGRACOES[-1][0],
+        'impressao': SCHEMA_IMPRESSAO,
+        'atualizado': schema_atualizado(),
+        'migracoes': [{'versao': v, 'descricao': d} for v, d, _ in MIGRACOES],
+        'planos': verificar_planos(),
+    })
 
 
 # ============================================================
@@ -215,22 +1344,63 @@ DIAS_SEMANA = {
 }
 
 
-def calcular_idade(data_nasc_str):
-    """Calcula a idade a partir de dd/mm/aaaa."""
-    if not data_nasc_str:
+def idade_sql(coluna='nascimento'):
+    """Expressão SQL da idade em anos completos a partir da coluna ISO de
+    nascimento. Recebe um parâmetro: hoje_aaaammdd()."""
+    return f"(? - CAST(replace({coluna}, '-', '') AS INTEGER)) / 10000"
+
+
+def hoje_aaaammdd():
+    """Data de hoje como inteiro AAAAMMDD (parâmetro de idade_sql)."""
+    return int(date.today().strftime('%Y%m%d'))
+
+
+def _anos_atras(anos):
+    """Data ISO de hoje há `anos` anos (29/02 vira 28/02 em ano não bissexto)."""
+    hoje = date.today()
+    try:
+        return hoje.replace(year=hoje.year - anos).isoformat()
+    except ValueError:
+        return hoje.replace(year=hoje.year - anos, day=28).isoformat()
+
+
+def filtro_idade(idade_min=None, idade_max=None, coluna='nascimento'):
+    """Faixa de idade → condições sobre o nascimento (usam o índice).
+    Retorna (lista de condições SQL, parâmetros)."""
+    conds, params = [], []
+    if idade_min is not None:
+        conds.append(f"{coluna} <= ?")
+        params.append(_anos_atras(idade_min))
+    if idade_max is not None:
+        conds.append(f"{coluna} > ?")
+        params.append(_anos_atras(idade_max + 1))
+    return conds, params
+
+
+def intervalo_mes(mes):
+    """'AAAA-MM' → ('AAAA-MM-01', 1º dia do mês seguinte): intervalo semiaberto
+    [inicio, fim) para comparar com frequencia.data usando o índice.
+    Retorna None se o formato for inválido."""
+    try:
+        inicio = datetime.strptime(str(mes).strip(), '%Y-%m').date()
+    except ValueError:
         return None
+    if inicio.month == 12:
+        fim = date(inicio.year + 1, 1, 1)
+    else:
+        fim = date(inicio.year, inicio.month + 1, 1)
+    return inicio.isoformat(), fim.isoformat()
+
+
+def intervalo_ano(ano):
+    """'AAAA' → ('AAAA-01-01', '(AAAA+1)-01-01'), ou None se inválido."""
     try:
-        parts = data_nasc_str.split('/')
-        if len(parts) == 3:
-            birth = date(int(parts[2]), int(parts[1]), int(parts[0]))
-            today = date.today()
-            age = today.year - birth.year
-            if (today.month, today.day) < (birth.month, birth.day):
-                age -= 1
-            return age
-    except (ValueError, IndexError):
-        pass
-    return None
+        a = int(str(ano).strip())
+    except ValueError:
+        return None
+    if not 1 <= a < 9999:
+        return None
+    return f'{a:04d}-01-01', f'{a + 1:04d}-01-01'
 
 
 def safe_val(val):
@@ -367,39 +1537,165 @@ def deletar_turma(tid):
 # ROTAS — ALUNOS
 # ============================================================
 
+# Pesos do bm25 por coluna de alunos_busca: nome, nome social, RA, CPF, filiação
+BUSCA_ALUNOS_PESOS = '10.0, 8.0, 5.0, 5.0, 1.0'
+
+
+def expressao_busca(texto):
+    """Texto digitado → expressão MATCH do FTS5 (todas as palavras, cada uma
+    como prefixo; a palavra exata soma no bm25 e vem antes), ou '' se não
+    sobrar palavra. Números com pontuação (CPF '123.456.789-00', RA
+    '1234-5' ou '1234-X') perdem a pontuação, como no índice."""
+    documento = documento_busca(texto)
+    termos = [documento] if documento else re.findall(r'\w+', texto)
+    return ' AND '.join(f'("{t}" OR "{t}"*)' for t in termos if t)
+
+
+def documento_busca(texto):
+    """RA/CPF digitado (dígitos e pontuação, dígito verificador X opcional)
+    → sem pontuação; None se o texto não for um número de documento."""
+    texto = texto.strip()
+    if not re.fullmatch(r'[\d.\-/ ]*\d[\d.\-/ ]*[xX]?', texto):
+        return None
+    return re.sub(r'[.\-/ ]', '', texto)
+
+
+# Projeção (?fields=) e paginação por cursor de GET /api/alunos
+ALUNOS_CAMPOS = frozenset(['id', 'ativo', 'nascimento', 'criado_em', 'atualizado_em', 'idade']
+                          + DB_COLUMNS)
+# Colunas devolvidas sem ?fields= (e em GET /api/alunos/<id>): as de sempre,
+# sem o hash interno da importação nem a coluna gerada nascimento
+ALUNOS_COLUNAS_PADRAO = ['id'] + DB_COLUMNS + ['ativo', 'criado_em', 'atualizado_em']
+ALUNOS_PAGINA_PADRAO = 100
+ALUNOS_PAGINA_MAX = 500
+
+
+def _cursor_alunos(chave):
+    return base64.urlsafe_b64encode(json.dumps(chave).encode('utf-8')).decode('ascii')
+
+
+def _ler_cursor_alunos(cursor, n):
+    """Cursor → valores da chave de ordenação (None se inválido)."""
+    try:
+        chave = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, UnicodeError):
+        return None
+    if not isinstance(chave, list) or len(chave) != n:
+        return None
+    # Só valores escalares (nome, id, relevância); bool é int em Python
+    if any(isinstance(v, bool) or not isinstance(v, (str, int, float)) for v in chave):
+        return None
+    return chave
+
+
 @app.route('/api/alunos', methods=['GET'])
 def listar_alunos():
+    """Alunos ativos. Sem parâmetros novos devolve a lista completa, como
+    sempre. ?fields=id,nome,... limita as colunas; ?limite=N (ou ?cursor=)
+    pagina por chave (nome, id — ou relevância na busca) e devolve
+    {alunos, proximo_cursor}; ?total=1 inclui a contagem."""
     turma_id = request.args.get('turma_id')
     busca = request.args.get('busca', '').strip()
+    idade_min = request.args.get('idade_min', type=int)
+    idade_max = request.args.get('idade_max', type=int)
+
+    fields = request.args.get('fields', '').strip()
+    campos = list(dict.fromkeys(c.strip() for c in fields.split(',') if c.strip())) if fields else None
+    desconhecidos = [c for c in campos or [] if c not in ALUNOS_CAMPOS]
+    if desconhecidos:
+        return jsonify({'erro': f"Campo(s) desconhecido(s): {', '.join(desconhecidos)}"}), 400
+
+    cursor = request.args.get('cursor')
+    limite = request.args.get('limite', type=int)
+    paginar = limite is not None or cursor is not None
+    limite = max(1, min(limite or ALUNOS_PAGINA_PADRAO, ALUNOS_PAGINA_MAX))
+
+    # Idade calculada no SQL a partir do nascimento normalizado
+    if campos is None:
+        colunas, com_idade = [f'alunos.{c}' for c in ALUNOS_COLUNAS_PADRAO], True
+    else:
+        colunas = [f'alunos.{c}' for c in campos if c != 'idade']
+        com_idade = 'idade' in campos
+    if com_idade:
+        colunas.append(f'{idade_sql()} AS idade')
+    params_select = [hoje_aaaammdd()] if com_idade else []
+
+    consulta_busca = expressao_busca(busca)
+    documento = documento_busca(busca)
+    if consulta_busca:
+        # Só os alunos que casam com a busca, do mais relevante ao menos
+        acertos = f"""SELECT rowid AS aluno_id,
+                               bm25(alunos_busca, {BUSCA_ALUNOS_PESOS}) AS relevancia
+                        FROM alunos_busca WHERE alunos_busca MATCH ?"""
+        params = [consulta_busca]
+        if documento:
+            # Trecho do meio do RA/CPF ('2440' acha o RA 110892440): varre
+            # as colunas já sem pontuação do índice; vem depois dos prefixos
+            acertos += """
+                        UNION ALL
+                        SELECT rowid, 0.0 FROM alunos_busca
+                        WHERE (ra LIKE ? OR cpf LIKE ?)
+                          AND rowid NOT IN (SELECT rowid FROM alunos_busca
+                                            WHERE alunos_busca MATCH ?)"""
+            params += [f'%{documento}%', f'%{documento}%', consulta_busca]
+        origem = f"""alunos
+                  JOIN ({acertos}) AS b
+                    ON b.aluno_id = alunos.id"""
+        ordem = ['b.relevancia', 'alunos.nome', 'alunos.id']
+    else:
+        origem = "alunos"
+        params = []
+        ordem = ['alunos.nome', 'alunos.id']
 
-    sql = "SELECT * FROM alunos WHERE ativo = 1"
-    params = []
-
+    sql_where = " WHERE ativo = 1"
     if turma_id:
-        sql += " AND turma_id = ?"
+        sql_where += " AND turma_id = ?"
         params.append(int(turma_id))
-    if busca:
-        sql += " AND (nome LIKE ? OR ra LIKE ? OR cpf LIKE ?)"
-        like = f"%{busca}%"
-        params.extend([like, like, like])
-
-    sql += " ORDER BY nome"
-    alunos = query(sql, params)
-
-    # Calcular idade para cada aluno
-    for a in alunos:
-        a['idade'] = calcular_idade(a.get('data_nascimento', ''))
-
-    return jsonify(alunos)
+    conds, params_idade = filtro_idade(idade_min, idade_max)
+    for cond in conds:
+        sql_where += f" AND {cond}"
+    params.extend(params_idade)
+
+    if not paginar:
+        sql = f"SELECT {', '.join(colunas)} FROM {origem}{sql_where} ORDER BY {', '.join(ordem)}"
+        return jsonify(query(sql, params_select + params))
+
+    resposta = {}
+    if request.args.get('total') in ('1', 'true'):
+        resposta['total'] = query(f"SELECT COUNT(*) AS n FROM {origem}{sql_where}", params)[0]['n']
+
+    # Chave de ordenação selecionada à parte (_k0, _k1, ...) para montar o cursor
+    chaves = [f'{col} AS _k{i}' for i, col in enumerate(ordem)]
+    params_pagina = list(params)
+    if cursor:
+        chave = _ler_cursor_alunos(cursor, len(ordem))
+        if chave is None:
+            return jsonify({'erro': 'Cursor inválido'}), 400
+        sql_where += f" AND ({', '.join(ordem)}) > ({', '.join('?' * len(ordem))})"
+        params_pagina.extend(chave)
+    sql = (f"SELECT {', '.join(colunas + chaves)} FROM {origem}{sql_where}"
+           f" ORDER BY {', '.join(ordem)} LIMIT ?")
+    rows = query(sql, params_select + params_pagina + [limite + 1])
+
+    proximo = None
+    if len(rows) > limite:
+        rows = rows[:limite]
+        proximo = _cursor_alunos([rows[-1][f'_k{i}'] for i in range(len(ordem))])
+    for row in rows:
+        for i in range(len(ordem)):
+            row.pop(f'_k{i}', None)
+    resposta['alunos'] = rows
+    resposta['proximo_cursor'] = proximo
+    return jsonify(resposta)
 
 
 @app.route('/api/alunos/<int:aid>', methods=['GET'])
 def obter_aluno(aid):
-    rows = query("SELECT * FROM alunos WHERE id = ?", [aid])
+    rows = query(f"SELECT {', '.join(ALUNOS_COLUNAS_PADRAO)}, {idade_sql()} AS idade "
+                 "FROM alunos WHERE id = ?", [hoje_aaaammdd(), aid])
     if not rows:
         return jsonify({'erro': 'Aluno não encontrado'}), 404
     aluno = rows[0]
-    aluno['idade'] = calcular_idade(aluno.get('data_nascimento', ''))
 
     # Dados extras do JSON
     if aluno.get('dados_json'):
@@ -495,16 +1791,121 @@ def listar_frequencia():
         sql += " AND f.aluno_id = ?"
         params.append(int(aluno_id))
     if mes:
-        sql += " AND f.data LIKE ?"
-        params.append(f"{mes}%")
+        intervalo = intervalo_mes(mes)
+        if not intervalo:
+            return jsonify({'erro': 'mes inválido (use AAAA-MM)'}), 400
+        sql += " AND f.data >= ? AND f.data < ?"
+        params.extend(intervalo)
 
     sql += " ORDER BY f.data DESC, a.nome"
     return jsonify(query(sql, params))
 
 
+# Linhas por INSERT multi-linha (6 parâmetros cada, abaixo do limite de 999)
+UPSERT_FREQUENCIA_LOTE = 150
+
+
+def _upsert_frequencia_stmts(linhas):
+    """Gera INSERT ... ON CONFLICT multi-linha para
+    [(aluno_id, turma_id, data, dia_semana, presente, observacao)].
+    O DO UPDATE só reescreve a linha se o conteúdo de fato mudou."""
+    stmts = []
+    for i in range(0, len(linhas), UPSERT_FREQUENCIA_LOTE):
+        lote = linhas[i:i + UPSERT_FREQUENCIA_LOTE]
+        valores = ', '.join(['(?, ?, ?, ?, ?, ?)'] * len(lote))
+        stmts.append((
+            f"""INSERT INTO frequencia (aluno_id, turma_id, data, dia_semana, presente, observacao)
+                VALUES {valores}
+                ON CONFLICT(aluno_id, data) DO UPDATE SET
+                    turma_id = excluded.turma_id,
+                    dia_semana = excluded.dia_semana,
+                    presente = excluded.presente,
+                    observacao = excluded.observacao
+                WHERE frequencia.presente IS NOT excluded.presente
+                   OR frequencia.turma_id IS NOT excluded.turma_id
+                   OR COALESCE(frequencia.observacao, '') != COALESCE(excluded.observacao, '')""",
+            [v for linha in lote for v in linha]
+        ))
+    return stmts
+
+
+def _dia_semana(data_str):
+    """'AAAA-MM-DD' → nome do dia da semana ('' se a data for inválida)."""
+    try:
+        dt = datetime.strptime(data_str, '%Y-%m-%d')
+        return DIAS_SEMANA.get(dt.weekday(), '')
+    except (ValueError, TypeError):
+        return ''
+
+
+def _id_inteiro(v):
+    """Identificador vindo do JSON → int (ValueError se não for inteiro).
+    Aceita "12" e 12.0; recusa null, bool, "x" e 12.5."""
+    if v is None or isinstance(v, bool) or (isinstance(v, float) and not v.is_integer()):
+        raise ValueError(f'identificador inválido: {v!r}')
+    try:
+        return int(v)
+    except TypeError:
+        raise ValueError(f'identificador inválido: {v!r}') from None
+
+
+def _frequencia_gravada(datas, aluno_ids):
+    """Registros já gravados → {(aluno_id, data): row}, lidos do primário."""
+    datas = list(datas)
+    ids = [aid for aid in aluno_ids if aid is not None]
+    gravados = {}
+    passo = max(1, 900 - len(datas))
+    for i in range(0, len(ids), passo):
+        parte = ids[i:i + passo]
+        rows = query(
+            f"""SELECT aluno_id, data, turma_id, presente, observacao FROM frequencia
+                WHERE data IN ({','.join(['?'] * len(datas))})
+                  AND aluno_id IN ({','.join(['?'] * len(parte))})""",
+            datas + parte, primario=True
+        )
+        gravados.update({(r['aluno_id'], r['data']): r for r in rows})
+    return gravados
+
+
+def _diff_frequencia(turma_id, data_str, dia_semana, registros, gravados=None, afetados=None):
+    """Compara os registros recebidos com os já gravados para (aluno, data).
+    Retorna (linhas novas ou alteradas, {inseridos, atualizados, inalterados}).
+    Se `afetados` for um set, recebe os (turma_id, data) que a gravação muda
+    (inclui a turma antiga de um registro que trocou de turma)."""
+    # Último registro de cada aluno vence (payload com aluno repetido)
+    novos = {}
+    for reg in registros:
+        presente = 1 if reg.get('presente', True) else 0
+        obs = reg.get('observacao') or ''
+        novos[reg.get('aluno_id')] = (presente, obs)
+
+    if gravados is None:
+        gravados = _frequencia_gravada([data_str], novos.keys())
+
+    linhas = []
+    contagem = {'inseridos': 0, 'atualizados': 0, 'inalterados': 0}
+    for aluno_id, (presente, obs) in novos.items():
+        atual = gravados.get((aluno_id, data_str))
+        if atual is None:
+            contagem['inseridos'] += 1
+        elif (atual['presente'] == presente and atual['turma_id'] == turma_id
+              and (atual['observacao'] or '') == obs):
+            contagem['inalterados'] += 1
+            continue
+        else:
+            contagem['atualizados'] += 1
+            if afetados is not None:
+                afetados.add((atual['turma_id'], data_str))
+        linhas.append((aluno_id, turma_id, data_str, dia_semana, presente, obs))
+        if afetados is not None:
+            afetados.add((turma_id, data_str))
+    return linhas, contagem
+
+
 @app.route('/api/frequencia', methods=['POST'])
 def salvar_frequencia():
-    """Salva frequência para uma turma em uma data."""
+    """Salva frequência para uma turma em uma data.
+    Só grava alunos novos ou com presença/observação alterada."""
     data = request.get_json(force=True)
     turma_id = data.get('turma_id')
     data_str = data.get('data')  # YYYY-MM-DD
@@ -512,33 +1913,173 @@ def salvar_frequencia():
 
     if not turma_id or not data_str or not registros:
         return jsonify({'erro': 'turma_id, data e registros são obrigatórios'}), 400
-
-    # Determinar dia da semana
+    if not isinstance(registros, list) or not all(isinstance(r, dict) for r in registros):
+        return jsonify({'erro': 'registros deve ser uma lista de objetos'}), 400
+    # O diff compara com os inteiros gravados: "3" contaria como alteração
     try:
-        dt = datetime.strptime(data_str, '%Y-%m-%d')
-        dia_semana = DIAS_SEMANA.get(dt.weekday(), '')
+        turma_id = _id_inteiro(turma_id)
+        registros = [{**r, 'aluno_id': _id_inteiro(r.get('aluno_id'))} for r in registros]
     except ValueError:
-        dia_semana = ''
+        return jsonify({'erro': 'turma_id e aluno_id devem ser inteiros'}), 400
 
-    stmts = []
-    for reg in registros:
-        aluno_id = reg.get('aluno_id')
-        presente = 1 if reg.get('presente', True) else 0
-        obs = reg.get('observacao', '')
+    afetados = set()
+    linhas, contagem = _diff_frequencia(turma_id, data_str, _dia_semana(data_str), registros,
+                                        afetados=afetados)
 
-        # Upsert - deletar existente e re-inserir
-        stmts.append((
-            "DELETE FROM frequencia WHERE aluno_id = ? AND data = ?",
-            [aluno_id, data_str]
-        ))
+    try:
+        saida = execute_many(_upsert_frequencia_stmts(linhas))
+    except BatchError as e:
+        return jsonify({'erro': f'Erro ao salvar frequência: {e.mensagem}', 'indice': e.indice}), 500
+    _invalidar_cache_monitor(afetados, sum(r['linhas_afetadas'] for r in saida))
+    return jsonify({'ok': True, 'total': len(registros), **contagem})
+
+
+def _ler_entradas_lote():
+    """Lê o corpo do lote: JSON {lote_id, entradas: [...]}, lista JSON, ou
+    NDJSON (uma entrada por linha; lote_id em ?lote_id= ou X-Lote-Id)."""
+    lote_id = request.args.get('lote_id') or request.headers.get('X-Lote-Id')
+    if request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+        entradas = [json.loads(linha) for linha in request.get_data(as_text=True).splitlines()
+                    if linha.strip()]
+        return lote_id, entradas
+    body = request.get_json(force=True)
+    if isinstance(body, list):
+        return lote_id, body
+    return body.get('lote_id') or lote_id, body.get('entradas', [])
+
+
+def _resultado_lote_gravado(lote_id):
+    rows = query("SELECT resultado_json FROM frequencia_lotes WHERE lote_id = ?",
+                 [lote_id], primario=True)
+    return json.loads(rows[0]['resultado_json']) if rows else None
+
+
+@app.route('/api/frequencia/lote', methods=['POST'])
+def sincronizar_frequencia_lote():
+    """Grava muitas chamadas (turmas × datas) em uma única transação.
+    Corpo: {lote_id, entradas: [{turma_id, data, registros: [...]}]} ou NDJSON.
+    Com lote_id, o resultado fica gravado: repetir o envio não regrava nada."""
+    try:
+        lote_id, entradas = _ler_entradas_lote()
+    except (ValueError, AttributeError) as e:
+        return jsonify({'erro': f'Corpo inválido: {e}'}), 400
+    if not entradas:
+        return jsonify({'erro': 'entradas é obrigatório'}), 400
+    if not isinstance(entradas, list):
+        return jsonify({'erro': 'entradas deve ser uma lista'}), 400
+
+    if lote_id:
+        anterior = _resultado_lote_gravado(lote_id)
+        if anterior:
+            return jsonify({**anterior, 'repetido': True})
+
+    # Validar entradas e derivar o dia da semana uma vez por data
+    dias = {}
+    resultados = []
+    validas = []
+    for i, ent in enumerate(entradas):
+        if not isinstance(ent, dict):
+            resultados.append({'indice': i, 'ok': False, 'erro': 'entrada deve ser um objeto'})
+            continue
+        turma_id = ent.get('turma_id')
+        data_str = ent.get('data')
+        registros = ent.get('registros') or []
+        if not turma_id or not data_str or not registros:
+            resultados.append({'indice': i, 'ok': False,
+                               'erro': 'turma_id, data e registros são obrigatórios'})
+            continue
+        if not isinstance(registros, list) or not all(isinstance(r, dict) for r in registros):
+            resultados.append({'indice': i, 'ok': False,
+                               'erro': 'registros deve ser uma lista de objetos'})
+            continue
+        # aluno_id null derrubaria o lote inteiro (NOT NULL); "x" seria gravado
+        # como texto; "3" faria o diff ver alteração em tudo
+        try:
+            turma_id = _id_inteiro(turma_id)
+            registros = [{**r, 'aluno_id': _id_inteiro(r.get('aluno_id'))} for r in registros]
+        except ValueError:
+            resultados.append({'indice': i, 'ok': False,
+                               'erro': 'turma_id e aluno_id devem ser inteiros'})
+            continue
+        if data_str not in dias:
+            dias[data_str] = _dia_semana(data_str)
+        if not dias[data_str]:
+            resultados.append({'indice': i, 'ok': False, 'erro': 'data inválida (use AAAA-MM-DD)'})
+            continue
+        validas.append((i, turma_id, data_str, registros))
+        resultados.append(None)
+
+    # O mesmo (aluno_id, data) em mais de uma entrada: vale a última, como
+    # dentro de uma entrada; as anteriores não o gravam nem o contam.
+    repetidos = {}
+    vistos = set()
+    for k in range(len(validas) - 1, -1, -1):
+        i, turma_id, data_str, registros = validas[k]
+        proprios = {(r.get('aluno_id'), data_str) for r in registros}
+        mantidos = [r for r in registros if (r.get('aluno_id'), data_str) not in vistos]
+        repetidos[i] = len(registros) - len(mantidos)
+        vistos |= proprios
+        validas[k] = (i, turma_id, data_str, mantidos)
+
+    gravados = _frequencia_gravada(
+        {d for _, _, d, _ in validas},
+        {r.get('aluno_id') for _, _, _, regs in validas for r in regs}
+    )
+
+    stmts = []
+    dono = []  # índice da entrada dona de cada instrução
+    afetados = set()
+    totais = {'inseridos': 0, 'atualizados': 0, 'inalterados': 0}
+    for i, turma_id, data_str, registros in validas:
+        linhas, contagem = _diff_frequencia(turma_id, data_str, dias[data_str], registros,
+                                            gravados, afetados)
+        novas = _upsert_frequencia_stmts(linhas)
+        stmts.extend(novas)
+        dono.extend([i] * len(novas))
+        for k in totais:
+            totais[k] += contagem[k]
+        resultados[i] = {'indice': i, 'ok': True, 'turma_id': turma_id, 'data': data_str,
+                         **contagem, 'repetidos': repetidos[i]}
+
+    resposta = {
+        'ok': True,
+        'lote_id': lote_id,
+        'total_entradas': len(entradas),
+        'entradas_aplicadas': len(validas),
+        **totais,
+        'entradas': resultados,
+    }
+    if lote_id:
         stmts.append((
-            """INSERT INTO frequencia (aluno_id, turma_id, data, dia_semana, presente, observacao)
-               VALUES (?, ?, ?, ?, ?, ?)""",
-            [aluno_id, turma_id, data_str, dia_semana, presente, obs]
+            "INSERT INTO frequencia_lotes (lote_id, resultado_json) VALUES (?, ?)",
+            [lote_id, json.dumps(resposta, ensure_ascii=False)]
         ))
 
-    execute_many(stmts)
-    return jsonify({'ok': True, 'total': len(registros)})
+    try:
+        saida = execute_many(stmts)
+    except BatchError as e:
+        if lote_id and e.indice == len(stmts) - 1:
+            # Mesmo lote_id gravado por outra requisição em paralelo
+            anterior = _resultado_lote_gravado(lote_id)
+            if anterior:
+                return jsonify({**anterior, 'repetido': True})
+        entrada = dono[e.indice] if 0 <= e.indice < len(dono) else None
+        return jsonify({'erro': f'Erro ao gravar lote: {e.mensagem}',
+                        'entrada': entrada, 'lote_id': lote_id}), 500
+
+    # saida[:len(dono)]: só as instruções de frequencia (sem o registro do lote)
+    _invalidar_cache_monitor(afetados, sum(r['linhas_afetadas'] for r in saida[:len(dono)]))
+    return jsonify({**resposta, 'repetido': False})
+
+
+@app.route('/api/frequencia/agregados/reconstruir', methods=['POST'])
+def reconstruir_agregados_frequencia():
+    """Recalcula do zero frequencia_diaria e os contadores por aluno."""
+    execute_many([(stmt, None) for stmt in
+                  RECONSTRUIR_FREQUENCIA_DIARIA + RECONSTRUIR_CONTADORES_ALUNO])
+    diaria = query("SELECT COUNT(*) AS n FROM frequencia_diaria", primario=True)[0]['n']
+    contadores = query("SELECT COUNT(*) AS n FROM frequencia_aluno_periodo", primario=True)[0]['n']
+    return jsonify({'ok': True, 'frequencia_diaria': diaria, 'contadores_aluno': contadores})
 
 
 @app.route('/api/frequencia/resumo', methods=['GET'])
@@ -561,12 +2102,16 @@ def resumo_frequencia():
     params = []
     wheres = ["a.ativo = 1"]
 
+    if mes:
+        # Filtro do mês na junção: aluno sem registro no mês aparece com 0
+        intervalo = intervalo_mes(mes)
+        if not intervalo:
+            return jsonify({'erro': 'mes inválido (use AAAA-MM)'}), 400
+        sql += " AND f.data >= ? AND f.data < ?"
+        params.extend(intervalo)
     if turma_id:
         wheres.append("a.turma_id = ?")
         params.append(int(turma_id))
-    if mes:
-        wheres.append("(f.data LIKE ? OR f.data IS NULL)")
-        params.append(f"{mes}%")
 
     sql += " WHERE " + " AND ".join(wheres)
     sql += " GROUP BY a.id, a.nome, a.ra ORDER BY a.nome"
@@ -587,14 +2132,14 @@ def calendario_frequencia():
     ano = request.args.get('ano', str(date.today().year))
     if not turma_id:
         return jsonify({'erro': 'turma_id é obrigatório'}), 400
+    intervalo = intervalo_ano(ano)
+    if not intervalo:
+        return jsonify({'erro': 'ano inválido (use AAAA)'}), 400
     freq = query(
-        """SELECT data,
-                  COUNT(*) as total,
-                  SUM(CASE WHEN presente = 1 THEN 1 ELSE 0 END) as presencas
-           FROM frequencia
-           WHERE turma_id = ? AND data LIKE ?
-           GROUP BY data""",
-        [int(turma_id), f"{ano}%"]
+        """SELECT data, total, presencas
+           FROM frequencia_diaria
+           WHERE turma_id = ? AND data >= ? AND data < ?""",
+        [int(turma_id), *intervalo]
     )
     total_alunos = query(
         "SELECT COUNT(*) as n FROM alunos WHERE turma_id = ? AND ativo = 1",
@@ -610,280 +2155,1175 @@ def calendario_frequencia():
 # ROTAS — DASHBOARD / GRÁFICOS
 # ============================================================
 
-@app.route('/api/dashboard', methods=['GET'])
-def dashboard():
-    """Dados agregados para gráficos do dashboard."""
-
-    # Totais
-    total_alunos = query("SELECT COUNT(*) AS n FROM alunos WHERE ativo = 1")[0]['n']
-    total_turmas = query("SELECT COUNT(*) AS n FROM turmas")[0]['n']
-
-    # Frequência geral
-    freq_geral = query("""
-        SELECT
-            COUNT(*) AS total_registros,
-            SUM(CASE WHEN presente = 1 THEN 1 ELSE 0 END) AS total_presencas
-        FROM frequencia
-    """)
-    total_reg = freq_geral[0]['total_registros'] if freq_geral else 0
-    total_pres = freq_geral[0]['total_presencas'] if freq_geral else 0
-    perc_freq = round((total_pres / total_reg * 100), 1) if total_reg > 0 else 0
-
-    # Alunos por turma
-    por_turma = query("""
-        SELECT t.nome AS turma, COUNT(a.id) AS total
-        FROM turmas t
-        LEFT JOIN alunos a ON a.turma_id = t.id AND a.ativo = 1
-        GROUP BY t.id, t.nome
-        ORDER BY t.nome
-    """)
-
-    # Distribuição por sexo
-    por_sexo = query("""
-        SELECT COALESCE(sexo, 'Não informado') AS categoria, COUNT(*) AS total
-        FROM alunos WHERE ativo = 1
-        GROUP BY sexo ORDER BY total DESC
-    """)
-
-    # Distribuição por raça/cor
-    por_raca = query("""
-        SELECT COALESCE(raca_cor, 'Não informado') AS categoria, COUNT(*) AS total
-        FROM alunos WHERE ativo = 1
-        GROUP BY raca_cor ORDER BY total DESC
-    """)
-
-    # Faixa etária
-    alunos_nasc = query("SELECT data_nascimento FROM alunos WHERE ativo = 1 AND data_nascimento IS NOT NULL AND data_nascimento != ''")
-    faixas = {}
-    for a in alunos_nasc:
-        idade = calcular_idade(a['data_nascimento'])
-        if idade is not None:
-            faixas[idade] = faixas.get(idade, 0) + 1
-    por_idade = [{'idade': k, 'total': v} for k, v in sorted(faixas.items())]
-
-    # Bolsa Família
-    bf = query("""
-        SELECT
-            SUM(CASE WHEN bolsa_familia = 'Sim' THEN 1 ELSE 0 END) AS sim,
-            SUM(CASE WHEN bolsa_familia != 'Sim' OR bolsa_familia IS NULL THEN 1 ELSE 0 END) AS nao
-        FROM alunos WHERE ativo = 1
-    """)
+# Indicadores Sim/Não exibidos no dashboard: chave da resposta → coluna
+INDICADORES_DASHBOARD = {
+    'bolsa_familia': 'bolsa_familia',
+    'deficiencia': 'deficiencia',
+    'internet': 'internet_em_casa',
+    'smartphone': 'smartphone',
+}
 
-    # Deficiência
-    defic = query("""
-        SELECT
-            SUM(CASE WHEN deficiencia = 'Sim' THEN 1 ELSE 0 END) AS sim,
-            SUM(CASE WHEN deficiencia != 'Sim' OR deficiencia IS NULL THEN 1 ELSE 0 END) AS nao
-        FROM alunos WHERE ativo = 1
-    """)
+# Snapshot do dashboard: reaproveitado enquanto alunos/turmas/frequência não
+# mudarem (e no mesmo dia, por causa das idades).
+_dashboard_snapshot = {'chave': None, 'payload': None}
 
-    # Internet em casa
-    internet = query("""
-        SELECT
-            SUM(CASE WHEN internet_em_casa = 'Sim' THEN 1 ELSE 0 END) AS sim,
-            SUM(CASE WHEN internet_em_casa != 'Sim' OR internet_em_casa IS NULL THEN 1 ELSE 0 END) AS nao
-        FROM alunos WHERE ativo = 1
-    """)
 
-    # Smartphone
-    smart = query("""
-        SELECT
-            SUM(CASE WHEN smartphone = 'Sim' THEN 1 ELSE 0 END) AS sim,
-            SUM(CASE WHEN smartphone != 'Sim' OR smartphone IS NULL THEN 1 ELSE 0 END) AS nao
+def _calcular_dashboard():
+    """Monta o payload do dashboard com três leituras, cada uma em uma passada."""
+    # Alunos ativos: uma passada agrupando por sexo × raça × idade (calculada
+    # no SQL), com os indicadores Sim/Não como somas condicionais
+    somas = ',\n'.join(
+        f"SUM(CASE WHEN {col} = 'Sim' THEN 1 ELSE 0 END) AS {chave}"
+        for chave, col in INDICADORES_DASHBOARD.items()
+    )
+    grupos = query(f"""
+        SELECT sexo, raca_cor, {idade_sql()} AS idade, COUNT(*) AS total,
+               {somas}
         FROM alunos WHERE ativo = 1
-    """)
-
-    # Frequência por turma (média)
-    freq_turma = query("""
+        GROUP BY sexo, raca_cor, idade
+    """, [hoje_aaaammdd()])
+
+    total_alunos = 0
+    sexo, raca, faixas = {}, {}, {}
+    sim = dict.fromkeys(INDICADORES_DASHBOARD, 0)
+    for gr in grupos:
+        n = gr['total']
+        total_alunos += n
+        k = gr['sexo'] if gr['sexo'] is not None else 'Não informado'
+        sexo[k] = sexo.get(k, 0) + n
+        k = gr['raca_cor'] if gr['raca_cor'] is not None else 'Não informado'
+        raca[k] = raca.get(k, 0) + n
+        if gr['idade'] is not None:
+            faixas[gr['idade']] = faixas.get(gr['idade'], 0) + n
+        for chave in sim:
+            sim[chave] += gr[chave] or 0
+
+    # Turmas: contagem de alunos e frequência acumulada (agregado diário)
+    turmas = query("""
         SELECT t.nome AS turma,
-               COUNT(f.id) AS total_registros,
-               SUM(CASE WHEN f.presente = 1 THEN 1 ELSE 0 END) AS presencas
+               (SELECT COUNT(*) FROM alunos a
+                WHERE a.turma_id = t.id AND a.ativo = 1) AS total_alunos,
+               (SELECT SUM(fd.total) FROM frequencia_diaria fd
+                WHERE fd.turma_id = t.id) AS total_registros,
+               (SELECT SUM(fd.presencas) FROM frequencia_diaria fd
+                WHERE fd.turma_id = t.id) AS presencas
         FROM turmas t
-        LEFT JOIN frequencia f ON f.turma_id = t.id
-        GROUP BY t.id, t.nome
         ORDER BY t.nome
     """)
-    for ft in freq_turma:
-        tr = ft.get('total_registros', 0) or 0
-        pr = ft.get('presencas', 0) or 0
-        ft['percentual'] = round((pr / tr * 100), 1) if tr > 0 else 0
-
-    # Frequência ao longo do tempo (últimos 30 dias)
-    freq_tempo = query("""
-        SELECT data,
-               COUNT(*) AS total,
-               SUM(CASE WHEN presente = 1 THEN 1 ELSE 0 END) AS presencas
-        FROM frequencia
+    por_turma = [{'turma': t['turma'], 'total': t['total_alunos']} for t in turmas]
+    freq_turma = []
+    for t in turmas:
+        tr = t['total_registros'] or 0
+        pr = t['presencas'] or 0
+        freq_turma.append({
+            'turma': t['turma'],
+            'total_registros': tr,
+            'presencas': t['presencas'],
+            'percentual': round((pr / tr * 100), 1) if tr > 0 else 0,
+        })
+
+    # Frequência por dia: total geral e série dos últimos 60 dias registrados
+    por_dia = query("""
+        SELECT data, SUM(total) AS total, SUM(presencas) AS presencas
+        FROM frequencia_diaria
         GROUP BY data
         ORDER BY data DESC
-        LIMIT 60
     """)
+    total_reg = sum(d['total'] or 0 for d in por_dia)
+    total_pres = sum(d['presencas'] or 0 for d in por_dia)
+    perc_freq = round((total_pres / total_reg * 100), 1) if total_reg > 0 else 0
+
+    freq_tempo = por_dia[:60]
     for ft in freq_tempo:
         t = ft.get('total', 0) or 0
         p = ft.get('presencas', 0) or 0
         ft['percentual'] = round((p / t * 100), 1) if t > 0 else 0
     freq_tempo.reverse()  # mais antigo primeiro
 
-    return jsonify({
+    def sim_nao(chave):
+        if not total_alunos:
+            return {'sim': None, 'nao': None}
+        return {'sim': sim[chave], 'nao': total_alunos - sim[chave]}
+
+    def distribuicao(contagem):
+        itens = sorted(contagem.items(), key=lambda kv: -kv[1])
+        return [{'categoria': k, 'total': v} for k, v in itens]
+
+    return {
         'totais': {
             'alunos': total_alunos,
-            'turmas': total_turmas,
+            'turmas': len(turmas),
             'frequencia_percentual': perc_freq,
             'total_registros_freq': total_reg,
         },
         'por_turma': por_turma,
-        'por_sexo': por_sexo,
-        'por_raca': por_raca,
-        'por_idade': por_idade,
-        'bolsa_familia': bf[0] if bf else {},
-        'deficiencia': defic[0] if defic else {},
-        'internet': internet[0] if internet else {},
-        'smartphone': smart[0] if smart else {},
+        'por_sexo': distribuicao(sexo),
+        'por_raca': distribuicao(raca),
+        'por_idade': [{'idade': k, 'total': v} for k, v in sorted(faixas.items())],
+        'bolsa_familia': sim_nao('bolsa_familia'),
+        'deficiencia': sim_nao('deficiencia'),
+        'internet': sim_nao('internet'),
+        'smartphone': sim_nao('smartphone'),
         'freq_turma': freq_turma,
         'freq_tempo': freq_tempo,
-    })
+    }
+
+
+@app.route('/api/dashboard', methods=['GET'])
+@resposta_condicional(_versao_banco)
+def dashboard():
+    """Dados agregados para gráficos do dashboard (servidos do snapshot em
+    memória enquanto a versão dos dados não mudar)."""
+    v = versao_dados()
+    chave = (v.get('alunos'), v.get('turmas'), v.get('frequencia'), date.today())
+    if _dashboard_snapshot['chave'] != chave:
+        _dashboard_snapshot['payload'] = _calcular_dashboard()
+        _dashboard_snapshot['chave'] = chave
+    return jsonify(_dashboard_snapshot['payload'])
 
 
 # ============================================================
 # ROTAS — IMPORTAÇÃO DE EXCEL/CSV
 # ============================================================
 
+# Parâmetros por instrução multi-linha da importação (abaixo do limite de 999)
+IMPORTAR_PARAMS_MAX = 900
+
+
+# ── Detecção de encoding e separador de CSV ─────────────────
+# Decidida uma vez a partir do início do arquivo, para que o CSV seja lido
+# (e convertido pelo pandas) uma única vez, em vez de uma tentativa
+# completa por combinação de encoding × separador.
+
+CSV_AMOSTRA_BYTES = 64 * 1024
+CSV_SEPARADORES = (';', ',', '\t', '|')
+
+
+def _separador_csv(linha):
+    """Separador mais frequente fora de aspas na linha de cabeçalho (';' no empate/ausência)."""
+    contagem = dict.fromkeys(CSV_SEPARADORES, 0)
+    entre_aspas = False
+    for ch in linha:
+        if ch == '"':
+            entre_aspas = not entre_aspas
+        elif not entre_aspas and ch in contagem:
+            contagem[ch] += 1
+    melhor = max(CSV_SEPARADORES, key=lambda sep: contagem[sep])
+    return melhor if contagem[melhor] else ';'
+
+
+def detectar_formato_csv(amostra):
+    """Bytes iniciais do arquivo → (encoding, separador).
+    BOM indica o encoding; sem BOM, UTF-8 válido na amostra é UTF-8 e o resto
+    é latin-1 (exportações da SED)."""
+    if amostra.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        encoding = 'utf-16'
+    else:
+        try:
+            # Incremental: um caractere multibyte cortado no fim da amostra não é erro
+            codecs.getincrementaldecoder('utf-8')().decode(amostra, final=False)
+            encoding = 'utf-8-sig'
+        except UnicodeDecodeError:
+            encoding = 'latin-1'
+    texto = codecs.getincrementaldecoder(encoding)(errors='replace').decode(amostra)
+    return encoding, _separador_csv(texto.split('\n', 1)[0])
+
+
+def _ler_planilha(nome_arquivo, file_bytes):
+    """Bytes do arquivo → (DataFrame, None) ou (None, (mensagem, status))."""
+    # dtype=str, como na importação em lotes: o mesmo arquivo gera os mesmos
+    # textos (e hashes) em qualquer modo, sem '14177050.0' em colunas com vazios
+    if nome_arquivo.endswith('.xlsx') or nome_arquivo.endswith('.xls'):
+        return pd.read_excel(io.BytesIO(file_bytes), engine='openpyxl', dtype=str), None
+    if not nome_arquivo.endswith('.csv'):
+        return None, ('Formato não suportado. Use .xlsx, .xls ou .csv', 400)
+    encoding, sep = detectar_formato_csv(file_bytes[:CSV_AMOSTRA_BYTES])
+    try:
+        try:
+            df = pd.read_csv(io.BytesIO(file_bytes), sep=sep, encoding=encoding, dtype=str)
+        except UnicodeDecodeError:
+            # Byte inválido depois da amostra: só então uma segunda leitura
+            df = pd.read_csv(io.BytesIO(file_bytes), sep=sep, encoding='latin-1', dtype=str)
+    except Exception as e:
+        return None, (f'Não foi possível ler o CSV: {e}', 400)
+    if len(df.columns) <= 1:
+        return None, ('Não foi possível ler o CSV', 400)
+    return df, None
+
+
+def _texto_colunas(df):
+    """Cada coluna como lista de textos (como safe_val, mas por coluna).
+    Em Python puro por coluna: com ~85 colunas, as operações vetorizadas do
+    pandas custavam mais em overhead do que em trabalho nos arquivos de uma
+    turma (dezenas de linhas)."""
+    inf = float('inf')
+    texto = {}
+    for col in df.columns:
+        valores = ['' if v is None or v != v or v == inf or v == -inf else str(v).strip()
+                   for v in df[col].tolist()]
+        texto[col] = pd.Series(valores, index=df.index, dtype=object)
+    return texto
+
+
+def _registros_importacao(df):
+    """DataFrame → [(registro, série/ano)], com o mapeamento de colunas
+    resolvido uma vez por arquivo. Linhas sem nome são descartadas."""
+    texto = _texto_colunas(df)
+
+    # Coluna do banco → valores já combinados das colunas do arquivo que a
+    # alimentam (a primeira coluna preenchida vence; série/ano: a última)
+    mapeadas = {}
+    extras_cols = []
+    for col in df.columns:
+        db_col = EXCEL_TO_DB.get(col)
+        if not db_col:
+            extras_cols.append(col)  # coluna não mapeada → dados extras
+        elif db_col == '_serie_ano' or db_col in DB_COLUMNS:
+            atual = mapeadas.get(db_col)
+            if atual is None:
+                mapeadas[db_col] = texto[col]
+            elif db_col == '_serie_ano':
+                mapeadas[db_col] = texto[col].where(texto[col] != '', atual)
+            else:
+                mapeadas[db_col] = atual.where(atual != '', texto[col])
+
+    # RA é a chave de (ra, turma): só dígitos, sem zeros à esquerda nem '.0'
+    # (planilhas que gravaram o RA como número)
+    if 'ra' in mapeadas:
+        ra = mapeadas['ra']
+        numerico = ra.str.fullmatch(r'\d+(\.0)?')
+        mapeadas['ra'] = ra.where(
+            ~numerico, ra.str.replace(r'\.0$', '', regex=True).str.lstrip('0').replace('', '0'))
+
+    nomes = list(mapeadas)
+    colunas = [mapeadas[n].tolist() for n in nomes]
+    extras = [texto[c].tolist() for c in extras_cols]
+    vazio = [''] * len(df)
+
+    registros = []
+    for i, valores in enumerate(zip(*colunas) if colunas else ([] for _ in vazio)):
+        record = {n: v for n, v in zip(nomes, valores) if v}
+        if not record.get('nome'):
+            continue
+        extra = {c: col[i] for c, col in zip(extras_cols, extras) if col[i]}
+        if extra:
+            record['dados_json'] = json.dumps(extra, ensure_ascii=False)
+        registros.append((record, record.pop('_serie_ano', '')))
+    return registros
+
+
+def _em_partes(itens, tamanho):
+    for i in range(0, len(itens), tamanho):
+        yield itens[i:i + tamanho]
+
+
+def _hash_registro(record, serie):
+    """Hash do conteúdo importado de um aluno (sem turma_id, que depende do banco)."""
+    dados = {k: v for k, v in record.items() if k not in ('turma_id', 'hash_importacao')}
+    return hashlib.sha1(
+        json.dumps([serie, dados], sort_keys=True, ensure_ascii=False).encode('utf-8')
+    ).hexdigest()[:16]
+
+
+def _plano_importacao(registros):
+    """Resolve turmas e alunos existentes em lote e monta as instruções.
+    Alunos cujo hash de conteúdo não mudou desde a última importação não
+    são regravados. Retorna (instruções, resumo)."""
+    series = list(dict.fromkeys(serie for _, serie in registros if serie))
+
+    # Turmas: uma leitura; as que faltam são criadas na mesma transação
+    turma_ids = {}
+    for parte in _em_partes(series, IMPORTAR_PARAMS_MAX):
+        marcas = ','.join('?' * len(parte))
+        for r in query(f"SELECT id, nome FROM turmas WHERE nome IN ({marcas})", parte, primario=True):
+            turma_ids[r['nome']] = r['id']
+    turmas_novas = [serie for serie in series if serie not in turma_ids]
+    nome_turma = {tid: nome for nome, tid in turma_ids.items()}
+
+    # Alunos já cadastrados por (RA, turma): uma leitura por bloco de turmas
+    existentes = {}
+    hash_atual = {}
+    ids = list(turma_ids.values())
+    for parte in _em_partes(ids, IMPORTAR_PARAMS_MAX):
+        marcas = ','.join('?' * len(parte))
+        rows = query(f"""SELECT id, ra, turma_id, hash_importacao FROM alunos
+                         WHERE turma_id IN ({marcas}) AND ra IS NOT NULL
+                         ORDER BY id""", parte, primario=True)
+        for r in rows:
+            existentes.setdefault((r['ra'], r['turma_id']), r['id'])
+            hash_atual[r['id']] = r['hash_importacao']
+
+    # Linhas repetidas no arquivo (mesmo RA na mesma turma) são mescladas
+    # na ordem do arquivo, como inserir a primeira e atualizar com as demais
+    inserir = []       # [(registro, série nova ou '')]
+    pendentes = {}     # (ra, série) → registro a inserir
+    atualizar = {}     # aluno_id → registro
+    for record, serie in registros:
+        turma_id = turma_ids.get(serie)
+        if turma_id:
+            record['turma_id'] = turma_id
+        ra = record.get('ra', '')
+        if ra and serie:
+            aluno_id = existentes.get((ra, turma_id)) if turma_id else None
+            if aluno_id:
+                atualizar.setdefault(aluno_id, {}).update(record)
+                continue
+            if (ra, serie) in pendentes:
+                pendentes[(ra, serie)].update(record)
+                continue
+            pendentes[(ra, serie)] = record
+        inserir.append((record, serie if serie and not turma_id else ''))
+
+    # Hash calculado depois das mesclas; atualização sem mudança é descartada
+    for record, serie_nova in inserir:
+        record['hash_importacao'] = _hash_registro(
+            record, serie_nova or nome_turma.get(record.get('turma_id'), ''))
+    inalterados = 0
+    for aluno_id, record in list(atualizar.items()):
+        novo = _hash_registro(record, nome_turma[record['turma_id']])
+        if novo == hash_atual.get(aluno_id):
+            del atualizar[aluno_id]
+            inalterados += 1
+        else:
+            record['hash_importacao'] = novo
+    colunas = DB_COLUMNS + ['hash_importacao']
+
+    stmts = []
+    if turmas_novas:
+        stmts.append((
+            f"INSERT OR IGNORE INTO turmas (nome) VALUES {', '.join(['(?)'] * len(turmas_novas))}",
+            turmas_novas,
+        ))
+
+    # INSERT multi-linha agrupando linhas consecutivas com as mesmas colunas
+    # (mantém a ordem do arquivo, e portanto a dos ids)
+    grupo, assinatura = [], None
+    for record, serie_nova in inserir + [(None, '')]:
+        if record is not None:
+            cols = [c for c in colunas if c in record]
+            if serie_nova:
+                cols.append('turma_id')
+            atual = (tuple(cols), bool(serie_nova))
+        if grupo and (record is None or atual != assinatura):
+            cols, nova = assinatura
+            linha = '(' + ', '.join(
+                '(SELECT id FROM turmas WHERE nome = ?)' if nova and c == 'turma_id' else '?'
+                for c in cols) + ')'
+            for parte in _em_partes(grupo, max(1, IMPORTAR_PARAMS_MAX // len(cols))):
+                stmts.append((
+                    f"INSERT INTO alunos ({', '.join(cols)}) VALUES {', '.join([linha] * len(parte))}",
+                    [v for rec, s in parte for v in
+                     (s if nova and c == 'turma_id' else str(rec[c]) for c in cols)],
+                ))
+            grupo = []
+        if record is not None:
+            grupo.append((record, serie_nova))
+            assinatura = atual
+
+    # UPDATE ... FROM (VALUES ...) agrupando alunos com as mesmas colunas
+    por_colunas = {}
+    for aluno_id, record in atualizar.items():
+        cols = tuple(c for c in colunas if c in record)
+        por_colunas.setdefault(cols, []).append((aluno_id, record))
+    for cols, itens in por_colunas.items():
+        sets = ', '.join(f"{c} = v.column{i + 2}" for i, c in enumerate(cols))
+        linha = '(' + ', '.join(['?'] * (len(cols) + 1)) + ')'
+        for parte in _em_partes(itens, max(1, IMPORTAR_PARAMS_MAX // (len(cols) + 1))):
+            stmts.append((
+                f"""UPDATE alunos SET {sets}, atualizado_em = datetime('now')
+                    FROM (VALUES {', '.join([linha] * len(parte))}) AS v
+                    WHERE alunos.id = v.column1""",
+                [v for aluno_id, rec in parte for v in [aluno_id] + [str(rec[c]) for c in cols]],
+            ))
+
+    resumo = {
+        'inseridos': len(inserir),
+        'atualizados': len(atualizar),
+        'inalterados': inalterados,
+        'turmas_novas': len(turmas_novas),
+        'turmas_criadas': len(series),
+    }
+    return stmts, resumo
+
+
+def _hash_arquivo(stream):
+    """SHA-256 do upload, lido em partes; o stream volta ao início."""
+    h = hashlib.sha256()
+    for parte in iter(lambda: stream.read(1024 * 1024), b''):
+        h.update(parte)
+    stream.seek(0)
+    return h.hexdigest()
+
+
+def _importacao_repetida(hash_arquivo):
+    """Resposta de reimportação sem efeito, se o mesmo arquivo já foi importado
+    e alunos e turmas não mudaram desde então; senão None."""
+    rows = query(
+        """SELECT resumo_json FROM importacoes_arquivos
+           WHERE hash = ?
+             AND versao_alunos = (SELECT versao FROM versao_dados WHERE chave = 'alunos')
+             AND versao_turmas = (SELECT versao FROM versao_dados WHERE chave = 'turmas')""",
+        [hash_arquivo], primario=True)
+    if not rows:
+        return None
+    anterior = json.loads(rows[0]['resumo_json'])
+    return {
+        'ok': True,
+        'arquivo_repetido': True,
+        'total_importados': anterior['total_importados'],
+        'total_linhas_arquivo': anterior['total_linhas_arquivo'],
+        'inseridos': 0,
+        'atualizados': 0,
+        'inalterados': anterior['inseridos'] + anterior['atualizados'] + anterior['inalterados'],
+        'turmas_novas': 0,
+        'turmas_criadas': anterior['turmas_criadas'],
+    }
+
+
+def _registro_arquivo(hash_arquivo, nome_arquivo, resumo):
+    """Instrução que registra o arquivo importado. Vai na transação que grava
+    a última parte da importação, para as versões lidas serem as dela."""
+    return ("""INSERT OR REPLACE INTO importacoes_arquivos
+                   (hash, nome_arquivo, resumo_json, versao_alunos, versao_turmas, importado_em)
+               VALUES (?, ?, ?,
+                       (SELECT versao FROM versao_dados WHERE chave = 'alunos'),
+                       (SELECT versao FROM versao_dados WHERE chave = 'turmas'),
+                       datetime('now'))""",
+            [hash_arquivo, nome_arquivo, json.dumps(resumo, ensure_ascii=False)])
+
+
+def _com_ultimo(blocos):
+    """(bloco, é_o_último), lendo um bloco à frente."""
+    anterior = None
+    for bloco in blocos:
+        if anterior is not None:
+            yield anterior, False
+        anterior = bloco
+    if anterior is not None:
+        yield anterior, True
+
+
+# ── Importação em lotes (streaming) ────────────────────────
+# Arquivos grandes (exportações da rede inteira) não cabem em um DataFrame
+# na memória de uma função serverless. No modo em lotes o CSV é lido em
+# blocos e o XLSX pelo iterador read-only do openpyxl; cada bloco é gravado
+# na sua própria transação, então a memória fica limitada ao tamanho do lote.
+
+IMPORTAR_LOTE_LINHAS = int(os.environ.get('IMPORTAR_LOTE_LINHAS', '1000'))
+# Uploads acima deste tamanho usam o modo em lotes mesmo sem ?modo=stream
+IMPORTAR_STREAM_BYTES = int(os.environ.get('IMPORTAR_STREAM_BYTES', str(5 * 1024 * 1024)))
+
+
+def _utf8_valido(stream, pedaco=1024 * 1024):
+    """Confere o arquivo inteiro como UTF-8, lendo aos pedaços, e volta ao início."""
+    decodificador = codecs.getincrementaldecoder('utf-8')()
+    try:
+        while True:
+            dados = stream.read(pedaco)
+            decodificador.decode(dados, final=not dados)
+            if not dados:
+                return True
+    except UnicodeDecodeError:
+        return False
+    finally:
+        stream.seek(0)
+
+
+def _registro_csv(stream):
+    """Próximo registro do CSV em bytes: uma linha, ou mais enquanto houver
+    aspas abertas (campo com quebra de linha). b'' no fim do arquivo."""
+    registro = stream.readline()
+    while registro.count(b'"') % 2:
+        linha = stream.readline()
+        if not linha:
+            break
+        registro += linha
+    return registro
+
+
+def _blocos_csv(stream, linhas=None, inicio=None, encoding=None):
+    """CSV em DataFrames de até `linhas` (IMPORTAR_LOTE_LINHAS) linhas, valores
+    como texto. df.attrs['fim'] é a posição (bytes) logo depois do bloco e
+    df.attrs['encoding'] o encoding usado: com inicio=fim e esse encoding a
+    leitura retoma dali, sem reler nem reconferir o começo do arquivo."""
+    linhas = linhas or IMPORTAR_LOTE_LINHAS
+    detectado, sep = detectar_formato_csv(stream.read(CSV_AMOSTRA_BYTES))
+    stream.seek(0)
+    if encoding is None:
+        encoding = detectado
+        if encoding == 'utf-8-sig' and not _utf8_valido(stream):
+            # Byte latin-1 depois da amostra: sem esta conferência o erro só
+            # apareceria no meio da importação, com blocos anteriores já gravados
+            encoding = 'latin-1'
+    # dtype=str: sem inferência de tipo por bloco (blocos diferentes dariam
+    # '123' e '123.0' para a mesma coluna)
+    if encoding == 'utf-16':
+        # Quebra de linha em 2 bytes: o pandas separa os blocos, sem posição
+        texto = io.TextIOWrapper(stream, encoding=encoding, newline='')
+        for df in pd.read_csv(texto, sep=sep, dtype=str, chunksize=linhas):
+            df.attrs.update(fim=None, encoding=encoding)
+            yield df
+        return
+    cabecalho = _registro_csv(stream)
+    if inicio:
+        stream.seek(inicio)
+    while True:
+        bloco = []
+        while len(bloco) < linhas:
+            registro = _registro_csv(stream)
+            if not registro:
+                break
+            if registro.strip():
+                bloco.append(registro)
+        if not bloco:
+            return
+        df = pd.read_csv(io.BytesIO(cabecalho + b''.join(bloco)), sep=sep,
+                         encoding=encoding, dtype=str)
+        df.attrs.update(fim=stream.tell(), encoding=encoding)
+        yield df
+
+
+def _blocos_xlsx(stream, linhas=None, inicio=None):
+    """XLSX (primeira planilha) em DataFrames de até `linhas` (IMPORTAR_LOTE_LINHAS)
+    linhas. df.attrs['fim'] é o número da última linha da planilha lida no
+    bloco; com inicio=fim a leitura retoma na linha seguinte."""
+    from openpyxl import load_workbook
+    linhas_lote = linhas or IMPORTAR_LOTE_LINHAS
+    livro = load_workbook(stream, read_only=True, data_only=True)
+    try:
+        planilha = livro.active
+        cabecalho = next(planilha.iter_rows(max_row=1, values_only=True), None)
+        if cabecalho is None:
+            return
+        # Mesmos nomes que o pandas daria (vazias e repetidas)
+        colunas, vistos = [], {}
+        for i, nome in enumerate(cabecalho):
+            nome = f'Unnamed: {i}' if nome is None else str(nome)
+            if nome in vistos:
+                vistos[nome] += 1
+                nome = f'{nome}.{vistos[nome]}'
+            else:
+                vistos[nome] = 0
+            colunas.append(nome)
+        primeira = (inicio or 1) + 1
+        bloco = []
+        for numero, linha in enumerate(planilha.iter_rows(min_row=primeira, values_only=True),
+                                       start=primeira):
+            if not any(v is not None for v in linha):
+                continue
+            bloco.append(linha[:len(colunas)])
+            if len(bloco) >= linhas_lote:
+                df = pd.DataFrame(bloco, columns=colunas, dtype=object)
+                df.attrs['fim'] = numero
+                yield df
+                bloco = []
+        if bloco:
+            df = pd.DataFrame(bloco, columns=colunas, dtype=object)
+            df.attrs['fim'] = numero
+            yield df
+    finally:
+        livro.close()
+
+
+def _importar_em_lotes(arquivo, nome_arquivo, hash_arquivo=None):
+    """Importa bloco a bloco, cada um em uma transação. Gera um dict de
+    progresso por bloco e, no fim, o resumo (com 'ok') ou o erro."""
+    if nome_arquivo.endswith('.csv'):
+        blocos = _blocos_csv(arquivo.stream)
+    elif nome_arquivo.endswith('.xlsx'):
+        blocos = _blocos_xlsx(arquivo.stream)
+    else:
+        yield {'erro': 'Modo em lotes aceita .csv ou .xlsx'}
+        return
+
+    totais = {'total_importados': 0, 'total_linhas_arquivo': 0,
+              'inseridos': 0, 'atualizados': 0, 'inalterados': 0, 'turmas_novas': 0}
+    series = set()
+    gravados = 0
+    try:
+        for df, ultimo in _com_ultimo(blocos):
+            registros = _registros_importacao(df)
+            series.update(serie for _, serie in registros if serie)
+            stmts, resumo = _plano_importacao(registros)
+            parcial = dict(totais)
+            parcial['total_importados'] += len(registros)
+            parcial['total_linhas_arquivo'] += len(df)
+            for k in ('inseridos', 'atualizados', 'inalterados', 'turmas_novas'):
+                parcial[k] += resumo[k]
+            if ultimo and hash_arquivo:
+                stmts.append(_registro_arquivo(hash_arquivo, arquivo.filename,
+                                               {**parcial, 'turmas_criadas': len(series)}))
+            if stmts:
+                execute_many(stmts)
+            gravados += 1
+            totais = parcial
+            yield {'lote': gravados, 'linhas': len(df), **totais}
+    except Exception as e:
+        motivo = e.mensagem if isinstance(e, BatchError) else str(e)
+        # Lotes anteriores já estão gravados; o que falhou não grava nada
+        yield {'erro': f'Erro no lote {gravados + 1}: {motivo}', 'lote': gravados + 1,
+               'lotes_gravados': gravados, **totais}
+        return
+
+    if not totais['total_linhas_arquivo']:
+        yield {'erro': 'Arquivo vazio'}
+        return
+    yield {'ok': True, 'lotes': gravados, 'turmas_criadas': len(series), **totais}
+
+
 @app.route('/api/importar', methods=['POST'])
 def importar_arquivo():
-    """Importa dados de um arquivo Excel (.xlsx) ou CSV."""
+    """Importa dados de um arquivo Excel (.xlsx) ou CSV.
+    O arquivo inteiro é gravado em uma transação: turmas e alunos existentes
+    são resolvidos com poucas leituras e as escritas vão em lote.
+    Com ?modo=stream (ou upload maior que IMPORTAR_STREAM_BYTES) importa em
+    lotes; no modo stream a resposta é NDJSON com o progresso de cada lote.
+    Com ?modo=assincrono o arquivo entra na fila de importações e a resposta
+    (202) traz o job_id para acompanhar em GET /api/importar/<job_id>.
+    ?modo=auto (tela de importação) usa a fila só acima de IMPORTAR_STREAM_BYTES.
+    Reenviar um arquivo idêntico sem alterações no banco desde a importação
+    anterior não grava nada (arquivo_repetido); nos demais casos só os
+    alunos com conteúdo diferente são regravados (inalterados no resumo)."""
     if 'arquivo' not in request.files:
         return jsonify({'erro': 'Nenhum arquivo enviado'}), 400
 
     arquivo = request.files['arquivo']
     nome_arquivo = arquivo.filename.lower()
 
+    modo = request.args.get('modo') or request.form.get('modo')
+    if modo == 'auto':
+        grande = (request.content_length or 0) > IMPORTAR_STREAM_BYTES
+        modo = 'assincrono' if grande and nome_arquivo.endswith(('.csv', '.xlsx')) else None
+
+    # Mesmo arquivo já importado e nada mudou desde então: nada a gravar
+    hash_arquivo = _hash_arquivo(arquivo.stream)
+    repetida = _importacao_repetida(hash_arquivo)
+    if repetida:
+        if modo == 'stream':
+            return Response(json.dumps(repetida, ensure_ascii=False) + '\n',
+                            mimetype='application/x-ndjson')
+        return jsonify(repetida)
+
+    if modo == 'assincrono':
+        job_id, erro = _enfileirar_importacao(arquivo, nome_arquivo, hash_arquivo)
+        if erro:
+            return jsonify({'erro': erro[0]}), erro[1]
+        _garantir_worker_importacao()
+        return jsonify({'ok': True, 'job_id': job_id, 'status': 'pendente',
+                        'status_url': f'/api/importar/{job_id}'}), 202
+    if modo == 'stream':
+        def gerar():
+            for progresso in _importar_em_lotes(arquivo, nome_arquivo, hash_arquivo):
+                yield json.dumps(progresso, ensure_ascii=False) + '\n'
+        return Response(stream_with_context(gerar()), mimetype='application/x-ndjson',
+                        headers={'X-Accel-Buffering': 'no'})
+    if (request.content_length or 0) > IMPORTAR_STREAM_BYTES:
+        final = None
+        for final in _importar_em_lotes(arquivo, nome_arquivo, hash_arquivo):
+            pass
+        if 'erro' in final:
+            return jsonify(final), 400 if 'lote' not in final else 500
+        return jsonify(final)
+
+    try:
+        # Ler com Pandas
+        df, erro = _ler_planilha(nome_arquivo, arquivo.read())
+        if erro:
+            return jsonify({'erro': erro[0]}), erro[1]
+
+        if df.empty:
+            return jsonify({'erro': 'Arquivo vazio'}), 400
+
+        registros = _registros_importacao(df)
+        stmts, resumo = _plano_importacao(registros)
+        resposta = {
+            'ok': True,
+            'total_importados': len(registros),
+            'total_linhas_arquivo': len(df),
+            **resumo,
+        }
+        stmts.append(_registro_arquivo(hash_arquivo, arquivo.filename, resposta))
+        try:
+            execute_many(stmts)
+        except BatchError as e:
+            return jsonify({'erro': f'Erro ao gravar importação: {e.mensagem}',
+                            'indice': e.indice}), 500
+
+        return jsonify(resposta)
+
+    except Exception as e:
+        return jsonify({'erro': f'Erro ao processar arquivo: {str(e)}'}), 500
+
+
+# ── Importação assíncrona (fila no banco + worker) ───────────
+# O request só guarda o arquivo e devolve o job_id; um worker (thread do
+# próprio processo ou `python api/index.py importar-worker`) processa bloco
+# a bloco. Cada bloco grava alunos, registro em importacoes_lotes e
+# contadores na mesma transação: um job interrompido (sem heartbeat há
+# IMPORTAR_JOB_TIMEOUT s) é reassumido e continua do bloco seguinte.
+
+IMPORTAR_JOB_PARTE_BYTES = 256 * 1024
+IMPORTAR_JOB_PARTES_POR_LOTE = 8
+IMPORTAR_JOB_TIMEOUT = int(os.environ.get('IMPORTAR_JOB_TIMEOUT', '120'))
+IMPORTAR_JOB_TENTATIVAS = int(os.environ.get('IMPORTAR_JOB_TENTATIVAS', '3'))
+# Intervalo entre consultas à fila no worker dedicado (CLI)
+IMPORTAR_JOB_OCIOSO = float(os.environ.get('IMPORTAR_JOB_OCIOSO', '5'))
+# Cada consulta de status grava blocos do job por até este tempo. Em funções
+# serverless (Vercel) a thread congela junto com a função depois da
+# resposta, então é a própria consulta que faz o job andar.
+IMPORTAR_JOB_ETAPA_SEGUNDOS = float(os.environ.get('IMPORTAR_JOB_ETAPA_SEGUNDOS', '4'))
+IMPORTAR_JOB_THREAD = os.environ.get('IMPORTAR_JOB_THREAD',
+                                     '0' if os.environ.get('VERCEL') else '1') == '1'
+
+_worker_importacao = {'lock': threading.Lock(), 'thread': None}
+
+
+def _estimar_linhas_xlsx(stream):
+    """Linhas de dados declaradas na dimensão da planilha (None se ausente)."""
+    from openpyxl import load_workbook
+    try:
+        livro = load_workbook(stream, read_only=True, data_only=True)
+        try:
+            max_row = livro.active.max_row
+        finally:
+            livro.close()
+    except Exception:
+        return None
+    finally:
+        stream.seek(0)
+    return max(max_row - 1, 0) if max_row else None
+
+
+def _enfileirar_importacao(arquivo, nome_arquivo, hash_arquivo=None):
+    """Grava o upload em partes e cria o job. Retorna (job_id, None) ou (None, (msg, status))."""
+    if not nome_arquivo.endswith(('.csv', '.xlsx')):
+        return None, ('Importação assíncrona aceita .csv ou .xlsx', 400)
+    stream = arquivo.stream
+    estimado = _estimar_linhas_xlsx(stream) if nome_arquivo.endswith('.xlsx') else None
+
+    job_id = uuid.uuid4().hex
+    execute("INSERT INTO importacoes (id, nome_arquivo, lote_linhas, hash_arquivo) VALUES (?, ?, ?, ?)",
+            [job_id, arquivo.filename, IMPORTAR_LOTE_LINHAS, hash_arquivo])
+    try:
+        tamanho = quebras = parte = 0
+        ultimo = b''
+        pendentes = []
+        while True:
+            dados = stream.read(IMPORTAR_JOB_PARTE_BYTES)
+            if not dados:
+                break
+            tamanho += len(dados)
+            quebras += dados.count(b'\n')
+            ultimo = dados[-1:]
+            pendentes.append((
+                "INSERT INTO importacoes_partes (importacao_id, parte, dados) VALUES (?, ?, ?)",
+                [job_id, parte, dados]))
+            parte += 1
+            if len(pendentes) >= IMPORTAR_JOB_PARTES_POR_LOTE:
+                execute_many(pendentes)
+                pendentes = []
+        if not tamanho:
+            execute("DELETE FROM importacoes WHERE id = ?", [job_id])
+            return None, ('Arquivo vazio', 400)
+        if estimado is None and nome_arquivo.endswith('.csv'):
+            # Linhas menos o cabeçalho (campos com quebra de linha contam a mais)
+            estimado = max(quebras - (1 if ultimo == b'\n' else 0), 0)
+        pendentes.append((
+            """UPDATE importacoes SET status = 'pendente', tamanho_bytes = ?,
+                   total_linhas_estimado = ?, atualizado_em = datetime('now')
+               WHERE id = ?""", [tamanho, estimado, job_id]))
+        execute_many(pendentes)
+    except Exception:
+        execute_many([
+            ("DELETE FROM importacoes_partes WHERE importacao_id = ?", [job_id]),
+            ("DELETE FROM importacoes WHERE id = ?", [job_id]),
+        ])
+        raise
+    return job_id, None
+
+
+def _reivindicar_importacao(job_id=None):
+    """Assume o próximo job pendente ou interrompido (ou só `job_id`, se
+    informado). Retorna a linha do job ou None."""
+    dono = uuid.uuid4().hex
+    limite = f'-{IMPORTAR_JOB_TIMEOUT} seconds'
+    so_job = " AND id = ?" if job_id else ""
+    resultado = execute_many([
+        # Interrompidos vezes demais: desiste (o arquivo provavelmente derruba o worker)
+        ("""DELETE FROM importacoes_partes WHERE importacao_id IN (
+                SELECT id FROM importacoes WHERE status = 'processando'
+                   AND atualizado_em < datetime('now', ?) AND tentativas >= ?)""",
+         [limite, IMPORTAR_JOB_TENTATIVAS]),
+        ("""UPDATE importacoes SET status = 'erro', concluido_em = datetime('now'),
+                   erro = 'Interrompida ' || tentativas || ' vez(es); envie o arquivo novamente'
+            WHERE status = 'processando' AND atualizado_em < datetime('now', ?)
+              AND tentativas >= ?""", [limite, IMPORTAR_JOB_TENTATIVAS]),
+        # Pendente já iniciado = pausado ao fim de uma etapa: a vazão continua
+        # contando da última retomada de verdade
+        (f"""UPDATE importacoes SET status = 'processando', dono = ?,
+                   tentativas = tentativas + 1,
+                   iniciado_em = COALESCE(iniciado_em, datetime('now')),
+                   retomado_em = CASE WHEN status = 'pendente' AND retomado_em IS NOT NULL
+                                      THEN retomado_em ELSE datetime('now') END,
+                   linhas_na_retomada = CASE WHEN status = 'pendente' AND retomado_em IS NOT NULL
+                                             THEN linhas_na_retomada ELSE linhas_processadas END,
+                   atualizado_em = datetime('now')
+            WHERE id = (SELECT id FROM importacoes
+                        WHERE (status = 'pendente'
+                               OR (status = 'processando' AND atualizado_em < datetime('now', ?))){so_job}
+                        ORDER BY criado_em LIMIT 1)""", [dono, limite] + ([job_id] if job_id else [])),
+    ])
+    if not resultado[-1]['linhas_afetadas']:
+        return None
+    rows = query("SELECT * FROM importacoes WHERE dono = ?", [dono], primario=True)
+    return rows[0] if rows else None
+
+
+def _arquivo_da_importacao(job_id, destino, desde=None):
+    """Remonta o upload a partir das partes gravadas. Com `desde` (byte de
+    retomada do CSV) baixa só a primeira parte (cabeçalho e amostra do
+    formato) e as partes a partir dessa posição, cada uma no seu lugar."""
+    parte = 0
+    if desde:
+        tamanhos = query(
+            """SELECT parte, length(dados) AS n FROM importacoes_partes
+               WHERE importacao_id = ? ORDER BY parte""", [job_id], primario=True)
+        inicio_parte = 0
+        for r in tamanhos:
+            parte = r['parte']
+            if inicio_parte + r['n'] > desde:
+                break
+            inicio_parte += r['n']
+        if parte > 0:
+            rows = query("""SELECT dados FROM importacoes_partes
+                             WHERE importacao_id = ? AND parte = 0""", [job_id], primario=True)
+            destino.write(bytes(rows[0]['dados']))
+            destino.seek(inicio_parte)
+    while True:
+        rows = query(
+            """SELECT parte, dados FROM importacoes_partes
+               WHERE importacao_id = ? AND parte >= ? ORDER BY parte LIMIT ?""",
+            [job_id, parte, IMPORTAR_JOB_PARTES_POR_LOTE], primario=True)
+        if not rows:
+            break
+        for r in rows:
+            destino.write(bytes(r['dados']))
+        parte = rows[-1]['parte'] + 1
+    destino.seek(0)
+
+
+def _finalizar_importacao(job_id, erro=None):
+    status = 'erro' if erro else 'concluida'
+    execute_many([
+        ("""UPDATE importacoes SET status = ?, erro = ?, concluido_em = datetime('now'),
+                   atualizado_em = datetime('now')
+            WHERE id = ? AND status = 'processando'""", [status, erro, job_id]),
+        ("DELETE FROM importacoes_partes WHERE importacao_id = ?", [job_id]),
+    ])
+
+
+def _pausar_importacao(job):
+    """Devolve o job à fila depois de uma etapa (não conta como interrupção)."""
+    execute(
+        """UPDATE importacoes SET status = 'pendente', dono = NULL,
+               tentativas = tentativas - 1, atualizado_em = datetime('now')
+           WHERE id = ? AND dono = ? AND status = 'processando'""",
+        [job['id'], job['dono']])
+
+
+def _processar_importacao(job, prazo=None):
+    """Processa os blocos ainda não gravados do job. Com `prazo`
+    (time.monotonic()), para depois do bloco que o ultrapassar e devolve o
+    job à fila."""
+    job_id = job['id']
+    nome = job['nome_arquivo'].lower()
+    series = set(json.loads(job['series_json']))
+    totais = {'total_importados': job['total_importados'],
+              'total_linhas_arquivo': job['linhas_processadas'],
+              'inseridos': job['inseridos'], 'atualizados': job['atualizados'],
+              'inalterados': job['inalterados'], 'turmas_novas': job['turmas_novas']}
+    # Com a posição do último bloco gravado a leitura continua dali; sem
+    # ela (CSV UTF-16) os blocos já gravados são relidos e pulados
+    inicio = job['retomar_em']
+    lote = job['lotes_gravados'] if inicio is not None else 0
+    e_csv = nome.endswith('.csv')
     try:
-        # Ler com Pandas
-        file_bytes = arquivo.read()
-        if nome_arquivo.endswith('.xlsx') or nome_arquivo.endswith('.xls'):
-            df = pd.read_excel(io.BytesIO(file_bytes), engine='openpyxl')
-        elif nome_arquivo.endswith('.csv'):
-            # Tenta detectar separador e encoding
-            for enc in ('utf-8-sig', 'latin-1', 'cp1252'):
-                for sep in (';', ','):
-                    try:
-                        df = pd.read_csv(io.BytesIO(file_bytes), sep=sep, encoding=enc)
-                        if len(df.columns) > 1:
-                            break
-                        df = None
-                    except Exception:
-                        df = None
-                if df is not None and len(df.columns) > 1:
-                    break
-            if df is None:
-                return jsonify({'erro': 'Não foi possível ler o CSV'}), 400
-        else:
-            return jsonify({'erro': 'Formato não suportado. Use .xlsx, .xls ou .csv'}), 400
-
-        if df.empty:
-            return jsonify({'erro': 'Arquivo vazio'}), 400
+        with tempfile.TemporaryFile() as arq:
+            _arquivo_da_importacao(job_id, arq, inicio if e_csv else None)
+            blocos = (_blocos_csv(arq, job['lote_linhas'], inicio, job['encoding']) if e_csv
+                      else _blocos_xlsx(arq, job['lote_linhas'], inicio))
+            for df, ultimo in _com_ultimo(blocos):
+                lote += 1
+                if lote <= job['lotes_gravados']:
+                    continue  # já gravado antes da interrupção
+                registros = _registros_importacao(df)
+                series.update(serie for _, serie in registros if serie)
+                stmts, resumo = _plano_importacao(registros)
+                totais['total_importados'] += len(registros)
+                totais['total_linhas_arquivo'] += len(df)
+                for k in ('inseridos', 'atualizados', 'inalterados', 'turmas_novas'):
+                    totais[k] += resumo[k]
+                stmts.append(("INSERT INTO importacoes_lotes (importacao_id, lote) VALUES (?, ?)",
+                              [job_id, lote]))
+                guarda = len(stmts) - 1
+                stmts.append((
+                    """UPDATE importacoes SET lotes_gravados = ?,
+                           linhas_processadas = linhas_processadas + ?,
+                           total_importados = total_importados + ?,
+                           inseridos = inseridos + ?, atualizados = atualizados + ?,
+                           inalterados = inalterados + ?, turmas_novas = turmas_novas + ?,
+                           series_json = ?, retomar_em = ?, encoding = ?,
+                           atualizado_em = datetime('now')
+                       WHERE id = ?""",
+                    [lote, len(df), len(registros), resumo['inseridos'], resumo['atualizados'],
+                     resumo['inalterados'], resumo['turmas_novas'],
+                     json.dumps(sorted(series), ensure_ascii=False),
+                     df.attrs.get('fim'), df.attrs.get('encoding'), job_id]))
+                if ultimo and job['hash_arquivo']:
+                    stmts.append(_registro_arquivo(job['hash_arquivo'], job['nome_arquivo'],
+                                                   {**totais, 'turmas_criadas': len(series)}))
+                try:
+                    execute_many(stmts)
+                except BatchError as e:
+                    if e.indice == guarda:
+                        return  # outro worker reassumiu o job e já gravou este bloco
+                    raise
+                if prazo is not None and not ultimo and time.monotonic() >= prazo:
+                    _pausar_importacao(job)
+                    return
+    except Exception as e:
+        motivo = e.mensagem if isinstance(e, BatchError) else str(e)
+        _finalizar_importacao(job_id, f'Erro no lote {lote}: {motivo}')
+        return
+    _finalizar_importacao(job_id, None if lote else 'Arquivo vazio')
 
-        total_importados = 0
-        turmas_criadas = set()
 
-        for _, row in df.iterrows():
-            record = {}
-            extras = {}
+def _executar_fila_importacao():
+    """Processa jobs até a fila esvaziar."""
+    with app.app_context():
+        while True:
+            try:
+                job = _reivindicar_importacao()
+            except Exception as e:
+                print(f"[importacoes] Erro ao consultar a fila: {e}")
+                return
+            if job is None:
+                return
+            _processar_importacao(job)
+
+
+def _garantir_worker_importacao():
+    """Inicia a thread do worker se nenhuma estiver rodando neste processo
+    (nada em serverless: ali o job anda pelas consultas de status)."""
+    if not IMPORTAR_JOB_THREAD:
+        return
+    with _worker_importacao['lock']:
+        thread = _worker_importacao['thread']
+        if thread is not None and thread.is_alive():
+            return
+        thread = threading.Thread(target=_executar_fila_importacao, daemon=True,
+                                  name='importacoes')
+        _worker_importacao['thread'] = thread
+        thread.start()
+
+
+def _data_utc(texto):
+    if not texto:
+        return None
+    return datetime.strptime(texto, '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc)
+
+
+def _resumo_importacao(job):
+    """Progresso do job: linhas, erro, vazão (linhas/s desde a última retomada) e ETA."""
+    status = job['status']
+    linhas = job['linhas_processadas']
+    total = job['total_linhas_estimado']
+    if status == 'concluida':
+        total = linhas
+
+    vazao = eta = None
+    retomado = _data_utc(job['retomado_em'])
+    if retomado:
+        fim = datetime.now(timezone.utc) if status == 'processando' else _data_utc(job['atualizado_em'])
+        decorrido = (fim - retomado).total_seconds()
+        feitas = linhas - job['linhas_na_retomada']
+        if decorrido > 0 and feitas > 0:
+            vazao = round(feitas / decorrido, 1)
+    if status in ('pendente', 'processando') and vazao and total:
+        eta = round(max(total - linhas, 0) / vazao)
+
+    return {
+        'job_id': job['id'],
+        'arquivo': job['nome_arquivo'],
+        'status': status,
+        'lotes_gravados': job['lotes_gravados'],
+        'linhas_processadas': linhas,
+        'total_linhas_estimado': total,
+        'percentual': min(100.0, round(100 * linhas / total, 1)) if total else None,
+        'linhas_por_segundo': vazao,
+        'eta_segundos': eta,
+        'total_importados': job['total_importados'],
+        'total_linhas_arquivo': linhas,
+        'inseridos': job['inseridos'],
+        'atualizados': job['atualizados'],
+        'inalterados': job['inalterados'],
+        'turmas_novas': job['turmas_novas'],
+        'turmas_criadas': len(json.loads(job['series_json'])),
+        'tentativas': job['tentativas'],
+        'erro': job['erro'],
+        'criado_em': job['criado_em'],
+        'iniciado_em': job['iniciado_em'],
+        'concluido_em': job['concluido_em'],
+    }
 
-            # Mapear colunas conhecidas
-            for excel_col in df.columns:
-                val = safe_val(row.get(excel_col, ''))
-                if not val:
-                    continue
 
-                db_col = EXCEL_TO_DB.get(excel_col)
-                if db_col:
-                    if db_col == '_serie_ano':
-                        record['_serie_ano'] = val
-                    elif db_col in DB_COLUMNS:
-                        # Se já tem valor, não sobrescrever (priorizar colunas primárias)
-                        if db_col not in record or not record[db_col]:
-                            record[db_col] = val
-                else:
-                    # Coluna não mapeada → dados extras
-                    extras[excel_col] = val
-
-            # Nome é obrigatório
-            nome = record.get('nome', '').strip()
-            if not nome:
-                continue
+@app.route('/api/importar/<job_id>', methods=['GET'])
+def status_importacao(job_id):
+    """Progresso de uma importação assíncrona. Se o job estiver parado
+    (pendente ou interrompido), a própria consulta grava blocos dele por até
+    IMPORTAR_JOB_ETAPA_SEGUNDOS; com um worker ativo, só informa o progresso."""
+    rows = query("SELECT * FROM importacoes WHERE id = ?", [job_id], primario=True)
+    if not rows:
+        return jsonify({'erro': 'Importação não encontrada'}), 404
+    job = rows[0]
+    if job['status'] in ('pendente', 'processando'):
+        _garantir_worker_importacao()
+        reivindicado = _reivindicar_importacao(job_id)
+        if reivindicado:
+            _processar_importacao(reivindicado, time.monotonic() + IMPORTAR_JOB_ETAPA_SEGUNDOS)
+            job = query("SELECT * FROM importacoes WHERE id = ?", [job_id], primario=True)[0]
+    return jsonify(_resumo_importacao(job))
+
+
+# ── Importação de vários arquivos em um ZIP ────────────────
+# A extensão do SED gera um CSV por série/ano; um ZIP com a escola inteira
+# é lido em paralelo (um arquivo por processo: a conversão das linhas em
+# registros é Python puro e segura o GIL) e gravado em uma única transação,
+# como um arquivo só. Os processos saem de um forkserver (spawn onde não
+# há), nunca de fork direto: o servidor tem threads (pool de conexões, SSE,
+# worker de importação) e o filho herdaria locks presos. Onde não há
+# processos (funções serverless sem /dev/shm) a leitura é feita no próprio
+# processo.
+
+IMPORTAR_ZIP_PROCESSOS = int(os.environ.get('IMPORTAR_ZIP_PROCESSOS', str(min(4, os.cpu_count() or 1))))
+# Limite do conteúdo descompactado (proteção contra ZIPs "bomba")
+IMPORTAR_ZIP_MAX_BYTES = int(os.environ.get('IMPORTAR_ZIP_MAX_BYTES', str(200 * 1024 * 1024)))
+IMPORTAR_ZIP_EXTENSOES = ('.csv', '.xlsx', '.xls')
+
+
+def _registros_membro_zip(nome, dados):
+    """Um arquivo do ZIP → registros (roda nos processos do pool; o retorno
+    volta por pickle). Sem série/ano na linha, vale o nome do arquivo."""
+    try:
+        df, erro = _ler_planilha(nome.lower(), dados)
+        if erro:
+            return {'arquivo': nome, 'erro': erro[0]}
+        registros = _registros_importacao(df)
+    except Exception as e:
+        return {'arquivo': nome, 'erro': str(e)}
+    padrao = os.path.splitext(os.path.basename(nome))[0].strip()
+    return {'arquivo': nome, 'linhas': len(df),
+            'registros': [(record, serie or padrao) for record, serie in registros]}
+
+
+def _contexto_processos():
+    """forkserver com o módulo pré-carregado (cada processo já nasce com
+    pandas e as funções de leitura); spawn onde não há forkserver."""
+    if 'forkserver' not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('spawn')
+    contexto = multiprocessing.get_context('forkserver')
+    contexto.set_forkserver_preload(['pandas', __name__])
+    return contexto
+
+
+def _mapear_em_processos(funcao, itens):
+    """[funcao(*item)] na ordem dos itens, em um pool de processos quando
+    possível. Retorna (resultados, processos usados)."""
+    n = min(IMPORTAR_ZIP_PROCESSOS, len(itens))
+    if n > 1:
+        try:
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(max_workers=n, mp_context=_contexto_processos()) as pool:
+                return list(pool.map(funcao, *zip(*itens))), n
+        except Exception as e:
+            print(f"[importar-zip] Pool de processos indisponível ({e}); lendo no processo atual")
+    return [funcao(*item) for item in itens], 1
 
-            # Criar/obter turma
-            serie_ano = record.pop('_serie_ano', '')
-            turma_id = None
-            if serie_ano:
-                if serie_ano not in turmas_criadas:
-                    existing = query("SELECT id FROM turmas WHERE nome = ?", [serie_ano])
-                    if existing:
-                        turma_id = existing[0]['id']
-                    else:
-                        turma_id = execute(
-                            "INSERT INTO turmas (nome) VALUES (?)", [serie_ano]
-                        )
-                    turmas_criadas.add(serie_ano)
-                else:
-                    existing = query("SELECT id FROM turmas WHERE nome = ?", [serie_ano])
-                    turma_id = existing[0]['id'] if existing else None
-
-            if turma_id:
-                record['turma_id'] = turma_id
-
-            # Guardar extras como JSON
-            if extras:
-                record['dados_json'] = json.dumps(extras, ensure_ascii=False)
-
-            # Verificar se aluno já existe (mesmo RA na mesma turma)
-            ra = record.get('ra', '')
-            if ra and turma_id:
-                existing = query(
-                    "SELECT id FROM alunos WHERE ra = ? AND turma_id = ?",
-                    [ra, turma_id]
-                )
-                if existing:
-                    # Atualizar aluno existente
-                    sets = []
-                    vals = []
-                    for col in DB_COLUMNS:
-                        v = record.get(col)
-                        if v is not None:
-                            sets.append(f"{col} = ?")
-                            vals.append(str(v))
-                    if sets:
-                        sets.append("atualizado_em = datetime('now')")
-                        vals.append(existing[0]['id'])
-                        execute(f"UPDATE alunos SET {', '.join(sets)} WHERE id = ?", vals)
-                    total_importados += 1
-                    continue
 
-            # Inserir novo aluno
-            cols = []
-            vals = []
-            for col in DB_COLUMNS:
-                v = record.get(col)
-                if v is not None:
-                    cols.append(col)
-                    vals.append(str(v))
-
-            if cols:
-                placeholders = ', '.join(['?'] * len(cols))
-                col_names = ', '.join(cols)
-                execute(f"INSERT INTO alunos ({col_names}) VALUES ({placeholders})", vals)
-                total_importados += 1
+def _membros_zip(stream):
+    """Arquivos de planilha do ZIP → ([(nome, bytes)], None) ou (None, (mensagem, status))."""
+    try:
+        pacote = zipfile.ZipFile(stream)
+    except zipfile.BadZipFile:
+        return None, ('ZIP inválido', 400)
+    with pacote:
+        infos = [
+            info for info in pacote.infolist()
+            if not info.is_dir()
+            and not info.filename.startswith('__MACOSX/')
+            and not os.path.basename(info.filename).startswith('.')
+            and info.filename.lower().endswith(IMPORTAR_ZIP_EXTENSOES)
+        ]
+        if not infos:
+            return None, ('O ZIP não contém arquivos .csv, .xlsx ou .xls', 400)
+        if sum(info.file_size for info in infos) > IMPORTAR_ZIP_MAX_BYTES:
+            return None, ('Conteúdo do ZIP excede o limite de importação', 413)
+        infos.sort(key=lambda info: info.filename)
+        return [(info.filename, pacote.read(info)) for info in infos], None
+
+
+@app.route('/api/importar/zip', methods=['POST'])
+def importar_zip():
+    """Importa um ZIP com vários arquivos (ex.: um CSV por série/ano).
+    Os arquivos são lidos em paralelo e gravados juntos em uma transação;
+    se algum não puder ser lido, nada é gravado."""
+    if 'arquivo' not in request.files:
+        return jsonify({'erro': 'Nenhum arquivo enviado'}), 400
+    arquivo = request.files['arquivo']
 
-        return jsonify({
-            'ok': True,
-            'total_importados': total_importados,
-            'turmas_criadas': len(turmas_criadas),
-            'total_linhas_arquivo': len(df),
-        })
+    hash_arquivo = _hash_arquivo(arquivo.stream)
+    repetida = _importacao_repetida(hash_arquivo)
+    if repetida:
+        return jsonify(repetida)
+
+    membros, erro = _membros_zip(arquivo.stream)
+    if erro:
+        return jsonify({'erro': erro[0]}), erro[1]
+
+    inicio = time.perf_counter()
+    lidos, processos = _mapear_em_processos(_registros_membro_zip, membros)
+    leitura_ms = round((time.perf_counter() - inicio) * 1000, 1)
+    del membros
+
+    falhas = [{'arquivo': r['arquivo'], 'erro': r['erro']} for r in lidos if 'erro' in r]
+    if falhas:
+        return jsonify({'erro': f'{len(falhas)} arquivo(s) não puderam ser lidos; nada foi importado',
+                        'arquivos': falhas}), 400
+
+    registros = [item for r in lidos for item in r['registros']]
+    if not registros:
+        return jsonify({'erro': 'Nenhum aluno encontrado no ZIP'}), 400
+    stmts, resumo = _plano_importacao(registros)
+    resposta = {
+        'ok': True,
+        'total_importados': len(registros),
+        'total_linhas_arquivo': sum(r['linhas'] for r in lidos),
+        **resumo,
+    }
+    stmts.append(_registro_arquivo(hash_arquivo, arquivo.filename, resposta))
+    try:
+        execute_many(stmts)
+    except BatchError as e:
+        return jsonify({'erro': f'Erro ao gravar importação: {e.mensagem}',
+                        'indice': e.indice}), 500
 
-    except Exception as e:
-        return jsonify({'erro': f'Erro ao processar arquivo: {str(e)}'}), 500
+    return jsonify({
+        **resposta,
+        'arquivos': [{'arquivo': r['arquivo'], 'linhas': r['linhas'],
+                      'alunos': len(r['registros'])} for r in lidos],
+        'processos': processos,
+        'leitura_ms': leitura_ms,
+    })
 
 
 # ============================================================
@@ -898,6 +3338,9 @@ def relatorio_freq_mensal():
 
     if not turma_id or not mes:
         return jsonify({'erro': 'turma_id e mes são obrigatórios'}), 400
+    intervalo = intervalo_mes(mes)
+    if not intervalo:
+        return jsonify({'erro': 'mes inválido (use AAAA-MM)'}), 400
 
     # Dados dos alunos
     alunos = query(
@@ -907,8 +3350,9 @@ def relatorio_freq_mensal():
 
     # Frequência do mês
     freq = query(
-        "SELECT aluno_id, data, presente, observacao FROM frequencia WHERE turma_id = ? AND data LIKE ?",
-        [int(turma_id), f"{mes}%"]
+        """SELECT aluno_id, data, presente, observacao FROM frequencia
+           WHERE turma_id = ? AND data >= ? AND data < ?""",
+        [int(turma_id), *intervalo]
     )
 
     # Construir mapa aluno→datas
@@ -952,6 +3396,7 @@ def relatorio_freq_mensal():
         'turma': turma_info[0]['nome'] if turma_info else '',
         'mes': mes,
         'datas': datas,
+        'dias_letivos': dias_letivos_entre(intervalo[0], (date.fromisoformat(intervalo[1]) - timedelta(days=1)).isoformat()),
         'alunos': resultado,
     })
 
@@ -978,12 +3423,15 @@ def relatorio_perfil_turma():
     por_sexo = df['sexo'].fillna('Não informado').value_counts().to_dict()
     por_raca = df['raca_cor'].fillna('Não informado').value_counts().to_dict()
 
-    # Idades
-    idades = []
-    for _, row in df.iterrows():
-        idade = calcular_idade(row.get('data_nascimento', ''))
-        if idade is not None:
-            idades.append(idade)
+    # Idades: histograma agrupado no SQL
+    por_idade = query(f"""
+        SELECT {idade_sql()} AS idade, COUNT(*) AS total
+        FROM alunos
+        WHERE turma_id = ? AND ativo = 1 AND nascimento IS NOT NULL
+        GROUP BY idade
+        ORDER BY idade
+    """, [hoje_aaaammdd(), int(turma_id)])
+    idades = [p['idade'] for p in por_idade for _ in range(p['total'])]
 
     # Indicadores
     def contar_sim(coluna):
@@ -1006,7 +3454,8 @@ def relatorio_perfil_turma():
         'total_alunos': len(alunos),
         'por_sexo': [{'categoria': k, 'total': v} for k, v in por_sexo.items()],
         'por_raca': [{'categoria': k, 'total': v} for k, v in por_raca.items()],
-        'idades': sorted(idades),
+        'idades': idades,
+        'por_idade': por_idade,
         'indicadores': indicadores,
     })
 
@@ -1095,6 +3544,10 @@ def ia_analisar_frequencia():
     if not turma_id:
         return jsonify({'erro': 'turma_id é obrigatório'}), 400
 
+    intervalo = intervalo_mes(mes) if mes else None
+    if mes and not intervalo:
+        return jsonify({'erro': 'mes inválido (use AAAA-MM)'}), 400
+
     if not GROQ_API_KEY:
         return jsonify({'erro': 'GROQ_API_KEY não configurada'}), 500
 
@@ -1108,11 +3561,11 @@ def ia_analisar_frequencia():
                        COUNT(f.id) as total_dias,
                        SUM(CASE WHEN f.presente = 1 THEN 1 ELSE 0 END) as presencas
                 FROM alunos a
-                LEFT JOIN frequencia f ON a.id = f.aluno_id AND f.data LIKE ?
+                LEFT JOIN frequencia f ON a.id = f.aluno_id AND f.data >= ? AND f.data < ?
                 WHERE a.turma_id = ? AND a.ativo = 1
                 GROUP BY a.id, a.nome, a.ra
                 ORDER BY a.nome
-            """, [f"{mes}%", int(turma_id)])
+            """, [*intervalo, int(turma_id)])
         else:
             freq_data = query("""
                 SELECT a.nome, a.ra,
@@ -1315,8 +3768,14 @@ def corrigir_duplicados():
             grupo_sorted = sorted(grupo, key=lambda x: x['id'])
             manter = grupo_sorted[-1]
             for a in grupo_sorted[:-1]:
-                execute("DELETE FROM frequencia WHERE aluno_id = ?", [a['id']])
-                execute("DELETE FROM alunos WHERE id = ?", [a['id']])
+                afetados = {(r['turma_id'], r['data']) for r in query(
+                    "SELECT DISTINCT turma_id, data FROM frequencia WHERE aluno_id = ?",
+                    [a['id']], primario=True)}
+                saida = execute_many([
+                    ("DELETE FROM frequencia WHERE aluno_id = ?", [a['id']]),
+                    ("DELETE FROM alunos WHERE id = ?", [a['id']]),
+                ])
+                _invalidar_cache_monitor(afetados, saida[0]['linhas_afetadas'])
                 ids_removidos.append(a['id'])
                 removidos += 1
 
@@ -1348,76 +3807,6 @@ ALL_TURMAS_ORDENADAS = (
     PERIODOS['manha'] + PERIODOS['tarde'] + PERIODOS['noite']
 )
 
-# ============================================================
-# CALENDÁRIO PEDAGÓGICO 2026 — Estado de São Paulo (SEDUC-SP)
-# ============================================================
-
-CALENDARIO_PEDAGOGICO_2026 = {
-    "ano": 2026,
-    "inicio_aulas": "2026-02-02",
-    "fim_aulas": "2026-12-17",
-    "total_dias_letivos": 200,
-    "bimestres": [
-        {"bimestre": 1, "inicio": "2026-02-02", "fim": "2026-04-22", "dias_letivos": 55},
-        {"bimestre": 2, "inicio": "2026-04-23", "fim": "2026-07-09", "dias_letivos": 50},
-        {"bimestre": 3, "inicio": "2026-07-24", "fim": "2026-10-02", "dias_letivos": 50},
-        {"bimestre": 4, "inicio": "2026-10-05", "fim": "2026-12-17", "dias_letivos": 45},
-    ],
-    "feriados": [
-        {"data": "2026-01-01", "descricao": "Confraternização Universal"},
-        {"data": "2026-01-25", "descricao": "Aniversário de São Paulo"},
-        {"data": "2026-02-16", "descricao": "Carnaval (Ponto Facultativo)"},
-        {"data": "2026-02-17", "descricao": "Carnaval"},
-        {"data": "2026-02-18", "descricao": "Quarta-feira de Cinzas (Ponto Facultativo)"},
-        {"data": "2026-04-02", "descricao": "Paixão de Cristo"},
-        {"data": "2026-04-21", "descricao": "Tiradentes"},
-        {"data": "2026-05-01", "descricao": "Dia do Trabalho"},
-        {"data": "2026-06-04", "descricao": "Corpus Christi"},
-        {"data": "2026-06-05", "descricao": "Ponto Facultativo (Corpus Christi)"},
-        {"data": "2026-09-07", "descricao": "Independência do Brasil"},
-        {"data": "2026-10-12", "descricao": "Nossa Senhora Aparecida / Dia das Crianças"},
-        {"data": "2026-11-02", "descricao": "Finados"},
-        {"data": "2026-11-15", "descricao": "Proclamação da República"},
-        {"data": "2026-11-20", "descricao": "Dia da Consciência Negra"},
-        {"data": "2026-12-25", "descricao": "Natal"},
-    ],
-    "recessos": [
-        {"inicio": "2026-01-01", "fim": "2026-01-31", "descricao": "Recesso/Planejamento de Janeiro"},
-        {"inicio": "2026-07-10", "fim": "2026-07-23", "descricao": "Recesso Escolar de Julho"},
-        {"inicio": "2026-12-18", "fim": "2026-12-31", "descricao": "Recesso de Dezembro"},
-    ],
-    "avaliacoes": [
-        {"inicio": "2026-03-16", "fim": "2026-03-27", "descricao": "AAP 1 — Avaliação de Aprendizagem em Processo", "bimestre": 1},
-        {"inicio": "2026-05-18", "fim": "2026-05-29", "descricao": "AAP 2 — Avaliação de Aprendizagem em Processo", "bimestre": 2},
-        {"inicio": "2026-08-17", "fim": "2026-08-28", "descricao": "AAP 3 — Avaliação de Aprendizagem em Processo", "bimestre": 3},
-        {"inicio": "2026-10-19", "fim": "2026-10-30", "descricao": "AAP 4 — Avaliação de Aprendizagem em Processo", "bimestre": 4},
-    ],
-    "conselhos": [
-        {"inicio": "2026-04-20", "fim": "2026-04-22", "descricao": "Conselho de Classe/Série — 1º Bimestre"},
-        {"inicio": "2026-07-07", "fim": "2026-07-09", "descricao": "Conselho de Classe/Série — 2º Bimestre"},
-        {"inicio": "2026-09-30", "fim": "2026-10-02", "descricao": "Conselho de Classe/Série — 3º Bimestre"},
-        {"inicio": "2026-12-15", "fim": "2026-12-17", "descricao": "Conselho de Classe/Série — 4º Bimestre"},
-    ],
-    "reunioes_pais": [
-        {"data": "2026-02-06", "descricao": "Reunião de Pais e Mestres — Acolhimento"},
-        {"data": "2026-05-08", "descricao": "Reunião de Pais e Mestres — 1º Bimestre"},
-        {"data": "2026-08-07", "descricao": "Reunião de Pais e Mestres — 2º Bimestre"},
-        {"data": "2026-10-16", "descricao": "Reunião de Pais e Mestres — 3º Bimestre"},
-    ],
-    "replanejamentos": [
-        {"data": "2026-02-02", "descricao": "Planejamento Escolar — Início do Ano"},
-        {"data": "2026-07-24", "descricao": "Replanejamento — Início do 2º Semestre"},
-    ],
-    "olimpiadas": [
-        {"inicio": "2026-03-02", "fim": "2026-03-13", "descricao": "Olimpíada Brasileira de Matemática (OBMEP) — 1ª Fase"},
-        {"inicio": "2026-06-01", "fim": "2026-06-12", "descricao": "Olimpíada de Língua Portuguesa"},
-        {"inicio": "2026-09-14", "fim": "2026-09-25", "descricao": "OBMEP — 2ª Fase"},
-    ],
-    "provao_paulista": [
-        {"inicio": "2026-10-26", "fim": "2026-11-06", "descricao": "Provão Paulista — Fase Única (3ª Série)"},
-    ],
-}
-
 # ============================================================
 # DADOS CSV — Frequência até 28/02/2026
 # ============================================================
@@ -1541,11 +3930,22 @@ def get_csv_data():
 
 @app.route('/api/calendario-pedagogico', methods=['GET'])
 def calendario_pedagogico():
-    """Retorna o calendário pedagógico 2026 completo."""
-    return jsonify(CALENDARIO_PEDAGOGICO_2026)
+    """Retorna o calendário pedagógico 2026 completo, com a situação de hoje."""
+    hoje = date.today().isoformat()
+    bimestre = bimestre_vigente(hoje)
+    return jsonify({
+        **CALENDARIO_PEDAGOGICO_2026,
+        'hoje': {
+            'data': hoje,
+            'dia_letivo': eh_dia_letivo(hoje),
+            'bimestre': bimestre['bimestre'] if bimestre else None,
+            'dias_letivos_ate_hoje': chamadas_esperadas(hoje),
+        },
+    })
 
 
 @app.route('/api/frequencia-csv', methods=['GET'])
+@resposta_condicional(lambda: _versao_arquivos(CSV_FREQ_PATH))
 def frequencia_csv():
     """
     Retorna dados de frequência do CSV (SEDUC-SP) processados.
@@ -1653,7 +4053,11 @@ def _calcular_periodo_datas(tipo_periodo, referencia=None):
         return inicio.isoformat(), fim.isoformat()
 
     elif tipo_periodo == 'bimestral':
-        # Bimestre escolar baseado no mês
+        # Bimestre letivo do calendário pedagógico
+        bimestre = bimestre_vigente(ref)
+        if bimestre:
+            return bimestre['inicio'], bimestre['fim']
+        # Fora do ano do calendário: pares de meses
         mes = ref.month
         if mes <= 2:
             inicio = ref.replace(month=1, day=1)
@@ -1683,7 +4087,195 @@ def _calcular_periodo_datas(tipo_periodo, referencia=None):
     return ref.isoformat(), ref.isoformat()
 
 
+def _chave_contador(data_inicio, data_fim):
+    """Chave de frequencia_aluno_periodo que cobre exatamente [inicio, fim]:
+    'AAAA-MM' para um mês inteiro, 'AAAA-Bn' para um bimestre letivo, senão None."""
+    ini = date.fromisoformat(data_inicio)
+    fim = date.fromisoformat(data_fim)
+    if ini.day == 1 and (fim + timedelta(days=1)).day == 1 and (ini.year, ini.month) == (fim.year, fim.month):
+        return data_inicio[:7]
+    for b in CALENDARIO_PEDAGOGICO_2026['bimestres']:
+        if b['inicio'] == data_inicio and b['fim'] == data_fim:
+            return f"{data_inicio[:4]}-B{b['bimestre']}"
+    return None
+
+
+ALUNOS_CRITICOS_LIMITE = 50
+# Mesmo corte do cálculo em Python: round(perc, 1) < 75 ⇔ perc < 74.95
+ALUNOS_CRITICOS_CORTE = 74.95
+
+
+def _alunos_criticos(data_inicio, data_fim, turma_ids):
+    """Alunos ativos das turmas com < 75% de presença no período, do pior
+    para o melhor (no máximo ALUNOS_CRITICOS_LIMITE)."""
+    placeholders_ids = ','.join(['?' for _ in turma_ids])
+    chave = _chave_contador(data_inicio, data_fim)
+    if chave:
+        # Top-K pelo índice (periodo, percentual): para ao achar o limite
+        rows = query(f"""
+            SELECT a.id, a.nome, a.ra, a.turma_id, t.nome AS turma_nome,
+                   c.total AS total_dias, c.presencas, c.faltas
+            FROM frequencia_aluno_periodo c
+            JOIN alunos a ON a.id = c.aluno_id
+            JOIN turmas t ON t.id = a.turma_id
+            WHERE c.periodo = ? AND c.percentual < ?
+              AND a.ativo = 1 AND a.turma_id IN ({placeholders_ids})
+            ORDER BY c.percentual ASC, a.id
+            LIMIT ?
+        """, [chave, ALUNOS_CRITICOS_CORTE] + turma_ids + [ALUNOS_CRITICOS_LIMITE])
+    else:
+        # Janela sem contador (dia, semana, ano): agrega frequencia
+        rows = query(f"""
+            SELECT a.id, a.nome, a.ra, a.turma_id, t.nome AS turma_nome,
+                   COUNT(f.id) AS total_dias,
+                   SUM(CASE WHEN f.presente = 1 THEN 1 ELSE 0 END) AS presencas,
+                   SUM(CASE WHEN f.presente = 0 THEN 1 ELSE 0 END) AS faltas
+            FROM alunos a
+            JOIN turmas t ON t.id = a.turma_id
+            JOIN frequencia f ON f.aluno_id = a.id AND f.data >= ? AND f.data <= ?
+            WHERE a.ativo = 1 AND a.turma_id IN ({placeholders_ids})
+            GROUP BY a.id, a.nome, a.ra, a.turma_id, t.nome
+            HAVING presencas * 100.0 / total_dias < ?
+            ORDER BY presencas * 1.0 / total_dias ASC, a.id
+            LIMIT ?
+        """, [data_inicio, data_fim] + turma_ids + [ALUNOS_CRITICOS_CORTE, ALUNOS_CRITICOS_LIMITE])
+
+    criticos = []
+    for ac in rows:
+        total = ac['total_dias'] or 0
+        pres = ac['presencas'] or 0
+        criticos.append({
+            'id': ac['id'],
+            'nome': ac['nome'],
+            'ra': ac['ra'],
+            'turma': ac['turma_nome'],
+            'presencas': pres,
+            'faltas': ac['faltas'] or 0,
+            'total_dias': total,
+            'percentual': round((pres / total * 100), 1),
+        })
+    return criticos
+
+
+# ── Cache de resultados do monitoramento ────────────────────
+# As mesmas combinações (periodo, turno, nivel, data_ref) são pedidas o tempo
+# todo por várias telas. Resultados ficam num LRU limitado, com TTL, e uma
+# gravação de frequência invalida só as entradas que cobrem as turmas e datas
+# gravadas. Mudanças em alunos/turmas, ou frequência gravada por outra
+# instância (versão dos dados mudou sem gravação local), limpam o cache todo.
+
+MONITOR_CACHE_MAX = int(os.environ.get('MONITOR_CACHE_MAX', '256'))
+MONITOR_CACHE_TTL = float(os.environ.get('MONITOR_CACHE_TTL', '60'))
+
+_cache_monitor = {
+    'lock': threading.Lock(),
+    'itens': OrderedDict(),   # chave → {expira, turmas, inicio, fim, payload, status}
+    'versoes': None,          # (alunos, turmas, frequencia) já conciliadas
+    'escritas_locais': 0,     # invalidações seletivas desde a última conciliação
+    'geracao': 0,             # muda a cada invalidação (descarta cálculos em curso)
+}
+_cache_monitor_stats = {'acertos': 0, 'faltas': 0, 'expiradas': 0, 'invalidadas': 0, 'descartadas': 0}
+
+
+def _limpar_cache_monitor():
+    """Esvazia o cache (chamar com o lock)."""
+    _cache_monitor_stats['invalidadas'] += len(_cache_monitor['itens'])
+    _cache_monitor['itens'].clear()
+    _cache_monitor['geracao'] += 1
+
+
+def _conciliar_cache_monitor(v):
+    """Compara a versão dos dados `v` (lida com versao_dados() antes de
+    pegar o lock, que pode consultar o banco) com a última vista (chamar
+    com o lock)."""
+    atual = (v.get('alunos'), v.get('turmas'), v.get('frequencia'))
+    anterior = _cache_monitor['versoes']
+    if atual == anterior:
+        return
+    # Leitura mais velha que a já conciliada (outra thread passou na frente)
+    if anterior is not None and all(a is not None and b is not None and a <= b
+                                    for a, b in zip(atual, anterior)):
+        return
+    # Os gatilhos somam 1 por linha de frequencia gravada: se o salto não bate
+    # exatamente com as linhas gravadas (e já invalidadas) por este processo,
+    # houve escrita de fora e o cache inteiro é descartado.
+    if (anterior is None or atual[:2] != anterior[:2]
+            or atual[2] != anterior[2] + _cache_monitor['escritas_locais']):
+        _limpar_cache_monitor()
+    _cache_monitor['versoes'] = atual
+    _cache_monitor['escritas_locais'] = 0
+
+
+def _invalidar_cache_monitor(afetados, linhas_gravadas):
+    """Remove as entradas que cobrem algum (turma_id, data) gravado.
+    linhas_gravadas: linhas de frequencia de fato escritas (linhas_afetadas),
+    conferidas depois contra o salto da versão em _conciliar_cache_monitor."""
+    if not afetados and not linhas_gravadas:
+        return
+    with _cache_monitor['lock']:
+        itens = _cache_monitor['itens']
+        for chave in [k for k, e in itens.items()
+                      if any(tid in e['turmas'] and e['inicio'] <= d <= e['fim']
+                             for tid, d in afetados)]:
+            del itens[chave]
+            _cache_monitor_stats['invalidadas'] += 1
+        _cache_monitor['escritas_locais'] += linhas_gravadas
+        _cache_monitor['geracao'] += 1
+
+
+def _cache_monitor_obter(chave, calcular, escopo):
+    """Resultado em cache para `chave` ou calcular() → (payload, status).
+    escopo(payload) → (turma_ids, data_inicio, data_fim) que o resultado cobre."""
+    versao = versao_dados()
+    with _cache_monitor['lock']:
+        _conciliar_cache_monitor(versao)
+        itens = _cache_monitor['itens']
+        entrada = itens.get(chave)
+        if entrada and entrada['expira'] > time.monotonic():
+            itens.move_to_end(chave)
+            _cache_monitor_stats['acertos'] += 1
+            return entrada['payload'], entrada['status']
+        if entrada:
+            del itens[chave]
+            _cache_monitor_stats['expiradas'] += 1
+        _cache_monitor_stats['faltas'] += 1
+        geracao = _cache_monitor['geracao']
+
+    payload, status = calcular()
+    if status != 200:
+        return payload, status
+
+    turmas, inicio, fim = escopo(payload)
+    with _cache_monitor['lock']:
+        # Gravação durante o cálculo: o resultado pode já estar velho
+        if _cache_monitor['geracao'] == geracao:
+            itens[chave] = {
+                'expira': time.monotonic() + MONITOR_CACHE_TTL,
+                'turmas': frozenset(turmas), 'inicio': inicio, 'fim': fim,
+                'payload': payload, 'status': status,
+            }
+            while len(itens) > MONITOR_CACHE_MAX:
+                itens.popitem(last=False)
+                _cache_monitor_stats['descartadas'] += 1
+    return payload, status
+
+
+def _escopo_monitoramento(payload):
+    return [t['id'] for t in payload['turmas']], payload['data_inicio'], payload['data_fim']
+
+
+def _filtro_monitoramento(args):
+    """(periodo, turno, nivel, data_ref) a partir dos parâmetros da requisição."""
+    return (
+        args.get('periodo', 'diario'),
+        args.get('turno', 'todos'),
+        args.get('nivel', 'todos'),
+        args.get('data_ref', ''),
+    )
+
+
 @app.route('/api/monitoramento', methods=['GET'])
+@resposta_condicional(_versao_banco)
 def monitoramento():
     """
     Endpoint principal do painel de monitoramento.
@@ -1693,64 +4285,119 @@ def monitoramento():
       - nivel: ensino_medio|ensino_medio_iftp|fundamental_final|todos
       - data_ref: YYYY-MM-DD (data de referência)
     """
-    tipo_periodo = request.args.get('periodo', 'diario')
-    turno = request.args.get('turno', 'todos')
-    nivel = request.args.get('nivel', 'todos')
-    data_ref = request.args.get('data_ref', '')
+    payload, status = _obter_monitoramento(_filtro_monitoramento(request.args))
+    return jsonify(payload), status
 
-    data_inicio, data_fim = _calcular_periodo_datas(tipo_periodo, data_ref or None)
 
-    # Filtrar turmas por turno e nível
+def _obter_monitoramento(filtro):
+    """Monitoramento de um filtro pelo cache (rota e stream SSE) → (payload, status)."""
+    tipo_periodo, turno, nivel, data_ref = filtro
+    return _cache_monitor_obter(
+        ('monitoramento', tipo_periodo, turno, nivel, data_ref or date.today().isoformat()),
+        lambda: _calcular_monitoramento(*filtro),
+        _escopo_monitoramento,
+    )
+
+
+def _turmas_do_filtro(turno, nivel):
+    """Nomes das turmas do turno/nível, na ordem de ALL_TURMAS_ORDENADAS."""
     turmas_filtro = set(ALL_TURMAS_ORDENADAS)
     if turno != 'todos' and turno in PERIODOS:
         turmas_filtro &= set(PERIODOS[turno])
     if nivel != 'todos' and nivel in NIVEIS:
         turmas_filtro &= set(NIVEIS[nivel])
+    return sorted(turmas_filtro, key=lambda x: ALL_TURMAS_ORDENADAS.index(x) if x in ALL_TURMAS_ORDENADAS else 999)
+
+
+def _monitoramento_vazio(tipo_periodo, data_inicio, data_fim, turno, nivel):
+    return {
+        'periodo': tipo_periodo,
+        'data_inicio': data_inicio,
+        'data_fim': data_fim,
+        'turno': turno,
+        'nivel': nivel,
+        'resumo': {'total_turmas': 0, 'total_alunos': 0, 'media_frequencia': 0, 'total_presencas': 0, 'total_faltas': 0},
+        'turmas': [],
+        'alunos_criticos': [],
+    }
+
+
+def _alunos_por_turma(turma_ids):
+    """{turma_id: nº de alunos ativos}."""
+    placeholders_ids = ','.join(['?' for _ in turma_ids])
+    rows = query(f"""
+        SELECT turma_id, COUNT(*) AS total
+        FROM alunos
+        WHERE ativo = 1 AND turma_id IN ({placeholders_ids})
+        GROUP BY turma_id
+    """, turma_ids)
+    return {r['turma_id']: r['total'] for r in rows}
+
 
-    turmas_filtro = sorted(turmas_filtro, key=lambda x: ALL_TURMAS_ORDENADAS.index(x) if x in ALL_TURMAS_ORDENADAS else 999)
+def _calcular_monitoramento(tipo_periodo, turno, nivel, data_ref):
+    """Payload do monitoramento para um filtro → (dict, status HTTP).
+    Usado pela rota e pelo stream SSE (fora de requisição)."""
+    data_inicio, data_fim = _calcular_periodo_datas(tipo_periodo, data_ref or None)
 
+    # Filtrar turmas por turno e nível
+    turmas_filtro = _turmas_do_filtro(turno, nivel)
     if not turmas_filtro:
-        return jsonify({'erro': 'Nenhuma turma para o filtro selecionado'}), 400
+        return {'erro': 'Nenhuma turma para o filtro selecionado'}, 400
 
     turma_map = _obter_turma_ids(turmas_filtro)
     if not turma_map:
-        return jsonify({
-            'periodo': tipo_periodo,
-            'data_inicio': data_inicio,
-            'data_fim': data_fim,
-            'turno': turno,
-            'nivel': nivel,
-            'resumo': {'total_turmas': 0, 'total_alunos': 0, 'media_frequencia': 0, 'total_presencas': 0, 'total_faltas': 0},
-            'turmas': [],
-            'alunos_criticos': [],
-        })
+        return _monitoramento_vazio(tipo_periodo, data_inicio, data_fim, turno, nivel), 200
 
     turma_ids = list(turma_map.values())
     placeholders_ids = ','.join(['?' for _ in turma_ids])
 
     # Total de alunos por turma
-    alunos_por_turma = query(f"""
-        SELECT turma_id, COUNT(*) AS total
-        FROM alunos
-        WHERE ativo = 1 AND turma_id IN ({placeholders_ids})
-        GROUP BY turma_id
-    """, turma_ids)
-    alunos_map = {r['turma_id']: r['total'] for r in alunos_por_turma}
+    alunos_map = _alunos_por_turma(turma_ids)
 
     # Frequência no período
     freq_turma = query(f"""
-        SELECT f.turma_id,
-               COUNT(DISTINCT f.data) AS dias_registrados,
-               COUNT(f.id) AS total_registros,
-               SUM(CASE WHEN f.presente = 1 THEN 1 ELSE 0 END) AS presencas,
-               SUM(CASE WHEN f.presente = 0 THEN 1 ELSE 0 END) AS faltas
-        FROM frequencia f
-        WHERE f.turma_id IN ({placeholders_ids})
-          AND f.data >= ? AND f.data <= ?
-        GROUP BY f.turma_id
+        SELECT fd.turma_id,
+               COUNT(*) AS dias_registrados,
+               SUM(fd.total) AS total_registros,
+               SUM(fd.presencas) AS presencas,
+               SUM(fd.faltas) AS faltas
+        FROM frequencia_diaria fd
+        WHERE fd.turma_id IN ({placeholders_ids})
+          AND fd.data >= ? AND fd.data <= ?
+        GROUP BY fd.turma_id
     """, turma_ids + [data_inicio, data_fim])
     freq_map = {r['turma_id']: r for r in freq_turma}
 
+    # Alunos críticos (< 75% de frequência no período)
+    criticos = _alunos_criticos(data_inicio, data_fim, turma_ids)
+
+    # Frequência diária no período (para gráfico temporal)
+    freq_diaria = query(f"""
+        SELECT fd.data,
+               SUM(fd.total) AS total,
+               SUM(fd.presencas) AS presencas
+        FROM frequencia_diaria fd
+        WHERE fd.turma_id IN ({placeholders_ids})
+          AND fd.data >= ? AND fd.data <= ?
+        GROUP BY fd.data
+        ORDER BY fd.data
+    """, turma_ids + [data_inicio, data_fim])
+
+    return _montar_monitoramento(
+        tipo_periodo, data_inicio, data_fim, turno, nivel,
+        turmas_filtro, turma_map, alunos_map, freq_map, criticos, freq_diaria,
+    ), 200
+
+
+def _montar_monitoramento(tipo_periodo, data_inicio, data_fim, turno, nivel,
+                          turmas_filtro, turma_map, alunos_map, freq_map,
+                          criticos, freq_diaria):
+    """Monta o payload do monitoramento a partir das leituras já feitas."""
+    # Denominadores do calendário: dias letivos da janela e chamadas que já
+    # deveriam ter sido feitas (até hoje)
+    dias_letivos = dias_letivos_entre(data_inicio, data_fim)
+    esperadas = dias_letivos_entre(data_inicio, min(data_fim, date.today().isoformat()))
+
     # Montar dados por turma
     turmas_resultado = []
     total_alunos_geral = 0
@@ -1789,6 +4436,7 @@ def monitoramento():
             'presencas': presencas,
             'faltas': faltas,
             'dias_registrados': dias,
+            'chamadas_pendentes': max(esperadas - dias, 0),
             'percentual': perc,
             'periodo': periodo_turma,
             'nivel': nivel_turma,
@@ -1801,51 +4449,6 @@ def monitoramento():
     total_geral = total_presencas_geral + total_faltas_geral
     media_geral = round((total_presencas_geral / total_geral * 100), 1) if total_geral > 0 else 0
 
-    # Alunos críticos (< 75% de frequência no período)
-    alunos_criticos = query(f"""
-        SELECT a.id, a.nome, a.ra, a.turma_id, t.nome AS turma_nome,
-               COUNT(f.id) AS total_dias,
-               SUM(CASE WHEN f.presente = 1 THEN 1 ELSE 0 END) AS presencas,
-               SUM(CASE WHEN f.presente = 0 THEN 1 ELSE 0 END) AS faltas
-        FROM alunos a
-        JOIN turmas t ON t.id = a.turma_id
-        LEFT JOIN frequencia f ON f.aluno_id = a.id AND f.data >= ? AND f.data <= ?
-        WHERE a.ativo = 1 AND a.turma_id IN ({placeholders_ids})
-        GROUP BY a.id, a.nome, a.ra, a.turma_id, t.nome
-        HAVING total_dias > 0
-        ORDER BY presencas * 1.0 / total_dias ASC
-    """, [data_inicio, data_fim] + turma_ids)
-
-    criticos = []
-    for ac in alunos_criticos:
-        total = ac['total_dias'] or 0
-        pres = ac['presencas'] or 0
-        if total > 0:
-            perc_aluno = round((pres / total * 100), 1)
-            if perc_aluno < 75:
-                criticos.append({
-                    'id': ac['id'],
-                    'nome': ac['nome'],
-                    'ra': ac['ra'],
-                    'turma': ac['turma_nome'],
-                    'presencas': pres,
-                    'faltas': ac['faltas'] or 0,
-                    'total_dias': total,
-                    'percentual': perc_aluno,
-                })
-
-    # Frequência diária no período (para gráfico temporal)
-    freq_diaria = query(f"""
-        SELECT f.data,
-               COUNT(f.id) AS total,
-               SUM(CASE WHEN f.presente = 1 THEN 1 ELSE 0 END) AS presencas
-        FROM frequencia f
-        WHERE f.turma_id IN ({placeholders_ids})
-          AND f.data >= ? AND f.data <= ?
-        GROUP BY f.data
-        ORDER BY f.data
-    """, turma_ids + [data_inicio, data_fim])
-
     for fd in freq_diaria:
         t = fd.get('total', 0) or 0
         p = fd.get('presencas', 0) or 0
@@ -1866,12 +4469,14 @@ def monitoramento():
                 'total_turmas': len(ids_periodo),
             }
 
-    return jsonify({
+    return {
         'periodo': tipo_periodo,
         'data_inicio': data_inicio,
         'data_fim': data_fim,
         'turno': turno,
         'nivel': nivel,
+        'dias_letivos': dias_letivos,
+        'chamadas_esperadas': esperadas,
         'resumo': {
             'total_turmas': len(turmas_resultado),
             'total_alunos': total_alunos_geral,
@@ -1880,9 +4485,241 @@ def monitoramento():
             'total_faltas': total_faltas_geral,
         },
         'turmas': turmas_resultado,
-        'alunos_criticos': criticos[:50],
+        'alunos_criticos': criticos,
         'freq_diaria': freq_diaria,
         'freq_por_periodo': freq_por_periodo,
+    }
+
+
+TIPOS_PERIODO = ('diario', 'semanal', 'mensal', 'bimestral', 'anual')
+
+
+def _calcular_monitoramento_periodos(turno, nivel, data_ref):
+    """Os cinco períodos do monitoramento para um turno/nível/data_ref →
+    (dict, status HTTP). Cada leitura percorre uma vez a faixa que cobre
+    todas as janelas e separa os períodos com agregação condicional."""
+    janelas = {p: _calcular_periodo_datas(p, data_ref or None) for p in TIPOS_PERIODO}
+    inicio = min(ini for ini, _ in janelas.values())
+    fim = max(f for _, f in janelas.values())
+
+    turmas_filtro = _turmas_do_filtro(turno, nivel)
+    if not turmas_filtro:
+        return {'erro': 'Nenhuma turma para o filtro selecionado'}, 400
+
+    turma_map = _obter_turma_ids(turmas_filtro)
+    if not turma_map:
+        return {'periodos': {
+            p: _monitoramento_vazio(p, ini, f, turno, nivel) for p, (ini, f) in janelas.items()
+        }}, 200
+
+    turma_ids = list(turma_map.values())
+    placeholders_ids = ','.join(['?' for _ in turma_ids])
+    alunos_map = _alunos_por_turma(turma_ids)
+
+    def somas(colunas, soma_linhas=False, data='data'):
+        """SUM(CASE ...) por período para cada coluna → (SQL, parâmetros)."""
+        partes, params = [], []
+        for p, (ini, f) in janelas.items():
+            if soma_linhas:
+                partes.append(f"SUM(CASE WHEN {data} >= ? AND {data} <= ? THEN 1 ELSE 0 END) AS dias_{p}")
+                params += [ini, f]
+            for col, expr in colunas:
+                partes.append(f"SUM(CASE WHEN {data} >= ? AND {data} <= ? THEN {expr} ELSE 0 END) AS {col}_{p}")
+                params += [ini, f]
+        return ',\n'.join(partes), params
+
+    # Frequência por turma nos cinco períodos
+    sql_somas, params_somas = somas(
+        [('presencas', 'presencas'), ('faltas', 'faltas')], soma_linhas=True)
+    freq_turma = query(f"""
+        SELECT turma_id, {sql_somas}
+        FROM frequencia_diaria
+        WHERE turma_id IN ({placeholders_ids}) AND data >= ? AND data <= ?
+        GROUP BY turma_id
+    """, params_somas + turma_ids + [inicio, fim])
+
+    # Série diária da faixa toda (cada período usa a sua fatia)
+    serie = query(f"""
+        SELECT data, SUM(total) AS total, SUM(presencas) AS presencas
+        FROM frequencia_diaria
+        WHERE turma_id IN ({placeholders_ids}) AND data >= ? AND data <= ?
+        GROUP BY data
+        ORDER BY data
+    """, turma_ids + [inicio, fim])
+
+    # Presença por aluno nos cinco períodos (base das listas de críticos)
+    sql_somas, params_somas = somas(
+        [('total', '1'), ('presencas', '(f.presente = 1)'), ('faltas', '(f.presente = 0)')],
+        data='f.data')
+    por_aluno = query(f"""
+        SELECT a.id, a.nome, a.ra, t.nome AS turma_nome, {sql_somas}
+        FROM alunos a
+        JOIN turmas t ON t.id = a.turma_id
+        JOIN frequencia f ON f.aluno_id = a.id AND f.data >= ? AND f.data <= ?
+        WHERE a.ativo = 1 AND a.turma_id IN ({placeholders_ids})
+        GROUP BY a.id, a.nome, a.ra, t.nome
+    """, params_somas + [inicio, fim] + turma_ids)
+
+    periodos = {}
+    for p, (ini, f) in janelas.items():
+        freq_map = {
+            r['turma_id']: {
+                'dias_registrados': r[f'dias_{p}'],
+                'presencas': r[f'presencas_{p}'],
+                'faltas': r[f'faltas_{p}'],
+            }
+            for r in freq_turma if r[f'dias_{p}']
+        }
+        criticos = []
+        for ac in por_aluno:
+            total = ac[f'total_{p}']
+            if total and ac[f'presencas_{p}'] * 100.0 / total < ALUNOS_CRITICOS_CORTE:
+                criticos.append(ac)
+        criticos.sort(key=lambda ac: (ac[f'presencas_{p}'] / ac[f'total_{p}'], ac['id']))
+        criticos = [{
+            'id': ac['id'],
+            'nome': ac['nome'],
+            'ra': ac['ra'],
+            'turma': ac['turma_nome'],
+            'presencas': ac[f'presencas_{p}'],
+            'faltas': ac[f'faltas_{p}'],
+            'total_dias': ac[f'total_{p}'],
+            'percentual': round((ac[f'presencas_{p}'] / ac[f'total_{p}'] * 100), 1),
+        } for ac in criticos[:ALUNOS_CRITICOS_LIMITE]]
+        freq_diaria = [dict(d) for d in serie if ini <= d['data'] <= f]
+        periodos[p] = _montar_monitoramento(
+            p, ini, f, turno, nivel,
+            turmas_filtro, turma_map, alunos_map, freq_map, criticos, freq_diaria,
+        )
+    return {'periodos': periodos}, 200
+
+
+@app.route('/api/monitoramento/periodos', methods=['GET'])
+@resposta_condicional(_versao_banco)
+def monitoramento_periodos():
+    """
+    Os cinco períodos (diario, semanal, mensal, bimestral, anual) de uma vez,
+    cada um no mesmo formato de /api/monitoramento. Permite trocar de aba no
+    painel sem nova requisição.
+    Params: turno, nivel, data_ref (como em /api/monitoramento)
+    """
+    _, turno, nivel, data_ref = _filtro_monitoramento(request.args)
+
+    def escopo(payload):
+        janelas = [_escopo_monitoramento(p) for p in payload['periodos'].values()]
+        return ({tid for turmas, _, _ in janelas for tid in turmas},
+                min(ini for _, ini, _ in janelas), max(fim for _, _, fim in janelas))
+
+    payload, status = _cache_monitor_obter(
+        ('periodos', turno, nivel, data_ref or date.today().isoformat()),
+        lambda: _calcular_monitoramento_periodos(turno, nivel, data_ref),
+        escopo,
+    )
+    return jsonify(payload), status
+
+
+# ── Stream SSE do monitoramento ─────────────────────────────
+# Cada tela abre GET /api/monitoramento/stream com seu filtro e recebe um
+# evento "snapshot" com o payload completo e, depois, eventos "delta" só com
+# as chaves que mudaram. Telas com o mesmo filtro compartilham o mesmo cálculo
+# (um snapshot por filtro e versão dos dados). Escritas deste processo acordam
+# as conexões na hora; escritas de outras instâncias são percebidas pela
+# versão dos dados a cada MONITOR_STREAM_INTERVALO segundos.
+# Requer servidor com threads (servidor de dev do Flask, gunicorn --threads,
+# waitress...): cada tela conectada ocupa uma thread. Cada conexão dura no
+# máximo MONITOR_STREAM_DURACAO segundos (o navegador reconecta sozinho); em
+# funções serverless (Vercel) o stream fica desligado e a tela faz polling,
+# em vez de segurar a função aberta até o limite da plataforma.
+
+MONITOR_STREAM_INTERVALO = float(os.environ.get('MONITOR_STREAM_INTERVALO', '5'))
+MONITOR_STREAM_DURACAO = float(os.environ.get('MONITOR_STREAM_DURACAO', '300'))
+MONITOR_STREAM = os.environ.get('MONITOR_STREAM',
+                                '0' if os.environ.get('VERCEL') else '1') == '1'
+
+_monitor_hub = {
+    'cond': threading.Condition(),
+    'seq': 0,              # incrementado a cada escrita local
+    'snapshots': {},       # filtro → (chave_versao, payload, status)
+    'assinantes': {},      # filtro → nº de telas conectadas
+    'travas': {},          # filtro → Lock (um cálculo por filtro por vez)
+}
+
+
+def _notificar_monitor():
+    """Acorda os streams conectados (chamado após escritas)."""
+    with _monitor_hub['cond']:
+        _monitor_hub['seq'] += 1
+        _monitor_hub['cond'].notify_all()
+
+
+def _snapshot_monitor(filtro):
+    """Payload atual do filtro, calculado uma vez por versão dos dados."""
+    chave = _versao_banco()[0]
+    with _monitor_hub['cond']:
+        trava = _monitor_hub['travas'].setdefault(filtro, threading.Lock())
+    with trava:
+        atual = _monitor_hub['snapshots'].get(filtro)
+        if atual and atual[0] == chave:
+            return atual
+        payload, status = _obter_monitoramento(filtro)
+        atual = (chave, payload, status)
+        _monitor_hub['snapshots'][filtro] = atual
+        return atual
+
+
+def _evento_sse(evento, dados):
+    return f"event: {evento}\ndata: {json.dumps(dados, ensure_ascii=False)}\n\n"
+
+
+@app.route('/api/monitoramento/stream', methods=['GET'])
+def monitoramento_stream():
+    """Server-Sent Events do monitoramento (mesmos parâmetros de /api/monitoramento).
+    Com o stream desligado responde 204: o EventSource desiste e a tela segue no polling."""
+    if not MONITOR_STREAM:
+        return '', 204
+    filtro = _filtro_monitoramento(request.args)
+    hub = _monitor_hub
+
+    def gerar():
+        with hub['cond']:
+            hub['assinantes'][filtro] = hub['assinantes'].get(filtro, 0) + 1
+        enviado = None
+        chave_enviada = None
+        try:
+            yield f"retry: {int(MONITOR_STREAM_INTERVALO * 1000)}\n\n"
+            limite = time.monotonic() + MONITOR_STREAM_DURACAO if MONITOR_STREAM_DURACAO > 0 else None
+            while limite is None or time.monotonic() < limite:
+                seq = hub['seq']
+                chave, payload, status = _snapshot_monitor(filtro)
+                if chave != chave_enviada:
+                    if status != 200:
+                        yield _evento_sse('erro', payload)
+                    elif enviado is None:
+                        yield _evento_sse('snapshot', payload)
+                    else:
+                        delta = {k: v for k, v in payload.items() if enviado.get(k) != v}
+                        if delta:
+                            yield _evento_sse('delta', delta)
+                    enviado, chave_enviada = payload, chave
+                with hub['cond']:
+                    if hub['seq'] == seq:
+                        espera = MONITOR_STREAM_INTERVALO
+                        if limite is not None:
+                            espera = max(0.0, min(espera, limite - time.monotonic()))
+                        hub['cond'].wait(espera)
+                yield ": ping\n\n"  # mantém a conexão e detecta tela desconectada
+        finally:
+            with hub['cond']:
+                hub['assinantes'][filtro] -= 1
+                if not hub['assinantes'][filtro]:
+                    # Ninguém mais olhando este filtro: libera o snapshot
+                    del hub['assinantes'][filtro]
+                    hub['snapshots'].pop(filtro, None)
+                    hub['travas'].pop(filtro, None)
+
+    return Response(gerar(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
     })
 
 
@@ -1892,11 +4729,21 @@ def monitoramento_turma_detalhe(tid):
     tipo_periodo = request.args.get('periodo', 'mensal')
     data_ref = request.args.get('data_ref', '')
 
+    payload, status = _cache_monitor_obter(
+        ('turma', tid, tipo_periodo, data_ref or date.today().isoformat()),
+        lambda: _calcular_monitoramento_turma(tid, tipo_periodo, data_ref),
+        lambda p: ([tid], p['data_inicio'], p['data_fim']),
+    )
+    return jsonify(payload), status
+
+
+def _calcular_monitoramento_turma(tid, tipo_periodo, data_ref):
+    """Payload do detalhe de uma turma → (dict, status HTTP)."""
     data_inicio, data_fim = _calcular_periodo_datas(tipo_periodo, data_ref or None)
 
     turma_info = query("SELECT * FROM turmas WHERE id = ?", [tid])
     if not turma_info:
-        return jsonify({'erro': 'Turma não encontrada'}), 404
+        return {'erro': 'Turma não encontrada'}, 404
 
     alunos = query("""
         SELECT a.id, a.nome, a.ra, a.numero_chamada,
@@ -1915,13 +4762,15 @@ def monitoramento_turma_detalhe(tid):
         pres = a['presencas'] or 0
         a['percentual'] = round((pres / total * 100), 1) if total > 0 else 0
 
-    return jsonify({
+    return {
         'turma': turma_info[0],
         'periodo': tipo_periodo,
         'data_inicio': data_inicio,
         'data_fim': data_fim,
+        'dias_letivos': dias_letivos_entre(data_inicio, data_fim),
+        'chamadas_esperadas': dias_letivos_entre(data_inicio, min(data_fim, date.today().isoformat())),
         'alunos': alunos,
-    })
+    }, 200
 
 
 # ============================================================
@@ -1938,10 +4787,34 @@ def health():
     return jsonify({
         'status': 'ok' if db_ok else 'erro_db',
         'db': 'turso' if USE_TURSO else 'sqlite_local',
+        'pool': {**_pool_stats, 'ociosas': len(_pool), 'max': DB_POOL_MAX},
+        'replica': {
+            'ativa': USE_REPLICA,
+            'defasagem_s': round(time.monotonic() - _replica_estado['ultima_sync'], 1) if _replica_estado['syncs'] else None,
+            'syncs': _replica_estado['syncs'],
+            'falhas': _replica_estado['falhas'],
+            'leituras': _replica_estado['leituras'],
+        },
+        'cache_monitoramento': {
+            **_cache_monitor_stats,
+            'itens': len(_cache_monitor['itens']),
+            'max': MONITOR_CACHE_MAX,
+            'ttl_s': MONITOR_CACHE_TTL,
+        },
         'timestamp': datetime.now().isoformat(),
     })
 
 
+@app.route('/api/replica/sincronizar', methods=['POST'])
+def replica_sincronizar():
+    """Força a sincronização da réplica embutida com o primário."""
+    if not USE_REPLICA:
+        return jsonify({'erro': 'Réplica embutida não configurada (TURSO_REPLICA_PATH)'}), 400
+    if not sincronizar_replica(forcar=True):
+        return jsonify({'erro': 'Falha ao sincronizar a réplica'}), 502
+    return jsonify({'ok': True, 'syncs': _replica_estado['syncs']})
+
+
 # ============================================================
 # ALERTAS WHATSAPP — Painel de frequência + telefones
 # ============================================================
@@ -1950,21 +4823,13 @@ def _load_alunos_csv():
     """Carrega dados_alunos.csv e retorna lista de dicts com nome, turma, responsável, telefones."""
     alunos = []
     try:
-        # Tentar múltiplos encodings — dados_alunos.csv frequentemente é latin-1
-        content = None
-        for enc in ['utf-8-sig', 'utf-8', 'latin-1', 'cp1252', 'iso-8859-1']:
-            try:
-                with open(CSV_ALUNOS_PATH, 'r', encoding=enc) as f:
-                    content = f.read()
-                break
-            except (UnicodeDecodeError, UnicodeError):
-                continue
+        # Encoding/separador pelo início do arquivo — dados_alunos.csv frequentemente é latin-1
+        with open(CSV_ALUNOS_PATH, 'rb') as f:
+            encoding, sep = detectar_formato_csv(f.read(CSV_AMOSTRA_BYTES))
+        with open(CSV_ALUNOS_PATH, 'r', encoding=encoding, errors='replace', newline='') as f:
+            content = f.read()
 
-        if content is None:
-            print("Erro: não foi possível decodificar dados_alunos.csv")
-            return alunos
-
-        reader = csv.DictReader(io.StringIO(content), delimiter=';')
+        reader = csv.DictReader(io.StringIO(content), delimiter=sep)
         for row in reader:
                 turma_raw = (row.get('série/ano') or row.get('s\u00e9rie/ano') or row.get('serie/ano') or '').strip()
                 nome = (row.get('nome') or row.get('Nome') or '').strip()
@@ -2039,6 +4904,7 @@ def _classificar_turma_periodo(turma_short):
 
 
 @app.route('/api/alertas-frequencia', methods=['GET'])
+@resposta_condicional(lambda: _versao_arquivos(CSV_FREQ_PATH, CSV_ALUNOS_PATH))
 def alertas_frequencia():
     """
     Retorna dados para o painel de alertas WhatsApp.
@@ -2203,10 +5069,30 @@ def serve_static(filepath):
         return send_from_directory(STATIC_DIR, 'index.html')
 
 
+# ============================================================
+# INICIALIZAÇÃO
+# ============================================================
+
+# Inicializar banco na primeira carga (no fim do módulo: a migração em
+# segundo plano usa funções e estados definidos acima)
+if not PROCESSO_AUXILIAR:
+    init_db()
+
+
 # ============================================================
 # DEVELOPMENT SERVER
 # ============================================================
 
 if __name__ == '__main__':
+    import sys
+    if sys.argv[1:] == ['migrar']:
+        print(f"Migrações aplicadas: {aplicar_migracoes() or 'nenhuma'}")
+        sys.exit(0)
+    if sys.argv[1:] == ['importar-worker']:
+        # Worker dedicado da fila de importações (deploys serverless)
+        _schema_pronto.wait()
+        while True:
+            _executar_fila_importacao()
+            time.sleep(IMPORTAR_JOB_OCIOSO)
     port = int(os.environ.get('PORT', 5000))
     app.run(host='0.0.0.0', port=port, debug=True)
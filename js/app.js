@@ -11,6 +11,11 @@ let freqCalendario = {};
 let dataChamadaAtual = '';
 let nivelAcesso = null; // 'admin' | 'frequencia'
 let monitorInterval = null;
+let monitorStream = null;      // EventSource de /api/monitoramento/stream
+let monitorStreamParams = '';
+let monitorStreamRecusado = ''; // filtro cujo stream respondeu 'erro' (fica no polling)
+let monitorUltimo = { data: null, csvData: null };
+let monitorPeriodos = { chave: '', periodos: null }; // os 5 períodos do último filtro
 let monitorPeriodoAtual = 'diario';
 let monitorAnimating = false;
 
@@ -78,6 +83,22 @@ async function apiUpload(endpoint, formData) {
   return data;
 }
 
+// Importação: o servidor decide pelo tamanho (IMPORTAR_STREAM_BYTES) se grava na
+// hora ou põe o arquivo na fila; com job na fila, acompanha até terminar
+async function apiImportar(formData, onProgresso) {
+  const job = await apiUpload('/api/importar?modo=auto', formData);
+  if (!job.job_id) return job;  // importado na hora, ou arquivo idêntico ao já importado
+  for (;;) {
+    await new Promise(r => setTimeout(r, 1500));
+    const res = await fetch(job.status_url);
+    const st = await res.json();
+    if (!res.ok) throw new Error(st.erro || 'Erro ao consultar importação');
+    if (st.status === 'erro') throw new Error(st.erro || 'Erro na importação');
+    if (st.status === 'concluida') return st;
+    if (onProgresso) onProgresso(st);
+  }
+}
+
 // Animated counter
 function animateCounter(el, target, suffix = '') {
   const start = parseInt(el.textContent) || 0;
@@ -227,6 +248,7 @@ document.getElementById('btn-logout')?.addEventListener('click', () => {
   sessionStorage.removeItem('dalmaso_nivel');
   nivelAcesso = null;
   if (monitorInterval) clearInterval(monitorInterval);
+  fecharMonitorStream();
   document.getElementById('login-screen').style.display = '';
   document.getElementById('wrapper').style.display = 'none';
   document.getElementById('wrapper').style.cssText = 'display:none !important;';
@@ -293,7 +315,8 @@ function initMonitor() {
       document.querySelectorAll('.monitor-tab').forEach(t => t.classList.remove('active'));
       tab.classList.add('active');
       monitorPeriodoAtual = tab.dataset.periodo;
-      loadMonitorData();
+      // Troca de aba instantânea: os cinco períodos já vieram juntos
+      if (!mostrarPeriodoEmCache()) loadMonitorData();
     });
   });
 
@@ -322,11 +345,13 @@ function initMonitor() {
     });
   });
 
-  // Auto-refresh a cada 15 segundos (monitor 24h alive)
+  // Auto-refresh a cada 15 segundos (monitor 24h alive). Com o stream SSE
+  // aberto as atualizações chegam por push; o polling fica como fallback.
   if (monitorInterval) clearInterval(monitorInterval);
   monitorInterval = setInterval(() => {
     const monPage = document.getElementById('page-monitoramento');
-    if (monPage && monPage.classList.contains('active')) {
+    const streamAberto = monitorStream && monitorStream.readyState === EventSource.OPEN;
+    if (monPage && monPage.classList.contains('active') && !streamAberto) {
       loadMonitorData(true); // silent refresh
     }
   }, 15000);
@@ -380,20 +405,90 @@ async function loadMonitorData(silent = false) {
   const nivel = document.getElementById('filtro-nivel')?.value || 'todos';
   const dataRef = document.getElementById('filtro-data-ref')?.value || '';
 
-  const params = new URLSearchParams({
-    periodo: monitorPeriodoAtual,
-    turno,
-    nivel,
-    data_ref: dataRef,
-  });
+  const filtro = new URLSearchParams({ turno, nivel, data_ref: dataRef });
 
   try {
-    // Carregar dados do monitoramento principal E CSV em paralelo
-    const [data, csvData] = await Promise.all([
-      fetch(`/api/monitoramento?${params}`).then(r => r.json()).catch(() => null),
+    // Carregar os cinco períodos do monitoramento (uma requisição) E CSV em paralelo
+    const [todos, csvData] = await Promise.all([
+      fetch(`/api/monitoramento/periodos?${filtro}`).then(r => r.json()).catch(() => null),
       fetch(`/api/frequencia-csv?turno=${turno}&nivel=${nivel}`).then(r => r.json()).catch(() => null),
     ]);
 
+    monitorPeriodos = { chave: filtro.toString(), periodos: todos?.periodos || null };
+    const data = monitorPeriodos.periodos ? monitorPeriodos.periodos[monitorPeriodoAtual] : todos;
+    const params = new URLSearchParams({ periodo: monitorPeriodoAtual, turno, nivel, data_ref: dataRef });
+
+    monitorUltimo = { data, csvData };
+    renderMonitorData(data, csvData);
+    conectarMonitorStream(params.toString());
+  } catch (err) {
+    if (!silent) console.error('Monitor error:', err);
+  }
+}
+
+// Renderiza o período atual a partir dos cinco já carregados (false se o
+// filtro mudou desde a última carga).
+function mostrarPeriodoEmCache() {
+  const turno = document.getElementById('filtro-turno')?.value || 'todos';
+  const nivel = document.getElementById('filtro-nivel')?.value || 'todos';
+  const dataRef = document.getElementById('filtro-data-ref')?.value || '';
+  const filtro = new URLSearchParams({ turno, nivel, data_ref: dataRef });
+  const data = monitorPeriodos.periodos?.[monitorPeriodoAtual];
+  if (monitorPeriodos.chave !== filtro.toString() || !data) return false;
+
+  monitorUltimo.data = data;
+  renderMonitorData(data, monitorUltimo.csvData);
+  conectarMonitorStream(new URLSearchParams({ periodo: monitorPeriodoAtual, turno, nivel, data_ref: dataRef }).toString());
+  return true;
+}
+
+// ── Push do monitoramento (Server-Sent Events) ──
+// O servidor manda um 'snapshot' ao conectar e depois só as chaves que
+// mudaram ('delta') a cada gravação de frequência, ou 'erro' se não consegue
+// montar o monitoramento desse filtro.
+function conectarMonitorStream(params) {
+  if (typeof EventSource === 'undefined') return;
+  if (monitorStream && monitorStreamParams === params && monitorStream.readyState !== EventSource.CLOSED) return;
+  fecharMonitorStream();
+  if (params === monitorStreamRecusado) return;
+
+  monitorStreamParams = params;
+  monitorStream = new EventSource(`/api/monitoramento/stream?${params}`);
+  const periodo = new URLSearchParams(params).get('periodo');
+  const guardar = data => {
+    monitorUltimo.data = data;
+    if (monitorPeriodos.periodos) monitorPeriodos.periodos[periodo] = data;
+    renderMonitorData(data, monitorUltimo.csvData);
+  };
+  monitorStream.addEventListener('snapshot', ev => guardar(JSON.parse(ev.data)));
+  monitorStream.addEventListener('delta', ev => {
+    guardar(Object.assign({}, monitorUltimo.data || {}, JSON.parse(ev.data)));
+  });
+  // Sem fechar, o EventSource seguiria aberto (e o polling parado) sem dados:
+  // encerra o stream deste filtro e volta ao polling
+  monitorStream.addEventListener('erro', () => {
+    fecharMonitorStream();
+    monitorStreamRecusado = params;
+    loadMonitorData(true);
+  });
+  // Fim normal de uma conexão (duração máxima) reconecta sozinho; CLOSED é
+  // recusa definitiva (204 com o stream desligado no servidor): fica no polling
+  const stream = monitorStream;
+  stream.addEventListener('error', () => {
+    if (stream !== monitorStream || stream.readyState !== EventSource.CLOSED) return;
+    fecharMonitorStream();
+    monitorStreamRecusado = params;
+  });
+}
+
+function fecharMonitorStream() {
+  if (monitorStream) monitorStream.close();
+  monitorStream = null;
+  monitorStreamParams = '';
+}
+
+function renderMonitorData(data, csvData) {
+  try {
     // Decidir fonte de dados: CSV tem prioridade se monitoramento não tem dados
     const usarCSV = csvData && !csvData.erro && csvData.turmas && csvData.turmas.length > 0;
     const monOk = data && !data.erro && data.turmas && data.turmas.length > 0;
@@ -500,7 +595,7 @@ async function loadMonitorData(silent = false) {
     if (ultimaAtt) ultimaAtt.textContent = `Atualizado: ${agora()}`;
 
   } catch (err) {
-    if (!silent) console.error('Monitor error:', err);
+    console.error('Monitor error:', err);
   }
 }
 
@@ -1194,7 +1289,7 @@ window.abrirChamada = async function(dateStr) {
   document.getElementById('page-chamada').classList.add('active');
 
   try {
-    const alunos = await api(`/api/alunos?turma_id=${turmaAtual.id}`);
+    const alunos = await api(`/api/alunos?turma_id=${turmaAtual.id}&fields=id,nome,ra`);
     if (!alunos.length) {
       document.getElementById('corpo-tabela-chamada').innerHTML =
         '<tr><td colspan="5" class="text-center text-muted py-4">Nenhum aluno nesta turma.</td></tr>';
@@ -1350,30 +1445,13 @@ async function popularSelects() {
 // ============================================================
 // ALUNOS
 // ============================================================
-async function loadAlunos() {
-  await popularSelects();
-  const turmaId = document.getElementById('filtro-turma-alunos')?.value;
-  const busca = document.getElementById('busca-alunos')?.value?.trim() || '';
-  let url = '/api/alunos?';
-  if (turmaId) url += `turma_id=${turmaId}&`;
-  if (busca) url += `busca=${encodeURIComponent(busca)}&`;
-
-  try {
-    const alunos = await api(url);
-    const tbody = document.getElementById('corpo-tabela-alunos');
-    const vazio = document.getElementById('alunos-vazio');
-
-    if (!alunos.length) {
-      tbody.innerHTML = '';
-      if (vazio) vazio.style.display = 'block';
-      return;
-    }
-    if (vazio) vazio.style.display = 'none';
+const ALUNOS_CAMPOS_LISTA = 'id,nome,ra,turma_id,data_nascimento,sexo';
+let alunosCarga = 0;  // listagem em andamento (uma nova busca interrompe a anterior)
 
-    tbody.innerHTML = alunos.map((a, i) => {
-      const turma = turmasCache.find(t => t.id === a.turma_id);
-      return `<tr style="cursor:pointer;" onclick="verAluno(${a.id})">
-        <td>${i + 1}</td>
+function linhaAluno(a, n) {
+  const turma = turmasCache.find(t => t.id === a.turma_id);
+  return `<tr style="cursor:pointer;" onclick="verAluno(${a.id})">
+        <td>${n}</td>
         <td><strong>${a.nome}</strong></td>
         <td>${a.ra || '-'}</td>
         <td><span class="badge bg-primary">${turma ? turma.nome : '-'}</span></td>
@@ -1384,7 +1462,39 @@ async function loadAlunos() {
           <button class="btn btn-sm btn-outline-danger" onclick="event.stopPropagation(); deletarAluno(${a.id}, '${a.nome.replace(/'/g, "\\'")}')" title="Excluir"><i class="bi bi-trash"></i></button>
         </td>
       </tr>`;
-    }).join('');
+}
+
+async function loadAlunos() {
+  await popularSelects();
+  const carga = ++alunosCarga;
+  const turmaId = document.getElementById('filtro-turma-alunos')?.value;
+  const busca = document.getElementById('busca-alunos')?.value?.trim() || '';
+  // Só as colunas da tabela, em páginas: a primeira aparece logo e as demais vão sendo anexadas
+  const params = new URLSearchParams({ fields: ALUNOS_CAMPOS_LISTA, limite: 200 });
+  if (turmaId) params.set('turma_id', turmaId);
+  if (busca) params.set('busca', busca);
+
+  try {
+    const tbody = document.getElementById('corpo-tabela-alunos');
+    const vazio = document.getElementById('alunos-vazio');
+    let cursor = null;
+    let n = 0;
+    do {
+      if (cursor) params.set('cursor', cursor);
+      const pagina = await api(`/api/alunos?${params}`);
+      if (carga !== alunosCarga) return;
+
+      if (!cursor) {
+        tbody.innerHTML = '';
+        if (!pagina.alunos.length) {
+          if (vazio) vazio.style.display = 'block';
+          return;
+        }
+        if (vazio) vazio.style.display = 'none';
+      }
+      tbody.insertAdjacentHTML('beforeend', pagina.alunos.map(a => linhaAluno(a, ++n)).join(''));
+      cursor = pagina.proximo_cursor;
+    } while (cursor);
   } catch (err) { console.error(err); }
 }
 
@@ -1393,7 +1503,7 @@ document.getElementById('filtro-turma-alunos')?.addEventListener('change', loadA
 let buscaTimeout;
 document.getElementById('busca-alunos')?.addEventListener('input', () => {
   clearTimeout(buscaTimeout);
-  buscaTimeout = setTimeout(loadAlunos, 400);
+  buscaTimeout = setTimeout(loadAlunos, 250);
 });
 
 // Ver detalhe
@@ -1683,14 +1793,31 @@ document.getElementById('btn-importar')?.addEventListener('click', async () => {
 
   progresso.style.display = 'block';
   resultado.innerHTML = '';
+  const progressoTexto = progresso.querySelector('small');
+  if (progressoTexto) progressoTexto.textContent = 'Processando arquivo...';
 
   try {
-    const data = await apiUpload('/api/importar', formData);
+    // Arquivos grandes: importação em segundo plano, com progresso e tempo restante
+    const zip = fileInput.files[0].name.toLowerCase().endsWith('.zip');
+    const data = zip
+      ? await apiUpload('/api/importar/zip', formData)
+      : await apiImportar(formData, st => {
+          if (!progressoTexto) return;
+          const pct = st.percentual != null ? ` (${st.percentual}%)` : '';
+          const eta = st.eta_segundos != null ? ` — cerca de ${st.eta_segundos}s restante(s)` : '';
+          // Pendente com linhas gravadas: pausado entre duas consultas de status
+          progressoTexto.textContent = st.status === 'pendente' && !st.linhas_processadas
+            ? 'Na fila de importação...'
+            : `${st.linhas_processadas} linha(s) processada(s)${pct}${eta}`;
+        });
     progresso.style.display = 'none';
     resultado.innerHTML = `
       <div class="alert alert-success">
         <strong><i class="bi bi-check-circle"></i> Importação concluída!</strong><br>
-        ${data.total_importados} aluno(s) importado(s) de ${data.total_linhas_arquivo} linha(s).<br>
+        ${data.total_importados} aluno(s) importado(s) de ${data.total_linhas_arquivo} linha(s)${data.arquivos ? ` em ${data.arquivos.length} arquivo(s)` : ''}.<br>
+        ${data.arquivo_repetido
+          ? 'Arquivo idêntico ao já importado — nenhuma alteração.<br>'
+          : `${data.inseridos} novo(s), ${data.atualizados} alterado(s), ${data.inalterados || 0} sem alteração.<br>`}
         ${data.turmas_criadas ? `${data.turmas_criadas} turma(s) criada(s).` : ''}
       </div>
     `;
@@ -0,0 +1,85 @@
+"""
+Benchmark da importação de alunos (POST /api/importar).
+
+Importa o dados_alunos.csv do repositório duas vezes em um banco SQLite
+temporário — carga inicial (inserções) e reimportação (atualizações) — e
+mostra o tempo e o número de idas ao banco de cada rodada.
+
+Uso:
+    python scripts/benchmark_importar.py [arquivo.csv|arquivo.xlsx] [--rodadas N]
+"""
+
+import argparse
+import importlib.util
+import io
+import os
+import sys
+import tempfile
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def carregar_app(pasta):
+    """Carrega api/index.py apontando para um SQLite local em `pasta`."""
+    # Nunca tocar o banco real: sem Turso e sem réplica
+    for var in ('TURSO_DATABASE_URL', 'TURSO_AUTH_TOKEN', 'TURSO_REPLICA_PATH'):
+        os.environ.pop(var, None)
+    os.chdir(pasta)
+    spec = importlib.util.spec_from_file_location('index', os.path.join(RAIZ, 'api', 'index.py'))
+    modulo = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(modulo)
+    modulo._schema_pronto.wait()
+    return modulo
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('arquivo', nargs='?', default=os.path.join(RAIZ, 'dados_alunos.csv'))
+    parser.add_argument('--rodadas', type=int, default=3)
+    args = parser.parse_args()
+
+    arquivo = os.path.abspath(args.arquivo)
+    with open(arquivo, 'rb') as f:
+        dados = f.read()
+
+    with tempfile.TemporaryDirectory() as pasta:
+        index = carregar_app(pasta)
+        cliente = index.app.test_client()
+
+        # Conta as idas ao banco (cada query/execute/lote passa por _com_conexao)
+        idas = [0]
+        original = index._com_conexao
+
+        def contar(operacao):
+            idas[0] += 1
+            return original(operacao)
+
+        index._com_conexao = contar
+
+        print(f'Arquivo: {os.path.basename(arquivo)} ({len(dados) / 1024:.0f} KiB)')
+        for rodada in range(1, args.rodadas + 1):
+            for etapa in ('carga inicial', 'reimportação'):
+                if etapa == 'carga inicial':
+                    index.execute_many([("DELETE FROM alunos", []), ("DELETE FROM turmas", [])])
+                idas[0] = 0
+                inicio = time.perf_counter()
+                resp = cliente.post('/api/importar', data={
+                    'arquivo': (io.BytesIO(dados), os.path.basename(arquivo)),
+                }, content_type='multipart/form-data')
+                decorrido = time.perf_counter() - inicio
+                corpo = resp.get_json()
+                if resp.status_code != 200:
+                    print(f'  falhou ({resp.status_code}): {corpo}')
+                    return 1
+                print(f'  rodada {rodada} · {etapa:<14} {decorrido * 1000:8.1f} ms  '
+                      f'{idas[0]:5d} idas ao banco  '
+                      f"inseridos={corpo.get('inseridos')} atualizados={corpo.get('atualizados')} "
+                      f"inalterados={corpo.get('inalterados')} "
+                      f"linhas={corpo.get('total_linhas_arquivo')}")
+        index._com_conexao = original
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())